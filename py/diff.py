@@ -3,69 +3,255 @@
 
 import tarfile
 import hashlib
+import os
+import posixpath
+import sqlite3
 import tempfile
 import typer
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict
-import shutil
-import os
+from typing import Callable, Iterator, List, Optional, Set, Tuple
 from qutil.log.log import setup_logger
+from qutil.diffdir.cache import HashCache
+from qutil.diffdir.diff import hash_fileobj, iter_files_sha256
+from qutil.diffdir.table import merge_sorted
 from loguru import logger
 from rich.table import Table
 from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
 
 app = typer.Typer()
 
 def sha256sum(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
-def extract_tar_to_temp(tar_path: Path) -> Path:
-    """Extract a tar file to a temporary directory."""
-    temp_dir = tempfile.mkdtemp(prefix=f"{tar_path.stem}_")
-    logger.info(f"Extracting tar file: {tar_path} to {temp_dir}")
-    with tarfile.open(tar_path, 'r') as tar:
-        tar.extractall(temp_dir)
-    return Path(temp_dir)
+# pending HashStore rows are written to SQLite in batches of this size
+STORE_FLUSH_EVERY = 10_000
+
+# zstd frame magic, tarfile only detects gz/bz2/xz by itself before python 3.14
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+@contextmanager
+def open_tar_stream(tar_path: Path):
+    """Open a (possibly gz/bz2/xz/zst compressed) tar file for a single sequential pass, without seeking."""
+    with open(tar_path, 'rb') as raw:
+        is_zstd = raw.read(4) == ZSTD_MAGIC
+        raw.seek(0)
+        if is_zstd and "zst" not in tarfile.TarFile.OPEN_METH:
+            try:
+                import zstandard
+            except ImportError:
+                raise tarfile.ReadError(f"{tar_path} is zstd compressed, install 'zstandard' to read it")
+            with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    yield tar
+        else:
+            with tarfile.open(fileobj=raw, mode='r|*') as tar:
+                yield tar
+
 
 def is_tar_extractable(path: Path) -> bool:
     """Check if the file is a valid tar file."""
     try:
-        with tarfile.open(path, 'r') as tar:
+        with open_tar_stream(path) as tar:
+            tar.next()
             return True
     except (tarfile.TarError, OSError):
-        return False  
-  
-def get_dir_file_hashes(dir_path: Path, ignore_top_folder: bool = False) -> Dict[str, str]:
-    """Get {relative_path: sha256 hash} for files in a directory.
+        return False
+
+
+class HashStore(MutableMapping):
+    """{relative_path: sha256 hash} of one source kept in a temporary SQLite file instead of a dict,
+    so memory use is bounded by cache_kib however many files the source has.
+    Hashes are stored as raw 32-byte digests. Iterating yields paths in sorted order,
+    which compare() merges across sources."""
+
+    def __init__(self, db_path: Path, cache_kib: int = 64 * 1024):
+        # filled by a loader thread, read by the main thread once the loader is done
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(f"PRAGMA cache_size=-{max(cache_kib, 1024)}")
+        self.conn.execute("CREATE TABLE files (path TEXT PRIMARY KEY, digest BLOB) WITHOUT ROWID")
+        self._pending = {}
+
+    def flush(self):
+        if self._pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?)", self._pending.items())
+            self._pending.clear()
+
+    def __setitem__(self, path: str, sha: str):
+        self._pending[path] = bytes.fromhex(sha)
+        if len(self._pending) >= STORE_FLUSH_EVERY:
+            self.flush()
+
+    def __getitem__(self, path: str) -> str:
+        if path in self._pending:
+            return self._pending[path].hex()
+        row = self.conn.execute("SELECT digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            raise KeyError(path)
+        return row[0].hex()
+
+    def __delitem__(self, path: str):
+        self.flush()
+        with self.conn:
+            if self.conn.execute("DELETE FROM files WHERE path = ?", (path,)).rowcount == 0:
+                raise KeyError(path)
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        for path, _ in self.digests():
+            yield path
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for path, digest in self.digests():
+            yield path, digest.hex()
+
+    def digests(self) -> Iterator[Tuple[str, bytes]]:
+        """(path, raw digest) pairs in path order."""
+        self.flush()
+        yield from self.conn.execute("SELECT path, digest FROM files ORDER BY path")
+
+    def clear(self):
+        self._pending.clear()
+        with self.conn:
+            self.conn.execute("DELETE FROM files")
+
+    def close(self):
+        self.conn.close()
+
+
+def _scan_tar(tar_path: Path, hashes: MutableMapping, strip: Optional[str] = None,
+              on_file: Optional[Callable[[str], None]] = None) -> Set[str]:
+    """One streaming pass over tar_path, storing {name: sha256} into hashes.
+    If strip is set, only members under that top-level folder are kept, without it.
+    Returns the top-level directory names seen in the archive."""
+    top_dirs = set()
+    links = {}
+
+    def relative(name: str) -> Optional[str]:
+        if strip is None:
+            return name
+        first, _, rest = name.partition('/')
+        return rest if first == strip and rest else None
+
+    with open_tar_stream(tar_path) as tar:
+        for member in tar:
+            full_name = posixpath.normpath(member.name).lstrip('/')
+            if full_name == '.':
+                continue
+            first, sep, _ = full_name.partition('/')
+            if sep or member.isdir():
+                top_dirs.add(first)
+            name = relative(full_name)
+            if name is None:
+                continue
+            if member.isreg():
+                file_hash = hash_fileobj(tar.extractfile(member))
+                hashes[name] = file_hash
+                logger.debug("File: {}, Hash: {}", name, file_hash)
+                if on_file:
+                    on_file(name)
+            elif member.islnk():
+                links[name] = relative(posixpath.normpath(member.linkname).lstrip('/'))
+            elif member.issym():
+                target = posixpath.join(posixpath.dirname(full_name), member.linkname)
+                links[name] = relative(posixpath.normpath(target).lstrip('/'))
+
+    # hard links and symlinks hash as their target file, like they would after extraction
+    for name, target in links.items():
+        seen = {name}
+        while target in links and target not in seen:
+            seen.add(target)
+            target = links[target]
+        if target is not None and target in hashes:
+            hashes[name] = hashes[target]
+    return top_dirs
+
+
+def get_tar_file_hashes(tar_path: Path, ignore_top_folder: bool = False,
+                        hashes: Optional[MutableMapping] = None,
+                        on_file: Optional[Callable[[str], None]] = None) -> MutableMapping:
+    """Get {relative_path: sha256 hash} for the files in a tar file by streaming its members,
+    nothing is written to disk. Results go into hashes (a dict by default).
     If ignore_top_folder is True, strip the first path component."""
-    hashes = {}
+    hashes = {} if hashes is None else hashes
+    strip = None
+    if ignore_top_folder:
+        # guess the single top folder from the first member, re-read only if the guess was wrong
+        with open_tar_stream(tar_path) as tar:
+            first = tar.next()
+        if first is not None:
+            name = posixpath.normpath(first.name).lstrip('/')
+            if '/' in name or first.isdir():
+                strip = name.split('/', 1)[0]
+    top_dirs = _scan_tar(tar_path, hashes, strip=strip, on_file=on_file)
+    if ignore_top_folder:
+        expected = top_dirs.pop() if len(top_dirs) == 1 else None
+        if expected != strip:
+            logger.info(f"{tar_path} has no single top folder '{strip}', reading it again")
+            hashes.clear()
+            _scan_tar(tar_path, hashes, strip=expected, on_file=on_file)
+    return hashes
+
+
+def get_dir_file_hashes(dir_path: Path, ignore_top_folder: bool = False,
+                        cache: Optional[HashCache] = None,
+                        hashes: Optional[MutableMapping] = None,
+                        jobs: int = 1,
+                        on_file: Optional[Callable[[str], None]] = None) -> MutableMapping:
+    """Get {relative_path: sha256 hash} for files in a directory, hashed by jobs workers.
+    If ignore_top_folder is True, strip the first path component.
+    If cache is given, files whose stat matches the cache are not re-hashed.
+    Results go into hashes (a dict by default)."""
+    hashes = {} if hashes is None else hashes
     # If ignoring top folder, find the single top-level directory
     base_path = dir_path
     if ignore_top_folder:
         entries = [p for p in dir_path.iterdir() if p.is_dir()]
         if len(entries) == 1:
             base_path = entries[0]
-    for path in base_path.rglob('*'):
-        if path.is_file():
-            rel_path = path.relative_to(base_path).as_posix()
-            content = path.read_bytes()
-            hashes[rel_path] = sha256sum(content)
-            logger.debug(f"File: {rel_path}, Hash: {hashes[rel_path]}")
+    for path, file_hash in iter_files_sha256(base_path, jobs=jobs, cache=cache):
+        rel_path = path.as_posix()
+        hashes[rel_path] = file_hash
+        logger.debug("File: {}, Hash: {}", rel_path, file_hash)
+        if on_file:
+            on_file(rel_path)
     return hashes
 
+
+def get_cached_dir_file_hashes(dir_path: Path, use_cache: bool = True, **kwargs) -> MutableMapping:
+    """get_dir_file_hashes for a real (non temporary) folder, backed by its hash cache."""
+    if not use_cache:
+        return get_dir_file_hashes(dir_path, **kwargs)
+    with HashCache.for_root(dir_path) as cache:
+        hashes = get_dir_file_hashes(dir_path, cache=cache, **kwargs)
+        logger.info(f"Hash cache for {dir_path}: {cache.hits} hits, {cache.misses} misses")
+    return hashes
+
+
 @app.command()
-def show_file_hashes(source: Path):
+def show_file_hashes(
+    source: Path,
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or update the on-disk hash cache"),
+):
     """
     Show file hashes for a single folder or tar file.
-    Tar files will be extracted to a temp folder first.
+    Tar files (plain, gz, bz2, xz or zst) are streamed, not extracted.
     """
     console = Console()
     if source.is_file() and is_tar_extractable(source):
-        temp_dir = extract_tar_to_temp(source)
-        hashes = get_dir_file_hashes(temp_dir, ignore_top_folder=True)
-        shutil.rmtree(temp_dir)
+        hashes = get_tar_file_hashes(source, ignore_top_folder=True)
     elif source.is_dir():
-        hashes = get_dir_file_hashes(source)
+        hashes = get_cached_dir_file_hashes(source, use_cache=not no_cache)
     else:
         console.print(f"[yellow]⚠️ Skipping unsupported source: {source}[/yellow]")
         return
@@ -80,62 +266,99 @@ def show_file_hashes(source: Path):
     console.print(table)
 
 @app.command()
-def compare(sources: List[Path]):
+def compare(
+    sources: List[Path],
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or update the on-disk hash cache"),
+    jobs: int = typer.Option(0, help="Hashing workers per folder source, 0 shares the CPUs between them"),
+    memory_budget: int = typer.Option(512, help="Memory budget in MB for the per-source hash tables"),
+):
     """
     Compare multiple folders or tar files.
-    Tar files will be extracted to temp folders first.
+    Tar files (plain, gz, bz2, xz or zst) are streamed, not extracted.
+    All sources are loaded concurrently into on-disk hash tables.
     Only files that differ or are missing are reported.
     """
     console = Console()
     console.print(f"Comparing {len(sources)} sources...")
-    temp_dirs = []
-    content_map = {}
 
-    try:
-        for source in sources:
-            console.print(f"Processing: {source}")
-            if source.is_file() and is_tar_extractable(source):
-                temp_dir = extract_tar_to_temp(source)
-                temp_dirs.append(temp_dir)
-                content_map[source] = get_dir_file_hashes(temp_dir, ignore_top_folder=True)
-            elif source.is_dir():
-                content_map[source] = get_dir_file_hashes(source)
-            else:
-                console.print(f"[yellow]⚠️ Skipping unsupported source: {source}[/yellow]")
-
-        # Collect union of all relative file paths
-        all_files = set()
-        for hashes in content_map.values():
-            all_files.update(hashes.keys())
-
-        # Prepare rich table
-        table = Table(title="Diff or Missing Files")
-        table.add_column("File Path", style="bold")
-        for src in content_map.keys():
-            # Show only the base name of the source (ignore root folder path)
-            table.add_column(src.name, overflow="fold")
-
-        for file_path in sorted(all_files):
-            file_hashes = set()
-            row = [file_path]
-            for src, files in content_map.items():
-                h = files.get(file_path)
-                if h:
-                    row.append(h[:12])
-                    file_hashes.add(h)
+    loaders = {}
+    for source in sources:
+        if source.is_file() and is_tar_extractable(source):
+            loaders[source] = "tar"
+        elif source.is_dir():
+            loaders[source] = "dir"
+        else:
+            console.print(f"[yellow]⚠️ Skipping unsupported source: {source}[/yellow]")
+    if not loaders:
+        return
+
+    dir_count = list(loaders.values()).count("dir")
+    inner_jobs = jobs if jobs > 0 else max(1, (os.cpu_count() or 1) // max(dir_count, 1))
+    cache_kib = memory_budget * 1024 // len(loaders)
+
+    with tempfile.TemporaryDirectory(prefix="diff_") as temp_dir:
+        content_map = {
+            source: HashStore(Path(temp_dir) / f"{index}.sqlite", cache_kib=cache_kib)
+            for index, source in enumerate(loaders)
+        }
+        try:
+            progress = Progress(
+                SpinnerColumn(),
+                TextColumn("{task.description}"),
+                TextColumn("{task.completed} files"),
+                TimeElapsedColumn(),
+                console=console,
+            )
+
+            def load(source: Path, task) -> None:
+                def on_file(_):
+                    progress.advance(task)
+
+                if loaders[source] == "tar":
+                    get_tar_file_hashes(source, ignore_top_folder=True,
+                                        hashes=content_map[source], on_file=on_file)
                 else:
-                    row.append("[red]MISSING[/red]")
-            if len(file_hashes) > 1 or row.count("[red]MISSING[/red]") > 0:
-                table.add_row(*row)
+                    get_cached_dir_file_hashes(source, use_cache=not no_cache, hashes=content_map[source],
+                                               jobs=inner_jobs, on_file=on_file)
+                content_map[source].flush()
+                done = next(t.completed for t in progress.tasks if t.id == task)
+                progress.update(task, total=done, description=f"[green]{source.name}")
 
-        if table.row_count:
-            console.print(table)
-        else:
-            console.print("[green]No differences found![/green]")
+            with progress, ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+                futures = [
+                    executor.submit(load, source, progress.add_task(source.name, total=None))
+                    for source in loaders
+                ]
+                for future in futures:
+                    future.result()
 
-    finally:
-        for temp in temp_dirs:
-            shutil.rmtree(temp)
+            # Prepare rich table
+            table = Table(title="Diff or Missing Files")
+            table.add_column("File Path", style="bold")
+            for src in content_map.keys():
+                # Show only the base name of the source (ignore root folder path)
+                table.add_column(src.name, overflow="fold")
+
+            # sources are merged in path order, so no union of all paths is ever held in memory
+            for file_path, hashes in merge_sorted([store.digests() for store in content_map.values()]):
+                file_hashes = set()
+                row = [file_path]
+                for h in hashes:
+                    if h:
+                        row.append(h.hex()[:12])
+                        file_hashes.add(h)
+                    else:
+                        row.append("[red]MISSING[/red]")
+                if len(file_hashes) > 1 or row.count("[red]MISSING[/red]") > 0:
+                    table.add_row(*row)
+
+            if table.row_count:
+                console.print(table)
+            else:
+                console.print("[green]No differences found![/green]")
+        finally:
+            for store in content_map.values():
+                store.close()
 
 @app.callback()
 def main(
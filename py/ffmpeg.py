@@ -6,6 +6,7 @@ from qutil.cli.fac import FuncAsCmd
 from qutil.console.color_print import ColorPrint
 from qutil.log.log import setup_logger
 from qutil.shell.local import run as run_cmd
+from qutil.shell.local import run_stream
 from qutil.filesystem.folder import FolderHelper
 
 
@@ -54,14 +55,14 @@ def get_files(folder_path, recursive=True):
 
 def detect_max_vol(file):
     """Detect the max volume of a file."""
-    command = f"ffmpeg -hide_banner -i '{
-        file}' -af 'volumedetect' -vn -sn -dn -f null -"
-    ret = run_cmd(command, log=pr)
-    lines = ret.split("\n")
-    for line in lines:
-        if "max_volume" in line and ":" in line:
-            vol = line.split(":")[-1].strip().split(" ")[-2].strip()
-            return float(vol)
+    command = ["ffmpeg", "-hide_banner", "-i", file, "-af", "volumedetect",
+               "-vn", "-sn", "-dn", "-f", "null", "-"]
+    # ffmpeg logs the whole decode on stderr, only read it line by line
+    with run_stream(command) as output:
+        for _, line in output:
+            if "max_volume" in line and ":" in line:
+                vol = line.split(":")[-1].strip().split(" ")[-2].strip()
+                return float(vol)
 
 
 def new_ext(file, ext):
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 from qutil.cli.fac import FuncAsCmd
 from qutil.console.color_print import ColorPrint
 from qutil.log.log import setup_logger
 from qutil.shell.local import run as run_cmd
+from qutil.shell.local import run_stream
 from qutil.filesystem.folder import FolderHelper
+import hashlib
+import json
 import logging
 import os
+import time
 
 setup_logger()
 pr = ColorPrint()
@@ -106,14 +112,128 @@ def get_file_name(file):
 
 def detect_max_vol(file):
     """Detect the max volume of a file."""
-    command = f"ffmpeg -hide_banner -i '{
-        file}' -af 'volumedetect' -vn -sn -dn -f null -"
-    ret = run_cmd(command, log=pr)
-    lines = ret.split("\n")
-    for line in lines:
-        if "max_volume" in line and ":" in line:
-            vol = line.split(":")[-1].strip().split(" ")[-2].strip()
-            return float(vol)
+    command = ["ffmpeg", "-hide_banner", "-i", file, "-af", "volumedetect",
+               "-vn", "-sn", "-dn", "-f", "null", "-"]
+    # ffmpeg logs the whole decode on stderr, only read it line by line
+    with run_stream(command) as output:
+        for _, line in output:
+            if "max_volume" in line and ":" in line:
+                vol = line.split(":")[-1].strip().split(" ")[-2].strip()
+                return float(vol)
+
+
+def overloaded(max_load):
+    """Check if the 1 minute load average is above max_load."""
+    if max_load is None or not hasattr(os, "getloadavg"):
+        return False
+    return os.getloadavg()[0] > max_load
+
+
+def run_jobs(commands, jobs=1, timeout=None, ordered=True, max_load=None, on_done=None,
+             keep_output=None):
+    """Run shell commands on a pool of jobs worker threads.
+
+    Yield (index, command, result, seconds) in input order if ordered, else as
+    they finish. A command running longer than timeout seconds is killed and
+    its result has timed_out set. While the load average is above max_load no
+    new command starts (one always runs). on_done(done, total, item) is
+    called with the (index, command, result, seconds) of each command as soon
+    as it finishes, whatever the output order. keep_output bounds the bytes
+    of stdout and of stderr kept per command to their last keep_output.
+    """
+    jobs = max(1, jobs)
+    total = len(commands)
+    todo = list(enumerate(commands))[::-1]
+    pending = {}
+    finished = {}
+    next_index = 0
+    done_count = 0
+
+    def job(cmd):
+        started = time.monotonic()
+        ret = run_cmd(cmd, warn=True, pty=False, timeout=timeout, tail=keep_output)
+        return ret, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while todo or pending:
+            while todo and len(pending) < jobs and not (pending and overloaded(max_load)):
+                index, cmd = todo.pop()
+                pending[executor.submit(job, cmd)] = (index, cmd)
+            # wake up every second to look at the load again while commands wait
+            done, _ = wait(pending, timeout=1 if todo else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, cmd = pending.pop(future)
+                ret, seconds = future.result()
+                done_count += 1
+                finished[index] = (index, cmd, ret, seconds)
+                if on_done:
+                    on_done(done_count, total, finished[index])
+            if ordered:
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+            else:
+                for index in list(finished):
+                    yield finished.pop(index)
+
+
+def input_state(file):
+    """Get [size, mtime_ns] of a file or folder, to tell if it changed."""
+    st = os.stat(file)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_journal(path):
+    """Load the last journal record of each (file, command)."""
+    records = {}
+    if not path or not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # last line cut short by a crash
+            records[(rec["file"], rec["cmd"])] = rec
+    return records
+
+
+def journal_record(file, cmd, ret, seconds):
+    """Build the journal record of a finished command."""
+    output = (ret["stdout"] + ret["stderr"]).encode("utf-8", "replace")
+    return {
+        "file": file,
+        "cmd": cmd,
+        "exit_code": ret["exit_code"],
+        "timed_out": ret.get("timed_out", False),
+        "seconds": round(seconds, 3),
+        "output_sha256": hashlib.sha256(output).hexdigest(),
+        "input": input_state(file) if os.path.exists(file) else None,
+        "finished": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def is_completed(rec, file):
+    """Check if a journal record is a success on the same, unchanged input."""
+    if rec is None or rec["exit_code"] != 0 or not os.path.exists(file):
+        return False
+    return rec["input"] == input_state(file)
+
+
+def output_path(template, file):
+    """Format the output path template of a file: {path} {dir} {name} {stem}."""
+    return template.format(
+        path=file,
+        dir=os.path.dirname(file),
+        name=os.path.basename(file),
+        stem=os.path.splitext(file)[0],
+    )
+
+
+def is_fresh(template, file):
+    """Check if the output of a file exists and is newer than the file."""
+    out = output_path(template, file)
+    return os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(file)
 
 
 def new_ext(file, ext):
@@ -175,20 +295,79 @@ def run_cmd_str(args):
         and exclude_keywords(get_file_name(x), args.exclude)
     ]
     commands = list(map(lambda x: args.cmdstr.format("'{}'".format(x)), files))
+
+    # skip what a previous run finished and outputs already up to date
+    journal_path = args.journal or (".foreach_journal.jsonl" if args.resume else None)
+    records = load_journal(journal_path) if args.resume else {}
+    todo = [
+        (f, cmd)
+        for f, cmd in zip(files, commands)
+        if not is_completed(records.get((f, cmd)), f)
+        and not (args.fresh and is_fresh(args.fresh, f))
+    ]
+    skipped = len(files) - len(todo)
+    if skipped:
+        pr.info(f"Skipping {skipped} files already done or up to date")
+    files = [f for f, _ in todo]
+    commands = [cmd for _, cmd in todo]
+    journal = open(journal_path, "a", encoding="utf-8") if journal_path else None
+    started = time.monotonic()
+
+    def progress(done, total, item):
+        index, cmd, ret, seconds = item
+        if journal:
+            rec = journal_record(files[index], cmd, ret, seconds)
+            journal.write(json.dumps(rec) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        elapsed = time.monotonic() - started
+        eta = elapsed / done * (total - done)
+        pr.info(
+            f"[{done}/{total}] elapsed {timedelta(seconds=int(elapsed))}, "
+            f"ETA {timedelta(seconds=int(eta))}"
+        )
+
     fails = []
-    for f, cmd in zip(files, commands):
-        ret = run_cmd(cmd, warn=True)
-        if ret["exit_code"] != 0:
-            pr.fail(f"{cmd}")
-            pr.fail(f"{ret['stderr'] + ret['stdout']}")
-            fails.append(f)
-        else:
-            pr.success(f"{cmd}")
-            pr.success(f"{ret['stdout'] + ret['stderr']}")
-        pr.print("\n")
+    results = run_jobs(
+        commands,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        ordered=args.output == "ordered",
+        max_load=args.max_load,
+        on_done=progress,
+        keep_output=args.keep_output * 1024 if args.keep_output else None,
+    )
+    try:
+        for index, cmd, ret, seconds in results:
+            f = files[index]
+            if ret["exit_code"] != 0:
+                if ret["timed_out"]:
+                    pr.fail(f"timed out after {args.timeout}s: {cmd}")
+                else:
+                    pr.fail(f"{cmd}")
+                pr.fail(f"{ret['stderr'] + ret['stdout']}")
+                fails.append(f)
+            else:
+                pr.success(f"{cmd} ({seconds:.1f}s)")
+                pr.success(f"{ret['stdout'] + ret['stderr']}")
+            pr.print("\n")
+    finally:
+        if journal:
+            journal.close()
     if fails:
         for f in fails:
             pr.fail(f"{f}")
+    pr.print(
+        f"{len(commands) - len(fails)} succeeded, {len(fails)} failed, "
+        f"{skipped} skipped in {timedelta(seconds=int(time.monotonic() - started))}"
+    )
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
 
 
 # ==================================================
@@ -238,6 +417,53 @@ def parse_args():
         default="folder",
         help="operate on folder or file, or both",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="commands run at the same time by run_cmd_str",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="seconds after which a command is killed and counts as failed",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["ordered", "completed"],
+        default="ordered",
+        help="print results in file order or as commands finish",
+    )
+    parser.add_argument(
+        "--max-load",
+        type=float,
+        default=None,
+        help="start no new command while the 1 minute load average is above this",
+    )
+    parser.add_argument(
+        "--keep-output",
+        type=int,
+        default=None,
+        help="KB of each command's stdout and stderr kept (the last ones), default all",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="file recording each finished command (exit code, duration, output hash)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="skip files whose command succeeded in the journal on the same input",
+    )
+    parser.add_argument(
+        "--fresh",
+        default=None,
+        help="skip files whose output is newer, eg: '{stem}.mp3' ({path} {dir} {name} {stem})",
+    )
     parser.add_argument(
         "--debug", default=False, help="debug mode", action="store_true"
     )
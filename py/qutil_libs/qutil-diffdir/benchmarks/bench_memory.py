@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Bytes per file held by diffs() for the file hashes of two folders:
+the old {str(rel_path): hexdigest} dicts plus a union set, against SortedTable with raw digests.
+
+    python benchmarks/bench_memory.py --files 200000
+"""
+
+import argparse
+import gc
+import tracemalloc
+from hashlib import sha256
+
+from qutil.diffdir.table import SortedTable, merge_sorted
+
+
+def synthetic_paths(count):
+    # build-output like layout: a few levels of directories with numbered files
+    for i in range(count):
+        yield f"release/component_{i // 5000:03d}/lib/module_{i // 100 % 50:02d}/source_file_{i}.o"
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, current, peak
+
+
+def build_dicts(count):
+    def build():
+        dicts = []
+        for folder in range(2):
+            dicts.append({path: sha256(f"{folder}{path}".encode()).hexdigest() for path in synthetic_paths(count)})
+        union = set()
+        for files_dict in dicts:
+            union.update(files_dict.keys())
+        return dicts, union
+    return build
+
+
+def build_tables(count):
+    def build():
+        tables = []
+        for folder in range(2):
+            table = SortedTable()
+            for path in synthetic_paths(count):
+                table.add(path, sha256(f"{folder}{path}".encode()).digest())
+            tables.append(table)
+        # force the last pending run into its packed form
+        sum(1 for _ in merge_sorted(tables))
+        return tables
+    return build
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200_000, help="files per folder")
+    args = parser.parse_args()
+
+    total = 2 * args.files
+    for name, build in (("dict + union set", build_dicts(args.files)), ("SortedTable", build_tables(args.files))):
+        kept, current, peak = measure(build)
+        print(f"{name:18} {current / total:8.1f} bytes/file retained, {peak / total:8.1f} bytes/file peak")
+        del kept
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import time
+from hashlib import sha256
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "qutil-diffdir"
+# entries kept per root, least recently used ones are evicted on close
+DEFAULT_MAX_ENTRIES = 5_000_000
+# pending writes are flushed to the database every FLUSH_EVERY operations
+FLUSH_EVERY = 10_000
+
+
+class HashCache:
+    """
+    On-disk sha256 cache for the files under one root folder, stored in SQLite.
+    A cached hash is only reused while the file's (size, mtime_ns, inode) is unchanged.
+    Usage example:
+        with HashCache.for_root(Path("/data/build")) as cache:
+            sha = cache.get("bin/app", os.stat("/data/build/bin/app"))
+    """
+
+    def __init__(self, db_path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "sha256 TEXT, last_used INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes(last_used)")
+        # packed content-defined chunk lists of big files, see qutil.diffdir.chunks
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "path TEXT, avg_size INTEGER, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "data BLOB, PRIMARY KEY (path, avg_size))"
+        )
+        # every entry touched by this run gets the same "generation" stamp
+        self.generation = time.time_ns()
+        self._touched: List[str] = []
+        self._new: List[Tuple] = []
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_root(
+        cls,
+        root: Path,
+        cache_dir: Path = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> "HashCache":
+        """
+        Open the cache belonging to root, one database file per resolved root path.
+        """
+        cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        key = sha256(str(Path(root).resolve()).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return cls(cache_dir / f"{key}.sqlite", max_entries=max_entries)
+
+    def get(self, rel_path: str, st: os.stat_result) -> Optional[str]:
+        """
+        Return the cached sha256 of rel_path if its stat still matches, otherwise None.
+        """
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, sha256 FROM hashes WHERE path = ?", (rel_path,)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append(rel_path)
+        self._maybe_flush()
+        return row[3]
+
+    def put(self, rel_path: str, st: os.stat_result, sha: str) -> None:
+        """
+        Remember sha as the hash of rel_path for the given stat.
+        """
+        self._new.append((rel_path, st.st_size, st.st_mtime_ns, st.st_ino, sha, self.generation))
+        self._maybe_flush()
+
+    def get_chunks(self, rel_path: str, st: os.stat_result, avg_size: int) -> Optional[bytes]:
+        """
+        Return the cached packed chunk list of rel_path if its stat still matches, otherwise None.
+        """
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, data FROM chunks WHERE path = ? AND avg_size = ?", (rel_path, avg_size)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        return row[3]
+
+    def put_chunks(self, rel_path: str, st: os.stat_result, avg_size: int, data: bytes) -> None:
+        """
+        Remember the packed chunk list of rel_path for the given stat, written at once as there are few of them.
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                (rel_path, avg_size, st.st_size, st.st_mtime_ns, st.st_ino, data),
+            )
+
+    def _maybe_flush(self):
+        if len(self._touched) + len(self._new) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)", self._new
+            )
+            self.conn.executemany(
+                "UPDATE hashes SET last_used = ? WHERE path = ?",
+                ((self.generation, path) for path in self._touched),
+            )
+        self._new.clear()
+        self._touched.clear()
+
+    def evict(self) -> int:
+        """
+        Drop the least recently used entries above max_entries, return how many were dropped.
+        """
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()
+        extra = count - self.max_entries
+        if extra <= 0:
+            return 0
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM hashes WHERE path IN "
+                "(SELECT path FROM hashes ORDER BY last_used LIMIT ?)",
+                (extra,),
+            )
+        return extra
+
+    def close(self) -> None:
+        self.flush()
+        self.evict()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
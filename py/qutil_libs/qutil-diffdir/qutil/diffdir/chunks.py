@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+import os
+import random
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import sha256
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from .cache import HashCache
+from .diff import parallel_map, resolve_jobs
+
+try:
+    import numpy
+except ImportError:  # optional, pip install qutil-diffdir[fast]
+    numpy = None
+
+# average chunk size, chunks are between a quarter and four times of it
+DEFAULT_AVG_CHUNK = 1024 * 1024
+# bytes read from the file per call while chunking
+READ_SIZE = 4 * 1024 * 1024
+
+Chunk = namedtuple("Chunk", ["offset", "length", "digest"])
+# ranges_a/ranges_b: (offset, length) ranges of each file made of chunks the other file does not have
+# shared_bytes: bytes of b found somewhere in a, differing_bytes: what a delta transfer from a to b would send
+ChunkDiff = namedtuple("ChunkDiff", ["size_a", "size_b", "shared_bytes", "differing_bytes", "ranges_a", "ranges_b"])
+
+# (length, sha256) of a chunk as packed for the cache
+_CHUNK = struct.Struct("<I32s")
+# gear table of the rolling hash, fixed so that boundaries are stable across runs and machines
+_GEAR = tuple(struct.unpack("<256I", random.Random(0x9E3779B9).getrandbits(32 * 256).to_bytes(1024, "little")))
+# bytes a gear hash value depends on: older ones are shifted out of its 32 bits
+_WINDOW = 32
+_GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint32) if numpy is not None else None
+
+
+def chunk_params(avg_size: int = DEFAULT_AVG_CHUNK) -> Tuple[int, int, int]:
+    """
+    (min_size, avg_size, max_size) used for an average chunk size.
+    """
+    if avg_size < 64 or avg_size & (avg_size - 1):
+        raise ValueError("avg_size must be a power of two and at least 64.")
+    return avg_size // 4, avg_size, avg_size * 4
+
+
+def iter_chunks(fileobj: BinaryIO, avg_size: int = DEFAULT_AVG_CHUNK) -> Iterator[Chunk]:
+    """
+    Split a binary file object into content-defined chunks and yield (offset, length, sha256 digest).
+    A boundary is placed where a gear rolling hash over the last 32 bytes has its top bits clear, so an
+    insertion or deletion only changes the chunks around it and the rest of the file keeps its chunks.
+    The first min_size bytes of every chunk are hashed without rolling, as in FastCDC.
+    With numpy the rolling hash of a whole read is computed at once (over 100 MB/s), without it
+    a pure python loop runs at a few MB/s; both place the same boundaries.
+    """
+    min_size, avg_size, max_size = chunk_params(avg_size)
+    bits = avg_size.bit_length() - 1
+    mask = ((1 << bits) - 1) << (32 - bits)
+    if numpy is not None:
+        return _iter_chunks_numpy(fileobj, min_size, max_size, mask)
+    return _iter_chunks_python(fileobj, min_size, max_size, mask)
+
+
+def _iter_chunks_python(fileobj: BinaryIO, min_size: int, max_size: int, mask: int) -> Iterator[Chunk]:
+    gear = _GEAR
+    offset = 0
+    length = 0
+    h = 0
+    digest = sha256()
+    while True:
+        buf = fileobj.read(READ_SIZE)
+        if not buf:
+            break
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            if length < min_size:
+                take = min(min_size - length, end - pos)
+                digest.update(buf[pos:pos + take])
+                length += take
+                pos += take
+                h = 0
+                continue
+            limit = min(end, pos + max_size - length)
+            i = limit
+            cut = False
+            for i, b in enumerate(buf[pos:limit], pos + 1):
+                h = ((h << 1) + gear[b]) & 0xFFFFFFFF
+                if not h & mask:
+                    cut = True
+                    break
+            digest.update(buf[pos:i])
+            length += i - pos
+            pos = i
+            if cut or length >= max_size:
+                yield Chunk(offset, length, digest.digest())
+                offset += length
+                length = 0
+                digest = sha256()
+    if length:
+        yield Chunk(offset, length, digest.digest())
+
+
+def _cut_points(data: bytes, mask: int, block: int = 64 * 1024):
+    # indexes i >= 31 of data where the gear hash of data[i - 31:i + 1] has the mask bits clear, computed a
+    # cache-sized block at a time by doubling the window: h_2w[i] = h_w[i] + (h_w[i - w] << w), the uint32
+    # arithmetic drops what is shifted past 32 bits
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    h = numpy.empty(block + _WINDOW - 1, dtype=numpy.uint32)
+    tmp = numpy.empty_like(h)
+    found = [numpy.empty(0, dtype=numpy.intp)]
+    for first in range(_WINDOW - 1, len(raw), block):
+        n = len(raw[first - _WINDOW + 1:first + block])
+        numpy.take(_GEAR_ARRAY, raw[first - _WINDOW + 1:first + block], out=h[:n])
+        width = 1
+        while width < _WINDOW:
+            numpy.left_shift(h[:n - width], width, out=tmp[:n - width])
+            numpy.add(h[width:n], tmp[:n - width], out=h[width:n])
+            width *= 2
+        numpy.bitwise_and(h[:n], numpy.uint32(mask), out=tmp[:n])
+        found.append(numpy.flatnonzero(tmp[_WINDOW - 1:n] == 0) + first)
+    return numpy.concatenate(found)
+
+
+def _boundary(buf: bytes, pos: int, cuts, min_size: int, max_size: int, mask: int):
+    # end of the chunk starting at buf[pos], None when buf does not hold enough of the file to tell
+    start = pos + min_size
+    limit = pos + max_size
+    # the hash restarts from 0 at start, over its first 31 bytes it does not cover a full window yet
+    stop = min(start + _WINDOW - 1, limit)
+    h = 0
+    for i in range(start, min(stop, len(buf))):
+        h = ((h << 1) + _GEAR[buf[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i + 1
+    if len(buf) < stop:
+        return None
+    if stop == limit:
+        return limit
+    k = numpy.searchsorted(cuts, stop)
+    if k < len(cuts) and cuts[k] < limit:
+        return int(cuts[k]) + 1
+    return limit if limit <= len(buf) else None
+
+
+def _iter_chunks_numpy(fileobj: BinaryIO, min_size: int, max_size: int, mask: int) -> Iterator[Chunk]:
+    # buf holds the file from the start of the chunk being cut, cuts the cut points found in it so far
+    buf = b""
+    cuts = numpy.empty(0, dtype=numpy.intp)
+    offset = 0
+    while True:
+        data = fileobj.read(READ_SIZE)
+        # the hash windows ending in data start up to 31 bytes back in buf
+        carry = buf[-(_WINDOW - 1):]
+        cuts = numpy.concatenate((cuts, _cut_points(carry + data, mask) + (len(buf) - len(carry))))
+        buf = buf + data if buf else data
+        pos = 0
+        while pos < len(buf):
+            end = _boundary(buf, pos, cuts, min_size, max_size, mask)
+            if end is None:
+                if data:
+                    break
+                end = len(buf)  # end of the file
+            yield Chunk(offset, end - pos, sha256(memoryview(buf)[pos:end]).digest())
+            offset += end - pos
+            pos = end
+        if not data:
+            return
+        buf = buf[pos:]
+        cuts = cuts[cuts >= pos] - pos
+
+
+def chunk_file(f: Path, avg_size: int = DEFAULT_AVG_CHUNK) -> List[Chunk]:
+    """
+    Content-defined chunks of the file f.
+    """
+    with open(f, "rb") as file:
+        return list(iter_chunks(file, avg_size=avg_size))
+
+
+def pack_chunks(chunks: Iterable[Chunk]) -> bytes:
+    """
+    Pack chunks into (length, digest) records, offsets follow from the lengths.
+    """
+    return b"".join(_CHUNK.pack(chunk.length, chunk.digest) for chunk in chunks)
+
+
+def unpack_chunks(data: bytes) -> List[Chunk]:
+    chunks = []
+    offset = 0
+    for length, digest in _CHUNK.iter_unpack(data):
+        chunks.append(Chunk(offset, length, digest))
+        offset += length
+    return chunks
+
+
+def _ranges(chunks: List[Chunk], missing: set) -> List[Tuple[int, int]]:
+    # (offset, length) of runs of adjacent chunks whose digest is in missing
+    ranges = []
+    for chunk in chunks:
+        if chunk.digest not in missing:
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == chunk.offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + chunk.length)
+        else:
+            ranges.append((chunk.offset, chunk.length))
+    return ranges
+
+
+def diff_chunks(chunks_a: List[Chunk], chunks_b: List[Chunk]) -> ChunkDiff:
+    """
+    Compare the chunk lists of two files, wherever their chunks sit in either file.
+    """
+    digests_a = {chunk.digest for chunk in chunks_a}
+    digests_b = {chunk.digest for chunk in chunks_b}
+    size_a = sum(chunk.length for chunk in chunks_a)
+    size_b = sum(chunk.length for chunk in chunks_b)
+    shared = sum(chunk.length for chunk in chunks_b if chunk.digest in digests_a)
+    return ChunkDiff(
+        size_a,
+        size_b,
+        shared,
+        size_b - shared,
+        _ranges(chunks_a, digests_a - digests_b),
+        _ranges(chunks_b, digests_b - digests_a),
+    )
+
+
+def diff_files(file_a: Path, file_b: Path, avg_size: int = DEFAULT_AVG_CHUNK) -> ChunkDiff:
+    """
+    Chunk level comparison of two files.
+    """
+    return diff_chunks(chunk_file(file_a, avg_size), chunk_file(file_b, avg_size))
+
+
+def iter_chunk_diffs(
+    rows: Iterable[dict],
+    folder_paths: List[Path],
+    min_file_size: int,
+    avg_size: int = DEFAULT_AVG_CHUNK,
+    jobs: int = 1,
+    use_cache: bool = True,
+    cache_dir: Path = None,
+) -> Iterator[dict]:
+    """
+    Pass diff rows through, adding a "chunks" entry to rows of files of at least min_file_size bytes
+    that exist in the first folder and in some other one:
+        {str(folder): {"shared_bytes": ..., "differing_bytes": ..., "ranges": [[offset, length], ...],
+                       "base_ranges": [[offset, length], ...]}}
+    compares the file in folder with the one in the first folder; ranges are in the file under folder,
+    base_ranges in the file under the first folder. Chunk lists are kept in the hash cache of each folder.
+    Chunking runs in worker processes when jobs is not 1, one pool for all the rows.
+    """
+    chunker = partial(chunk_file, avg_size=avg_size)
+    caches = [HashCache.for_root(folder, cache_dir=cache_dir) if use_cache else None for folder in folder_paths]
+    jobs = resolve_jobs(jobs)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs != 1 else None
+    try:
+        for row in rows:
+            file = row["file"]
+            present = [
+                i for i, folder in enumerate(folder_paths)
+                if row.get(str(folder)) is not None and os.path.isfile(os.path.join(folder, file))
+            ]
+            if 0 not in present or len(present) < 2:
+                yield row
+                continue
+            stats = {i: os.stat(os.path.join(folder_paths[i], file)) for i in present}
+            if any(stats[i].st_size < min_file_size for i in present):
+                yield row
+                continue
+
+            chunk_lists = {}
+            todo = {}
+            for i in present:
+                data = caches[i].get_chunks(file, stats[i], avg_size) if caches[i] is not None else None
+                if data is not None:
+                    chunk_lists[i] = unpack_chunks(data)
+                else:
+                    todo[os.path.join(folder_paths[i], file)] = i
+            for path, chunks in parallel_map(chunker, list(todo), jobs=jobs, executor=executor):
+                i = todo[path]
+                chunk_lists[i] = chunks
+                if caches[i] is not None:
+                    caches[i].put_chunks(file, stats[i], avg_size, pack_chunks(chunks))
+
+            row = dict(row)
+            row["chunks"] = {}
+            for i in present[1:]:
+                result = diff_chunks(chunk_lists[0], chunk_lists[i])
+                row["chunks"][str(folder_paths[i])] = {
+                    "shared_bytes": result.shared_bytes,
+                    "differing_bytes": result.differing_bytes,
+                    "ranges": [list(r) for r in result.ranges_b],
+                    "base_ranges": [list(r) for r in result.ranges_a],
+                }
+            yield row
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for cache in caches:
+            if cache is not None:
+                cache.close()
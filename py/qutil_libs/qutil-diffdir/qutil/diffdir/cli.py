@@ -1,7 +1,12 @@
+import tempfile
 import typer
+from enum import Enum
 from pathlib import Path
 from typing import List
-from .diff import diffs, to_html
+from .chunks import iter_chunk_diffs
+from .diff import iter_diffs
+from .snapshot import iter_snapshot_diffs
+from .writers import DEFAULT_PAGE_SIZE, open_writer
 
 from rich.table import Table
 from rich.console import Console
@@ -19,35 +24,140 @@ def to_rich_table(diff_result, folders):
         table.add_row(*values)
     return table
 
+class Strategy(str, Enum):
+    full = "full"
+    tiered = "tiered"
+    size_only = "size-only"
+
+
+def print_stats(stats):
+    """
+    Print how many files each comparison tier looked at and how much I/O it avoided.
+    """
+    if "dirs_listed" in stats:
+        typer.echo(
+            f"Files: {stats['files']}, directories: {stats['dirs']} ({stats['dirs_listed']} re-listed), "
+            f"files stat'ed: {stats['files_stat']}, hashed: {stats['files_hashed']}, removed: {stats['files_removed']}"
+        )
+        return
+    if "bytes_total" not in stats:
+        typer.echo(f"Files: {stats['files']}, fully hashed: {stats['full_hashed']}, from the cache: {stats['cache_hits']}")
+        return
+    typer.echo(
+        f"Files: {stats['files']}, missing: {stats['missing']}, "
+        f"size differs: {stats['size_differs']}, size equal (not read): {stats['size_equal']}"
+    )
+    typer.echo(
+        f"Partial hashed: {stats['partial_hashed']} ({stats['partial_differs']} differ), "
+        f"full hashed: {stats['full_hashed']}, from the cache: {stats['cache_hits']} ({stats['full_differs']} differ)"
+    )
+    typer.echo(f"Read {stats['bytes_read']} bytes, hashing everything would read {stats['bytes_total']} bytes")
+
+
+def print_chunk_diffs(rows):
+    """
+    Print how much of each chunk compared file is shared with the first folder.
+    """
+    for row in rows:
+        for folder, result in row.get("chunks", {}).items():
+            typer.echo(
+                f"{row['file']} in {folder}: {result['differing_bytes']} bytes differ in "
+                f"{len(result['ranges'])} ranges, {result['shared_bytes']} bytes shared"
+            )
+
+
 app = typer.Typer()
 
 
+class Format(str, Enum):
+    html = "html"
+    json = "json"
+    csv = "csv"
+
+
 @app.command()
 def show_diffs(
     folders: List[Path],
-    output: Path = typer.Option("./diff.html", help="Output HTML file for the diff table"),
+    output: Path = typer.Option("./diff.html", help="Output file for the diff table"),
     file_exts: List[str] = typer.Option(None, help="Only compare files with these extensions, e.g. .py .txt"),
-    exclude_rep_path: List[str] = typer.Option(None, help="Ignore all files under these relative paths (prefix match)")
+    exclude_rep_path: List[str] = typer.Option(None, help="Ignore all files under these relative paths (prefix match)"),
+    jobs: int = typer.Option(0, help="Number of parallel hashing workers, 0 means one per CPU"),
+    processes: bool = typer.Option(False, help="Hash in worker processes instead of threads"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or update the on-disk hash cache"),
+    cache_dir: Path = typer.Option(None, help="Hash cache directory, default ~/.cache/qutil-diffdir"),
+    strategy: Strategy = typer.Option(Strategy.full, help="full: hash everything, tiered: sizes then head/tail then full hash, size-only: sizes only"),
+    external: bool = typer.Option(False, help="Sort file lists on disk, for trees that do not fit in memory"),
+    spill_dir: Path = typer.Option(None, help="Directory for the on-disk sorted runs of --external, default the system temp dir"),
+    output_format: Format = typer.Option(None, "--format", help="html, json (one object per line) or csv, default from the output suffix"),
+    page_size: int = typer.Option(DEFAULT_PAGE_SIZE, help="Rows per HTML page, 0 for a single page"),
+    since_snapshot: Path = typer.Option(None, help="Keep file hashes in this snapshot file and only re-scan directories changed since the last run"),
+    events_file: Path = typer.Option(None, help="With --since-snapshot, file of changed paths (one per line) appended by a watcher such as inotifywait"),
+    chunks_over: int = typer.Option(0, help="Compare differing files of at least this many MB chunk by chunk against the first folder, 0 to disable; ranges go to the json output"),
+    chunk_size: int = typer.Option(1024, help="Average chunk size in KB for --chunks-over, a power of two"),
+    console_rows: int = typer.Option(1000, help="Show at most this many rows in the console table")
 ):
-    """Show diffs of files under the given folders in a table, and optionally output to HTML."""
+    """Show diffs of files under the given folders in a table, and write them to an HTML, JSON or CSV file."""
     if len(folders) < 2:
         typer.echo("Please provide at least two folders.")
         raise typer.Exit(1)
 
-    result = diffs(folders, file_exts=file_exts, exclude_rep_path=exclude_rep_path)
+    stats = {}
+    if since_snapshot is not None:
+        rows = iter_snapshot_diffs(
+            folders,
+            since_snapshot,
+            file_exts=file_exts,
+            exclude_rep_path=exclude_rep_path,
+            jobs=jobs,
+            use_processes=processes,
+            events_file=events_file,
+            stats=stats,
+        )
+    else:
+        rows = iter_diffs(
+            folders,
+            file_exts=file_exts,
+            exclude_rep_path=exclude_rep_path,
+            jobs=jobs,
+            use_processes=processes,
+            use_cache=not no_cache,
+            cache_dir=cache_dir,
+            strategy=strategy.value,
+            stats=stats,
+            spill_dir=(spill_dir or Path(tempfile.gettempdir())) if external else None,
+        )
 
-    if not result:
+    if chunks_over > 0:
+        rows = iter_chunk_diffs(
+            rows,
+            folders,
+            chunks_over * 1024 * 1024,
+            avg_size=chunk_size * 1024,
+            jobs=jobs,
+            use_cache=not no_cache,
+            cache_dir=cache_dir,
+        )
+
+    # rows are written as they come, only the first console_rows are kept for the console
+    shown = []
+    with open_writer(output, folders, fmt=output_format.value if output_format else None, page_size=page_size) as writer:
+        for row in rows:
+            writer.write(row)
+            if len(shown) < console_rows:
+                shown.append(row)
+    print_stats(stats)
+
+    if not writer.count:
         typer.echo("No differences found.")
         raise typer.Exit(0)
 
-    table = to_rich_table(result, folders)
-    console = Console()
-    console.print(table)
-
-    if output:
-        to_html(result, folders, output)
-        typer.echo(f"Diff written to {output}")
-        return
+    if shown:
+        console = Console()
+        console.print(to_rich_table(shown, folders))
+        print_chunk_diffs(shown)
+    if writer.count > len(shown):
+        typer.echo(f"... {writer.count - len(shown)} more rows not shown")
+    typer.echo(f"{writer.count} differences written to {output}")
 
 def main():
     app()
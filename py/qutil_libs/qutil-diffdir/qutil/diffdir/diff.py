@@ -1,44 +1,253 @@
 #!/usr/bin/env python
 
+import os
+import mmap
+import struct
+import tempfile
+from collections import deque, namedtuple
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from hashlib import sha256
-from typing import List, Tuple, Generator, Any
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple, Generator, Any
 
+from .cache import HashCache
+from .table import SortedTable, SpilledTable, merge_sorted
+from .writers import HtmlWriter
 
-def hash_file(f: Path) -> str:
+# read size for files hashed through the buffered loop
+CHUNK_SIZE = 1024 * 1024
+# files at least this big are hashed through an mmap instead of read() calls
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# head/tail block size read by partial_hash_file in the tiered strategy
+PARTIAL_BLOCK = 64 * 1024
+
+# (size, mtime_ns, inode) of a file as stored in the tiered strategy's tables
+_STAT = struct.Struct("<QqQ")
+FileStat = namedtuple("FileStat", ["st_size", "st_mtime_ns", "st_ino"])
+
+# full: sha256 of every file
+# tiered: path sets, then sizes, then head/tail hash, full sha256 only when all of those are equal
+# size-only: path sets and sizes only, files of equal size are treated as equal
+STRATEGIES = ("full", "tiered", "size-only")
+
+
+def hash_fileobj(fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+    # return sha256 of everything left in a binary file object, read chunk_size bytes at a time
+    h = sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    n = fileobj.readinto(buf)
+    while n:
+        h.update(view[:n])
+        n = fileobj.readinto(buf)
+    return h.hexdigest()
+
+
+def hash_file(f: Path, chunk_size: int = CHUNK_SIZE) -> str:
     # return sha256 for f
+    with open(f, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            # one update over the whole mapping, hashlib drops the GIL for it
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return sha256(mm).hexdigest()
+        return hash_fileobj(file, chunk_size=chunk_size)
+
+
+def partial_hash_file(f: Path, block_size: int = PARTIAL_BLOCK) -> str:
+    """
+    Cheap sha256 over the size plus the first and last block_size bytes of f.
+    Different partial hashes mean different content, equal ones prove nothing.
+    """
     h = sha256()
     with open(f, "rb") as file:
-        chunk = file.read(8192)
-        while chunk:
-            h.update(chunk)
-            chunk = file.read(8192)
+        size = os.fstat(file.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        h.update(file.read(block_size))
+        if size > block_size:
+            file.seek(max(size - block_size, block_size))
+            h.update(file.read(block_size))
     return h.hexdigest()
 
 
-def calculate_files_sha256(
+def resolve_jobs(jobs: int) -> int:
+    """
+    Number of workers to use, jobs <= 0 means one per CPU.
+    """
+    if jobs is None or jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def parallel_map(
+    func: Callable,
+    items: Iterable,
+    jobs: int = 1,
+    use_processes: bool = False,
+    executor: Executor = None,
+) -> Iterator[Tuple[Any, Any]]:
+    """
+    Apply func to every item on a thread (or process) pool and yield (item, result) as they complete.
+    Only a bounded number of items is in flight at once, so items can be a lazy generator.
+    With jobs == 1 everything runs inline, in order.
+    executor: a pool of jobs workers to run on instead of starting one for this call, left running
+    """
+    jobs = resolve_jobs(jobs)
+    if jobs == 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    max_pending = jobs * 4
+    pool = nullcontext(executor) if executor is not None else executor_cls(max_workers=jobs)
+    with pool as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(func, item)] = item
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+def _list_dir(dir_path: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(dir_path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+def _scan_files(dir_path: str) -> Generator[os.DirEntry, None, None]:
+    # like rglob("*") + is_file(): symlinked files are kept, symlinked dirs are not entered
+    # an explicit stack of directory listings, deep trees do not hit the recursion limit
+    stack = [iter(_list_dir(dir_path))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(iter(_list_dir(entry.path)))
+            elif entry.is_file():
+                yield entry
+        except OSError:
+            continue
+
+
+def iter_file_stats(
     folder_path: Path,
     file_exts: List[str] = None,
     exclude_rep_path: List[str] = None
+) -> Generator[Tuple[Path, Path, os.stat_result], None, None]:
+    """
+    Recursively find files, filter by extension and exclude paths, and yield (file, relative_path, stat).
+    The stat comes from the directory scan, so no extra syscall is made per file where the OS allows it.
+    """
+    for entry in _scan_files(str(folder_path)):
+        file = Path(entry.path)
+        relative_path = file.relative_to(folder_path)
+        # Filter by extension if specified
+        if file_exts is not None and len(file_exts) > 0:
+            if not any(str(relative_path).endswith(ext) for ext in file_exts):
+                continue
+        # Exclude paths if specified
+        if exclude_rep_path is not None and len(exclude_rep_path) > 0:
+            if any(str(relative_path).startswith(exclude) for exclude in exclude_rep_path):
+                continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        yield file, relative_path, st
+
+
+def iter_files(
+    folder_path: Path,
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None
+) -> Generator[Tuple[Path, Path], None, None]:
+    """
+    Recursively find files, filter by extension and exclude paths, and yield (file, relative_path).
+    """
+    for file, relative_path, _ in iter_file_stats(folder_path, file_exts, exclude_rep_path):
+        yield file, relative_path
+
+
+def iter_files_sha256(
+    folder_path: Path,
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    cache: HashCache = None,
+) -> Generator[Tuple[Path, str], None, None]:
+    """
+    Same as calculate_files_sha256 but yields (relative_path, sha256) as soon as each file is hashed.
+    With jobs > 1 the results come in completion order, not walk order.
+    Files whose stat matches an entry in cache are not read at all.
+    """
+    files = iter_file_stats(folder_path, file_exts=file_exts, exclude_rep_path=exclude_rep_path)
+    pending = {}
+    hits = deque()
+
+    def paths():
+        for file, relative_path, st in files:
+            if cache is not None:
+                sha = cache.get(str(relative_path), st)
+                if sha is not None:
+                    hits.append((relative_path, sha))
+                    continue
+            pending[file] = (relative_path, st)
+            yield file
+
+    for file, sha in parallel_map(hash_file, paths(), jobs=jobs, use_processes=use_processes):
+        while hits:
+            yield hits.popleft()
+        relative_path, st = pending.pop(file)
+        if cache is not None:
+            cache.put(str(relative_path), st, sha)
+        yield relative_path, sha
+    while hits:
+        yield hits.popleft()
+
+
+def calculate_files_sha256(
+    folder_path: Path,
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    cache: HashCache = None,
 ) -> List[Tuple[Path, str]]:
     """
     Recursively find files, filter by extension and exclude paths, and return (relative_path, sha256).
+    jobs is the number of hashing workers (<= 0 for one per CPU), threads unless use_processes is set.
+    cache is an optional HashCache for folder_path, consulted before hashing each file.
     """
-    ret = []
-    for file in folder_path.rglob("*"):
-        if file.is_file():
-            relative_path = file.relative_to(folder_path)
-            # Filter by extension if specified
-            if file_exts is not None and len(file_exts) > 0:
-                if not any(str(relative_path).endswith(ext) for ext in file_exts):
-                    continue
-            # Exclude paths if specified
-            if exclude_rep_path is not None and len(exclude_rep_path) > 0:
-                if any(str(relative_path).startswith(exclude) for exclude in exclude_rep_path):
-                    continue
-            sha256 = hash_file(file)
-            ret.append((relative_path, sha256))
-    return ret
+    return list(
+        iter_files_sha256(
+            folder_path,
+            file_exts=file_exts,
+            exclude_rep_path=exclude_rep_path,
+            jobs=jobs,
+            use_processes=use_processes,
+            cache=cache,
+        )
+    )
 
 
 def sort_files_sha256(files_sha256: List[Tuple[Path, str]]) -> List[Tuple[Path, str]]:
@@ -51,69 +260,328 @@ def sort_files_sha256(files_sha256: List[Tuple[Path, str]]) -> List[Tuple[Path,
 def diffs(
     folder_paths: List[Path],
     file_exts: List[str] = None,
-    exclude_rep_path: List[str] = None
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    use_cache: bool = False,
+    cache_dir: Path = None,
+    strategy: str = "full",
+    stats: dict = None,
+    spill_dir: Path = None,
 ) -> List[dict]:
     """
     Accepts a list of folder paths (at least 2), finds the diffs of files under all the folders.
     Only compares files with specified extensions and ignores files under exclude_rep_path.
+    jobs and use_processes are passed to calculate_files_sha256.
+    If use_cache is True, hashes are looked up in / saved to a HashCache per folder under cache_dir.
+    strategy is one of STRATEGIES. With "tiered" and "size-only" a value is only as strong as the tier
+    that decided the row: "size:<bytes>", "partial:<sha256>" or a plain full sha256.
+    If stats is a dict it is filled with per-tier file and byte counts; full_hashed and cache_hits count
+    copies whose full sha256 was computed and copies whose hash came from the cache.
+    If spill_dir is set, the per-folder tables are sorted runs on disk under it instead of in memory.
     Returns a list of dicts, each dict has keys as file paths (relative), values as sha256 or None if not present in that folder.
     """
+    return list(
+        iter_diffs(
+            folder_paths,
+            file_exts=file_exts,
+            exclude_rep_path=exclude_rep_path,
+            jobs=jobs,
+            use_processes=use_processes,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            strategy=strategy,
+            stats=stats,
+            spill_dir=spill_dir,
+        )
+    )
+
+
+@contextmanager
+def _table_factory(spill_dir: Path = None):
+    # SortedTable in memory, or SpilledTable runs in a private temp dir removed afterwards
+    if spill_dir is None:
+        yield SortedTable
+        return
+    Path(spill_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="diffdir_", dir=str(spill_dir)) as temp_dir:
+        yield lambda: SpilledTable(temp_dir)
+
+
+def iter_diffs(
+    folder_paths: List[Path],
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    use_cache: bool = False,
+    cache_dir: Path = None,
+    strategy: str = "full",
+    stats: dict = None,
+    spill_dir: Path = None,
+) -> Generator[dict, None, None]:
+    """
+    Same as diffs() but yields the rows one by one, in file order.
+    With the full strategy and spill_dir set, memory use does not grow with the number of files:
+    every folder's (path, sha256) stream is written as sorted runs on disk, the runs are merged
+    k-way across all folders and each differing row is yielded as soon as the merge reaches it.
+    """
     if len(folder_paths) < 2:
         raise ValueError("At least two folder paths are required.")
     # folder should be different
     if len(set(folder_paths)) < 2:
         raise ValueError("All folder paths must be different.")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}.")
+    if stats is None:
+        stats = {}
+    with _table_factory(spill_dir) as new_table:
+        if strategy != "full":
+            yield from _tiered_diffs(
+                folder_paths,
+                file_exts=file_exts,
+                exclude_rep_path=exclude_rep_path,
+                jobs=jobs,
+                use_processes=use_processes,
+                use_cache=use_cache,
+                cache_dir=cache_dir,
+                size_only=strategy == "size-only",
+                stats=stats,
+                new_table=new_table,
+            )
+            return
+        yield from _full_diffs(
+            folder_paths,
+            file_exts=file_exts,
+            exclude_rep_path=exclude_rep_path,
+            jobs=jobs,
+            use_processes=use_processes,
+            use_cache=use_cache,
+            cache_dir=cache_dir,
+            stats=stats,
+            new_table=new_table,
+        )
 
-    # Collect all file hashes for each folder
-    all_hashes = []
-    all_files_set = set()
+
+def _full_diffs(
+    folder_paths: List[Path],
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    use_cache: bool = False,
+    cache_dir: Path = None,
+    stats: dict = None,
+    new_table: Callable[[], SortedTable] = SortedTable,
+) -> Generator[dict, None, None]:
+    """
+    diffs() for the "full" strategy.
+    """
+    # Collect all file hashes for each folder, as compact sorted tables of raw digests
+    tables = []
+    hits = 0
     for folder in folder_paths:
-        files_sha256 = calculate_files_sha256(folder, file_exts=file_exts, exclude_rep_path=exclude_rep_path)
-        files_dict = {str(rel_path): sha for rel_path, sha in files_sha256}
-        all_hashes.append(files_dict)
-        all_files_set.update(files_dict.keys())
-
-    # Union of all file paths
-    all_files = sorted(all_files_set)
-
-    # Build the result: a list of dicts, one per file, with sha256 or None for each folder
-    result = []
-    for file in all_files:
-        # same file get hashed from different folder
-        hashes = [files_dict.get(file, None) for files_dict in all_hashes]
-        # Ignore if all hashes are the same (including all None)
-        if all(h == hashes[0] for h in hashes):
+        cache = HashCache.for_root(folder, cache_dir=cache_dir) if use_cache else None
+        table = new_table()
+        try:
+            files_sha256 = iter_files_sha256(
+                folder,
+                file_exts=file_exts,
+                exclude_rep_path=exclude_rep_path,
+                jobs=jobs,
+                use_processes=use_processes,
+                cache=cache,
+            )
+            for rel_path, sha in files_sha256:
+                table.add(str(rel_path), bytes.fromhex(sha))
+        finally:
+            if cache is not None:
+                hits += cache.hits
+                cache.close()
+        tables.append(table)
+    stats["files"] = 0
+    # copies read and hashed, the ones the cache knew were not read
+    stats["full_hashed"] = sum(len(table) for table in tables) - hits
+    stats["cache_hits"] = hits
+
+    # Build the result: a dict per file, with sha256 or None for each folder.
+    # The tables are merged in path order, so the union of all paths is never built.
+    for file, digests in merge_sorted(tables):
+        stats["files"] += 1
+        # Ignore if all hashes are the same
+        if all(d == digests[0] for d in digests):
             continue
         entry = {"file": file}
-        for folder, h in zip(folder_paths, hashes):
-            entry[str(folder)] = h
-        result.append(entry)
-    return result
+        for folder, d in zip(folder_paths, digests):
+            entry[str(folder)] = d.hex() if d is not None else None
+        yield entry
+
+
+def _new_tier_stats(stats: dict) -> dict:
+    for key in (
+        "files", "missing", "size_differs", "size_equal",
+        "partial_hashed", "partial_differs", "full_hashed", "full_differs", "cache_hits",
+        "bytes_total", "bytes_read",
+    ):
+        stats[key] = 0
+    return stats
+
+
+def _tiered_diffs(
+    folder_paths: List[Path],
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    use_cache: bool = False,
+    cache_dir: Path = None,
+    size_only: bool = False,
+    stats: dict = None,
+    new_table: Callable[[], SortedTable] = SortedTable,
+) -> Generator[dict, None, None]:
+    """
+    diffs() for the "tiered" and "size-only" strategies, every tier only looks at files still equal after the previous one.
+    """
+    stats = _new_tier_stats(stats if stats is not None else {})
+    count = len(folder_paths)
+
+    # tier 0 and 1: path sets and sizes, straight from the directory scan
+    listings = []
+    for folder in folder_paths:
+        listing = new_table()
+        for file, rel_path, st in iter_file_stats(folder, file_exts=file_exts, exclude_rep_path=exclude_rep_path):
+            listing.add(str(rel_path), _STAT.pack(st.st_size, st.st_mtime_ns, st.st_ino))
+            stats["bytes_total"] += st.st_size
+        listings.append(listing)
+
+    rows = {}
+    # files still equal after a tier, value is the packed stats of every copy
+    partial_candidates = new_table()
+    full_candidates = new_table()
+    for file, packed in merge_sorted(listings):
+        stats["files"] += 1
+        if None in packed:
+            stats["missing"] += 1
+        else:
+            sizes = {_STAT.unpack(p)[0] for p in packed}
+            if len(sizes) > 1:
+                stats["size_differs"] += 1
+            elif size_only:
+                stats["size_equal"] += 1
+                continue
+            else:
+                # tier 2 is only worth it when head and tail are less than the whole file
+                size = sizes.pop()
+                (partial_candidates if size > 2 * PARTIAL_BLOCK else full_candidates).add(file, b"".join(packed))
+                continue
+        rows[file] = [f"size:{_STAT.unpack(p)[0]}" if p is not None else None for p in packed]
+
+    def copies(file, packed):
+        return [
+            (os.path.join(str(folder), file), FileStat(*_STAT.unpack_from(packed, i * _STAT.size)))
+            for i, folder in enumerate(folder_paths)
+        ]
+
+    # tier 2: head/tail blocks
+    groups = (
+        (file, [(path, None) for path, _ in copies(file, packed)])
+        for file, packed in partial_candidates
+    )
+    passed = set()
+    for file, hashes in _map_groups(partial_hash_file, groups, jobs=jobs, use_processes=use_processes):
+        stats["partial_hashed"] += 1
+        stats["bytes_read"] += count * 2 * PARTIAL_BLOCK
+        if len(set(hashes)) > 1:
+            stats["partial_differs"] += 1
+            rows[file] = [f"partial:{h}" for h in hashes]
+        else:
+            passed.add(file)
+    for file, packed in partial_candidates:
+        if file in passed:
+            full_candidates.add(file, packed)
+    del passed
+
+    # tier 3: full sha256, through the hash cache when enabled
+    caches = [HashCache.for_root(folder, cache_dir=cache_dir) if use_cache else None for folder in folder_paths]
+    uncached = {}
+    try:
+        def full_groups():
+            for file, packed in full_candidates:
+                group = []
+                for i, ((path, st), cache) in enumerate(zip(copies(file, packed), caches)):
+                    sha = cache.get(file, st) if cache is not None else None
+                    if sha is None:
+                        stats["full_hashed"] += 1
+                        stats["bytes_read"] += st.st_size
+                        if cache is not None:
+                            uncached.setdefault(file, []).append((i, st))
+                    group.append((path, sha))
+                yield file, group
+
+        for file, hashes in _map_groups(hash_file, full_groups(), jobs=jobs, use_processes=use_processes):
+            for i, st in uncached.pop(file, []):
+                caches[i].put(file, st, hashes[i])
+            if len(set(hashes)) > 1:
+                stats["full_differs"] += 1
+                rows[file] = hashes
+    finally:
+        for cache in caches:
+            if cache is not None:
+                stats["cache_hits"] += cache.hits
+                cache.close()
+
+    for file in sorted(rows):
+        entry = {"file": file}
+        for folder, value in zip(folder_paths, rows[file]):
+            entry[str(folder)] = value
+        yield entry
+
+
+def _run_task(task):
+    # (file, index, func, path), kept a plain tuple so process pools can pickle it
+    return task[2](task[3])
+
+
+def _map_groups(func, groups, jobs: int = 1, use_processes: bool = False):
+    """
+    Hash groups of copies of the same file on the pool and yield (file, [hash per copy]) once a group is complete.
+    A group is (file, [(path, known_hash or None), ...]), known hashes are not recomputed.
+    """
+    waiting = {}
+    ready = deque()
+
+    def tasks():
+        for file, group in groups:
+            hashes = [known for _, known in group]
+            todo = hashes.count(None)
+            if todo == 0:
+                ready.append((file, hashes))
+                continue
+            waiting[file] = [hashes, todo]
+            for i, (path, known) in enumerate(group):
+                if known is None:
+                    yield (file, i, func, path)
+
+    for task, sha in parallel_map(_run_task, tasks(), jobs=jobs, use_processes=use_processes):
+        while ready:
+            yield ready.popleft()
+        file, i = task[0], task[1]
+        waiting[file][0][i] = sha
+        waiting[file][1] -= 1
+        if waiting[file][1] == 0:
+            yield file, waiting.pop(file)[0]
+    while ready:
+        yield ready.popleft()
 
 
 def to_html(
-    diff_result: List[dict], folder_paths: List[Path], output_file: Path
-) -> None:
+    diff_result: Iterable[dict], folder_paths: List[Path], output_file: Path, page_size: int = 0
+) -> int:
     """
     Render the diff result to an HTML file as a table.
+    Rows are written as they are read, so diff_result can be the iter_diffs() generator.
+    With page_size > 0 the table is split over linked pages, see writers.HtmlWriter.
+    Returns the number of rows written.
     """
-    html = []
-    html.append('<html><head><meta charset="utf-8"><title>Directory Diff</title>')
-    html.append(
-        "<style>table {border-collapse: collapse;} th, td {border: 1px solid #ccc; padding: 4px;} th {background: #eee;}</style>"
-    )
-    html.append("</head><body>")
-    html.append("<h2>Directory Diff</h2>")
-    html.append("<table>")
-    html.append("<tr><th>File</th>")
-    for folder in folder_paths:
-        html.append(f"<th>{folder}</th>")
-    html.append("</tr>")
-    for row in diff_result:
-        html.append(f'<tr><td>{row["file"]}</td>')
-        for folder in folder_paths:
-            val = row.get(str(folder), "")
-            html.append(f'<td>{val if val is not None else ""}</td>')
-        html.append("</tr>")
-    html.append("</table></body></html>")
-    output_file.write_text("\n".join(html), encoding="utf-8")
+    with HtmlWriter(output_file, folder_paths, page_size=page_size) as writer:
+        return writer.write_all(diff_result)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Generator, Iterator, List, Set, Tuple
+
+from .diff import hash_file, parallel_map
+from .table import merge_sorted
+
+
+class Snapshot:
+    """
+    (path, stat, sha256) of every file under one or more roots, kept in a SQLite file between runs.
+    refresh() brings a root up to date by only listing directories whose mtime changed since the last run:
+    in an unchanged directory the entries are taken from the snapshot and nothing in it is stat'ed
+    apart from its subdirectories. A file rewritten in place does not change its directory's mtime, so
+    such edits are only seen when the directory changes for another reason or the file is reported in
+    an events file (one changed path per line, e.g. written by
+    `inotifywait -m -r -e modify,create,delete,move --format '%w%f' ROOT >> events.log`).
+    Usage example:
+        with Snapshot(Path("snap.db")) as snap:
+            snap.refresh(Path("/data/build"))
+            for rel_path, digest in snap.iter_hashes(Path("/data/build")):
+                ...
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS roots (root TEXT PRIMARY KEY, filters TEXT, events_offset INTEGER);
+            CREATE TABLE IF NOT EXISTS dirs (
+                root TEXT, path TEXT, parent TEXT, mtime_ns INTEGER, PRIMARY KEY (root, path));
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (root, parent);
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT, path TEXT, dir TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER,
+                sha256 BLOB, PRIMARY KEY (root, path));
+            CREATE INDEX IF NOT EXISTS files_dir ON files (root, dir);
+            """
+        )
+
+    @staticmethod
+    def _root_key(root: Path) -> str:
+        return str(Path(root).resolve())
+
+    def _read_events(self, key: str, events_file: Path, offset: int) -> Tuple[Set[str], int]:
+        # root relative paths named by events appended since the last run, plus their parent directories
+        dirty = set()
+        with open(events_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size < offset:
+                # the file was rotated or truncated
+                offset = 0
+            f.seek(offset)
+            for line in f:
+                path = os.fsdecode(line.rstrip(b"\n"))
+                if not path:
+                    continue
+                try:
+                    rel = Path(path).resolve().relative_to(key) if os.path.isabs(path) else Path(path)
+                except ValueError:
+                    continue
+                rel = rel.as_posix()
+                rel = "" if rel == "." else rel
+                dirty.add(rel)
+                dirty.add(os.path.dirname(rel))
+            offset = f.tell()
+        return dirty, offset
+
+    def refresh(
+        self,
+        root: Path,
+        file_exts: List[str] = None,
+        exclude_rep_path: List[str] = None,
+        jobs: int = 1,
+        use_processes: bool = False,
+        events_file: Path = None,
+        stats: dict = None,
+    ) -> dict:
+        """
+        Bring the snapshot of root up to date and return counts of what had to be looked at.
+        Changing file_exts or exclude_rep_path since the previous run starts the root over.
+        """
+        stats = stats if stats is not None else {}
+        for k in ("dirs", "dirs_listed", "files_stat", "files_hashed", "files_removed"):
+            stats.setdefault(k, 0)
+        root = Path(root)
+        key = self._root_key(root)
+        filters = json.dumps([sorted(file_exts or []), sorted(exclude_rep_path or [])])
+        row = self.conn.execute("SELECT filters, events_offset FROM roots WHERE root = ?", (key,)).fetchone()
+        if row is not None and row[0] != filters:
+            self.forget(root)
+            row = None
+        offset = row[1] if row is not None else 0
+
+        dirty = set()
+        if events_file is not None and Path(events_file).exists():
+            dirty, offset = self._read_events(key, events_file, offset)
+
+        def wanted(rel: str) -> bool:
+            if file_exts and not any(rel.endswith(ext) for ext in file_exts):
+                return False
+            if exclude_rep_path and any(rel.startswith(exclude) for exclude in exclude_rep_path):
+                return False
+            return True
+
+        to_hash = []
+        pending_dirs = []
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(key, rel_dir) if rel_dir else key
+            try:
+                dir_mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                self._remove_dir(key, rel_dir, stats)
+                continue
+            stats["dirs"] += 1
+            known = self.conn.execute(
+                "SELECT mtime_ns FROM dirs WHERE root = ? AND path = ?", (key, rel_dir)
+            ).fetchone()
+            if known is not None and known[0] == dir_mtime and rel_dir not in dirty:
+                # nothing was added, removed or renamed here since the last run and no event names
+                # a file in it, so its file rows are still current
+                stack.extend(
+                    path for (path,) in self.conn.execute(
+                        "SELECT path FROM dirs WHERE root = ? AND parent = ?", (key, rel_dir)
+                    )
+                )
+                continue
+
+            stats["dirs_listed"] += 1
+            subdirs, files = self._list_dir(abs_dir, rel_dir)
+            old_subdirs = {
+                path for (path,) in self.conn.execute(
+                    "SELECT path FROM dirs WHERE root = ? AND parent = ?", (key, rel_dir)
+                )
+            }
+            for gone in old_subdirs - set(subdirs):
+                self._remove_dir(key, gone, stats)
+            old_files = {
+                path: (size, mtime_ns, inode)
+                for path, size, mtime_ns, inode in self.conn.execute(
+                    "SELECT path, size, mtime_ns, inode FROM files WHERE root = ? AND dir = ?", (key, rel_dir)
+                )
+            }
+            hashing = len(to_hash)
+            for rel, st in files.items():
+                if not wanted(rel):
+                    continue
+                stats["files_stat"] += 1
+                if old_files.pop(rel, None) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                    to_hash.append((rel, st))
+            dir_row = (key, rel_dir, os.path.dirname(rel_dir) if rel_dir else None, dir_mtime)
+            with self.conn:
+                self.conn.executemany(
+                    "DELETE FROM files WHERE root = ? AND path = ?", ((key, path) for path in old_files)
+                )
+                stats["files_removed"] += len(old_files)
+                if len(to_hash) == hashing:
+                    self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", dir_row)
+                else:
+                    # its mtime is only recorded once its files are hashed and stored, a run that fails
+                    # or is interrupted before that lists the directory again next time
+                    pending_dirs.append(dir_row)
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO dirs VALUES (?, ?, ?, NULL)",
+                    ((key, sub, rel_dir) for sub in subdirs),
+                )
+            stack.extend(subdirs)
+
+        paths = {os.path.join(key, rel): (rel, st) for rel, st in to_hash}
+        batch = []
+        for path, sha in parallel_map(hash_file, list(paths), jobs=jobs, use_processes=use_processes):
+            rel, st = paths[path]
+            batch.append((key, rel, os.path.dirname(rel), st.st_size, st.st_mtime_ns, st.st_ino, bytes.fromhex(sha)))
+            if len(batch) >= 10_000:
+                self._store_files(batch)
+        self._store_files(batch, pending_dirs)
+        stats["files_hashed"] += len(paths)
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO roots VALUES (?, ?, ?)", (key, filters, offset))
+        return stats
+
+    @staticmethod
+    def _list_dir(abs_dir: str, rel_dir: str):
+        # like rglob("*") + is_file(): symlinked files are kept, symlinked dirs are not entered
+        subdirs = []
+        files = {}
+        try:
+            entries = list(os.scandir(abs_dir))
+        except OSError:
+            return subdirs, files
+        for entry in entries:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(rel)
+                elif entry.is_file():
+                    files[rel] = entry.stat()
+            except OSError:
+                continue
+        return subdirs, files
+
+    def _store_files(self, batch: list, dirs: list = ()) -> None:
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            self.conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", dirs)
+        batch.clear()
+
+    def _remove_dir(self, key: str, rel_dir: str, stats: dict) -> None:
+        # drop a vanished directory and everything recorded below it
+        pattern = rel_dir.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"
+        with self.conn:
+            cur = self.conn.execute(
+                "DELETE FROM files WHERE root = ? AND (dir = ? OR dir LIKE ? ESCAPE '\\')", (key, rel_dir, pattern)
+            )
+            stats["files_removed"] += cur.rowcount
+            self.conn.execute(
+                "DELETE FROM dirs WHERE root = ? AND (path = ? OR path LIKE ? ESCAPE '\\')", (key, rel_dir, pattern)
+            )
+
+    def forget(self, root: Path) -> None:
+        """
+        Remove everything recorded for root.
+        """
+        key = self._root_key(root)
+        with self.conn:
+            for table in ("files", "dirs", "roots"):
+                self.conn.execute(f"DELETE FROM {table} WHERE root = ?", (key,))
+
+    def iter_hashes(self, root: Path) -> Iterator[Tuple[str, bytes]]:
+        """
+        (relative_path, raw sha256) of the files under root, in path order.
+        """
+        yield from self.conn.execute(
+            "SELECT path, sha256 FROM files WHERE root = ? ORDER BY path", (self._root_key(root),)
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_snapshot_diffs(
+    folder_paths: List[Path],
+    snapshot_path: Path,
+    file_exts: List[str] = None,
+    exclude_rep_path: List[str] = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    events_file: Path = None,
+    stats: dict = None,
+) -> Generator[dict, None, None]:
+    """
+    Same rows as iter_diffs() with the full strategy, computed from a Snapshot refreshed for every folder.
+    The first run builds the snapshot, later runs only look at what changed since.
+    """
+    if len(folder_paths) < 2:
+        raise ValueError("At least two folder paths are required.")
+    if len(set(folder_paths)) < 2:
+        raise ValueError("All folder paths must be different.")
+    stats = stats if stats is not None else {}
+    with Snapshot(snapshot_path) as snap:
+        for folder in folder_paths:
+            snap.refresh(
+                folder,
+                file_exts=file_exts,
+                exclude_rep_path=exclude_rep_path,
+                jobs=jobs,
+                use_processes=use_processes,
+                events_file=events_file,
+                stats=stats,
+            )
+        stats["files"] = 0
+        for file, digests in merge_sorted([snap.iter_hashes(folder) for folder in folder_paths]):
+            stats["files"] += 1
+            if all(d == digests[0] for d in digests):
+                continue
+            entry = {"file": file}
+            for folder, d in zip(folder_paths, digests):
+                entry[str(folder)] = d.hex() if d is not None else None
+            yield entry
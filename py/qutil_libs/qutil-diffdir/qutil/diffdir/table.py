@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import heapq
+import mmap
+import os
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# pairs buffered as python objects before being sorted and packed into a run
+DEFAULT_RUN_SIZE = 64 * 1024
+
+
+def _put_varint(buf: bytearray, n: int) -> None:
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _get_varint(buf, pos: int) -> Tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def pack_run(pairs: Iterable[Tuple[str, bytes]]) -> bytearray:
+    """
+    Pack (path, value) pairs, already sorted by path, into one buffer.
+    Each path is front-coded: only the bytes it does not share with the previous path are stored.
+    """
+    buf = bytearray()
+    prev = b""
+    for path, value in pairs:
+        raw = path.encode("utf-8", "surrogateescape")
+        shared = 0
+        limit = min(len(prev), len(raw))
+        while shared < limit and prev[shared] == raw[shared]:
+            shared += 1
+        _put_varint(buf, shared)
+        _put_varint(buf, len(raw) - shared)
+        buf += raw[shared:]
+        _put_varint(buf, len(value))
+        buf += value
+        prev = raw
+    return buf
+
+
+def iter_run(buf) -> Iterator[Tuple[str, bytes]]:
+    """
+    Decode a buffer made by pack_run back into (path, value) pairs.
+    """
+    view = memoryview(buf)
+    pos = 0
+    prev = b""
+    end = len(buf)
+    try:
+        while pos < end:
+            shared, pos = _get_varint(buf, pos)
+            length, pos = _get_varint(buf, pos)
+            raw = prev[:shared] + bytes(view[pos:pos + length])
+            pos += length
+            length, pos = _get_varint(buf, pos)
+            value = bytes(view[pos:pos + length])
+            pos += length
+            prev = raw
+            yield raw.decode("utf-8", "surrogateescape"), value
+    finally:
+        # an mmap backed buffer can only be closed once no view is left on it
+        view.release()
+
+
+class SortedTable(object):
+    """
+    Memory-compact table of (relative_path, value) pairs, iterated in sorted path order.
+    Values are raw bytes (e.g. a 32-byte sha256 digest rather than its 64-char hex string) and paths are
+    front-coded, so a file costs roughly its path suffix plus its value instead of two python objects.
+    Pairs can be added in any order, they are sorted in runs of run_size and the runs are merged on iteration.
+    Usage example:
+        table = SortedTable()
+        table.add("bin/app", digest)
+        for path, digest in table:
+            ...
+    """
+
+    def __init__(self, run_size: int = DEFAULT_RUN_SIZE):
+        self.run_size = run_size
+        self.runs: List[bytearray] = []
+        self._pending: List[Tuple[str, bytes]] = []
+        self._count = 0
+
+    def add(self, path: str, value: bytes) -> None:
+        self._pending.append((path, value))
+        self._count += 1
+        if len(self._pending) >= self.run_size:
+            self._seal()
+
+    def _seal(self) -> None:
+        if self._pending:
+            self._pending.sort(key=itemgetter(0))
+            self.runs.append(self._new_run(self._pending))
+            self._pending = []
+
+    def _new_run(self, pairs: List[Tuple[str, bytes]]):
+        return pack_run(pairs)
+
+    def _iter_run(self, run) -> Iterator[Tuple[str, bytes]]:
+        return iter_run(run)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        self._seal()
+        if len(self.runs) == 1:
+            return self._iter_run(self.runs[0])
+        return heapq.merge(*(self._iter_run(run) for run in self.runs), key=itemgetter(0))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held by the packed runs.
+        """
+        return sum(len(run) for run in self.runs)
+
+
+class SpilledTable(SortedTable):
+    """
+    SortedTable whose packed runs are written to files under spill_dir instead of kept in memory,
+    so only the run being filled is held in RAM. Iterating k-way merges the run files through mmap.
+    """
+
+    def __init__(self, spill_dir: Path, run_size: int = DEFAULT_RUN_SIZE):
+        super().__init__(run_size=run_size)
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def _new_run(self, pairs: List[Tuple[str, bytes]]) -> str:
+        fd, path = tempfile.mkstemp(prefix="run_", suffix=".bin", dir=str(self.spill_dir))
+        with os.fdopen(fd, "wb") as f:
+            f.write(pack_run(pairs))
+        return path
+
+    def _iter_run(self, path: str) -> Iterator[Tuple[str, bytes]]:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from iter_run(mm)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held by the run files.
+        """
+        return sum(os.path.getsize(path) for path in self.runs)
+
+    def close(self) -> None:
+        """
+        Remove the run files.
+        """
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+
+
+def merge_sorted(
+    streams: List[Iterable[Tuple[str, bytes]]]
+) -> Iterator[Tuple[str, List[Optional[bytes]]]]:
+    """
+    Merge N streams of (path, value) sorted by path into (path, [value or None per stream]) rows,
+    in path order, without building the union of all paths.
+    """
+
+    def tagged(index, stream):
+        for path, value in stream:
+            yield path, index, value
+
+    merged = heapq.merge(*(tagged(index, stream) for index, stream in enumerate(streams)))
+    for path, group in groupby(merged, key=itemgetter(0)):
+        row = [None] * len(streams)
+        for _, index, value in group:
+            row[index] = value
+        yield path, row
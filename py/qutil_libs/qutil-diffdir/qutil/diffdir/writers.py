@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import csv
+import html
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, List
+
+# rows per HTML page, small enough for a browser to render without choking
+DEFAULT_PAGE_SIZE = 10_000
+FORMATS = ("html", "json", "csv")
+
+_STYLE = (
+    "<style>table {border-collapse: collapse;} th, td {border: 1px solid #ccc; padding: 4px;} "
+    "th {background: #eee;} .nav {margin: 8px 0;}</style>"
+)
+
+
+class DiffWriter(ABC):
+    """
+    Base class of the streaming diff writers: rows are written one at a time as they are produced,
+    nothing is buffered beyond the file object.
+    Usage example:
+        with NdjsonWriter(Path("diff.ndjson"), folders) as writer:
+            for row in iter_diffs(folders):
+                writer.write(row)
+    """
+
+    def __init__(self, output_file: Path, folder_paths: List[Path]):
+        self.output_file = Path(output_file)
+        self.folder_paths = folder_paths
+        self.columns = [str(folder) for folder in folder_paths]
+        self.count = 0
+
+    def write(self, row: dict) -> None:
+        self._write_row(row)
+        self.count += 1
+
+    def write_all(self, rows: Iterable[dict]) -> int:
+        for row in rows:
+            self.write(row)
+        return self.count
+
+    @abstractmethod
+    def _write_row(self, row: dict) -> None:
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class NdjsonWriter(DiffWriter):
+    """
+    One JSON object per line, the same dicts diffs() returns.
+    """
+
+    def __init__(self, output_file: Path, folder_paths: List[Path]):
+        super().__init__(output_file, folder_paths)
+        self.out = open(self.output_file, "w", encoding="utf-8")
+
+    def _write_row(self, row: dict) -> None:
+        self.out.write(json.dumps(row, ensure_ascii=False))
+        self.out.write("\n")
+
+    def close(self) -> None:
+        self.out.close()
+
+
+class CsvWriter(DiffWriter):
+    """
+    A "File" column plus one column per folder, empty where the file is missing.
+    """
+
+    def __init__(self, output_file: Path, folder_paths: List[Path]):
+        super().__init__(output_file, folder_paths)
+        self.out = open(self.output_file, "w", encoding="utf-8", newline="")
+        self.csv = csv.writer(self.out)
+        self.csv.writerow(["File"] + self.columns)
+
+    def _write_row(self, row: dict) -> None:
+        values = [row.get(column) for column in self.columns]
+        self.csv.writerow([row["file"]] + ["" if v is None else v for v in values])
+
+    def close(self) -> None:
+        self.out.close()
+
+
+class HtmlWriter(DiffWriter):
+    """
+    HTML table split into pages of page_size rows: output_file is the first page and the next ones are
+    <stem>_2<suffix>, <stem>_3<suffix>, ... linked with previous/next links. page_size 0 means one page.
+    """
+
+    def __init__(self, output_file: Path, folder_paths: List[Path], page_size: int = DEFAULT_PAGE_SIZE):
+        super().__init__(output_file, folder_paths)
+        self.page_size = page_size
+        self.page = 0
+        self.page_rows = 0
+        self.out = None
+        self.pages: List[Path] = []
+        self._open_page()
+
+    def page_path(self, page: int) -> Path:
+        if page == 1:
+            return self.output_file
+        return self.output_file.with_name(f"{self.output_file.stem}_{page}{self.output_file.suffix}")
+
+    def _nav(self, has_next: bool) -> str:
+        links = []
+        if self.page > 1:
+            links.append(f'<a href="{html.escape(self.page_path(self.page - 1).name)}">&laquo; previous</a>')
+        links.append(f"page {self.page}")
+        if has_next:
+            links.append(f'<a href="{html.escape(self.page_path(self.page + 1).name)}">next &raquo;</a>')
+        return f'<div class="nav">{" | ".join(links)}</div>\n'
+
+    def _open_page(self) -> None:
+        self.page += 1
+        self.page_rows = 0
+        path = self.page_path(self.page)
+        self.pages.append(path)
+        self.out = open(path, "w", encoding="utf-8")
+        self.out.write('<html><head><meta charset="utf-8"><title>Directory Diff</title>\n')
+        self.out.write(_STYLE + "\n")
+        self.out.write("</head><body>\n")
+        self.out.write("<h2>Directory Diff</h2>\n")
+        if self.page > 1:
+            self.out.write(self._nav(has_next=False))
+        self.out.write("<table>\n")
+        self.out.write("<tr><th>File</th>\n")
+        for column in self.columns:
+            self.out.write(f"<th>{html.escape(column)}</th>\n")
+        self.out.write("</tr>\n")
+
+    def _close_page(self, has_next: bool) -> None:
+        self.out.write("</table>\n")
+        if has_next or self.page > 1:
+            self.out.write(self._nav(has_next))
+        self.out.write("</body></html>")
+        self.out.close()
+
+    def _write_row(self, row: dict) -> None:
+        if self.page_size and self.page_rows >= self.page_size:
+            # only now is it known that the page has a successor
+            self._close_page(has_next=True)
+            self._open_page()
+        self.out.write(f'<tr><td>{html.escape(row["file"])}</td>\n')
+        for column in self.columns:
+            val = row.get(column)
+            self.out.write(f'<td>{html.escape(val) if val is not None else ""}</td>\n')
+        self.out.write("</tr>\n")
+        self.page_rows += 1
+
+    def close(self) -> None:
+        self._close_page(has_next=False)
+
+
+def open_writer(
+    output_file: Path, folder_paths: List[Path], fmt: str = None, page_size: int = DEFAULT_PAGE_SIZE
+) -> DiffWriter:
+    """
+    Writer for fmt (one of FORMATS), guessed from the output file suffix when fmt is None.
+    """
+    if fmt is None:
+        suffix = Path(output_file).suffix.lower()
+        fmt = {".json": "json", ".ndjson": "json", ".jsonl": "json", ".csv": "csv"}.get(suffix, "html")
+    if fmt == "html":
+        return HtmlWriter(output_file, folder_paths, page_size=page_size)
+    if fmt == "json":
+        return NdjsonWriter(output_file, folder_paths)
+    if fmt == "csv":
+        return CsvWriter(output_file, folder_paths)
+    raise ValueError(f"Unknown format '{fmt}', expected one of {FORMATS}.")
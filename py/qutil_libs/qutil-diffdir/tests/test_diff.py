@@ -0,0 +1,285 @@
+import io
+import json
+import os
+import random
+import sys
+from hashlib import sha256
+
+import pytest
+
+from qutil.diffdir import chunks, snapshot
+from qutil.diffdir.cache import HashCache
+from qutil.diffdir.chunks import chunk_file, diff_files, iter_chunk_diffs
+from qutil.diffdir.diff import calculate_files_sha256, diffs, hash_file, iter_diffs
+from qutil.diffdir.snapshot import Snapshot, iter_snapshot_diffs
+from qutil.diffdir.table import SortedTable, SpilledTable, merge_sorted
+from qutil.diffdir.writers import DiffWriter, open_writer
+
+
+def make_tree(root, files):
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return root
+
+
+def test_hash_file(tmp_path):
+    f = tmp_path / "a.bin"
+    f.write_bytes(b"x" * 3000)
+    assert hash_file(f, chunk_size=1024) == sha256(b"x" * 3000).hexdigest()
+
+
+def test_calculate_files_sha256_parallel(tmp_path):
+    files = {f"d{i % 3}/f{i}.txt": str(i).encode() for i in range(20)}
+    make_tree(tmp_path, files)
+    serial = sorted((str(p), h) for p, h in calculate_files_sha256(tmp_path))
+    parallel = sorted((str(p), h) for p, h in calculate_files_sha256(tmp_path, jobs=4))
+    assert serial == parallel
+    assert len(serial) == 20
+
+
+def test_diffs(tmp_path):
+    a = make_tree(tmp_path / "a", {"same.txt": b"1", "diff.txt": b"a", "only_a.txt": b"x"})
+    b = make_tree(tmp_path / "b", {"same.txt": b"1", "diff.txt": b"b"})
+    result = diffs([a, b], jobs=2)
+    assert [row["file"] for row in result] == ["diff.txt", "only_a.txt"]
+    assert result[1][str(b)] is None
+
+
+def test_diffs_deep_tree(tmp_path):
+    # deeper than the recursion limit, still well under PATH_MAX
+    depth = sys.getrecursionlimit() + 100
+    deepest = str(tmp_path)
+    for _ in range(depth):
+        deepest = os.path.join(deepest, "d")
+        os.mkdir(deepest)
+    with open(os.path.join(deepest, "f.txt"), "wb") as f:
+        f.write(b"x")
+    assert [sha for _, sha in calculate_files_sha256(tmp_path)] == [sha256(b"x").hexdigest()]
+    # pytest removes old temp dirs with shutil.rmtree, which recurses too
+    os.remove(os.path.join(deepest, "f.txt"))
+    while deepest != str(tmp_path):
+        os.rmdir(deepest)
+        deepest = os.path.dirname(deepest)
+
+
+def test_hash_cache(tmp_path):
+    root = make_tree(tmp_path / "root", {"a.txt": b"1", "b.txt": b"2"})
+    cache_dir = tmp_path / "cache"
+    with HashCache.for_root(root, cache_dir=cache_dir) as cache:
+        first = sorted(calculate_files_sha256(root, cache=cache))
+        assert cache.misses == 2
+    (root / "b.txt").write_bytes(b"changed")
+    with HashCache.for_root(root, cache_dir=cache_dir) as cache:
+        second = sorted(calculate_files_sha256(root, cache=cache))
+        assert (cache.hits, cache.misses) == (1, 1)
+    assert first[0] == second[0]
+    assert second[1][1] == sha256(b"changed").hexdigest()
+
+
+def test_diffs_cache_stats(tmp_path):
+    big = b"h" * 200_000
+    a = make_tree(tmp_path / "a", {"x.txt": b"1", "y.bin": big})
+    b = make_tree(tmp_path / "b", {"x.txt": b"2", "y.bin": big})
+    for strategy in ("full", "tiered"):
+        cache_dir = tmp_path / strategy
+        first, second = {}, {}
+        diffs([a, b], use_cache=True, cache_dir=cache_dir, strategy=strategy, stats=first)
+        diffs([a, b], use_cache=True, cache_dir=cache_dir, strategy=strategy, stats=second)
+        assert (first["full_hashed"], first["cache_hits"]) == (4, 0)
+        # the second run reads nothing, cache hits are not hashes
+        assert (second["full_hashed"], second["cache_hits"]) == (0, 4)
+
+
+def test_hash_cache_eviction(tmp_path):
+    root = make_tree(tmp_path / "root", {f"{i}.txt": b"x" for i in range(5)})
+    with HashCache.for_root(root, cache_dir=tmp_path / "cache", max_entries=3) as cache:
+        calculate_files_sha256(root, cache=cache)
+    with HashCache.for_root(root, cache_dir=tmp_path / "cache") as cache:
+        (count,) = cache.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()
+    assert count == 3
+
+
+def test_diffs_tiered(tmp_path):
+    big = b"h" * 200_000
+    a = make_tree(tmp_path / "a", {
+        "same.bin": big, "size.bin": b"12", "middle.bin": big, "head.bin": big, "only_a": b"x",
+    })
+    b = make_tree(tmp_path / "b", {
+        "same.bin": big, "size.bin": b"123", "middle.bin": big[:100_000] + b"X" + big[100_001:],
+        "head.bin": b"X" + big[1:],
+    })
+    full = diffs([a, b])
+    stats = {}
+    tiered = diffs([a, b], strategy="tiered", stats=stats)
+    assert [row["file"] for row in tiered] == [row["file"] for row in full]
+    by_file = {row["file"]: row for row in tiered}
+    assert by_file["size.bin"][str(a)] == "size:2"
+    assert by_file["head.bin"][str(a)].startswith("partial:")
+    assert by_file["middle.bin"] == next(row for row in full if row["file"] == "middle.bin")
+    assert (stats["missing"], stats["size_differs"], stats["partial_differs"], stats["full_differs"]) == (1, 1, 1, 1)
+
+    stats = {}
+    size_only = diffs([a, b], strategy="size-only", stats=stats)
+    assert [row["file"] for row in size_only] == ["only_a", "size.bin"]
+    assert stats["bytes_read"] == 0
+
+
+def test_sorted_table():
+    pairs = [(f"dir{i % 7}/file{i}.txt", bytes([i % 256]) * 32) for i in range(1000)]
+    table = SortedTable(run_size=64)
+    for path, value in reversed(pairs):
+        table.add(path, value)
+    assert len(table) == 1000
+    assert list(table) == sorted(pairs)
+    assert table.nbytes < sum(len(p) + 32 for p, _ in pairs)
+
+
+def test_merge_sorted():
+    rows = list(merge_sorted([[("a", b"1"), ("c", b"3")], [("b", b"2"), ("c", b"4")]]))
+    assert rows == [("a", [b"1", None]), ("b", [None, b"2"]), ("c", [b"3", b"4"])]
+
+
+def test_spilled_table(tmp_path):
+    pairs = [(f"d{i % 5}/f{i}", bytes([i % 256]) * 4) for i in range(500)]
+    table = SpilledTable(tmp_path / "runs", run_size=50)
+    for path, value in pairs:
+        table.add(path, value)
+    assert list(table) == sorted(pairs)
+    assert len(list((tmp_path / "runs").iterdir())) == 10
+    table.close()
+    assert list((tmp_path / "runs").iterdir()) == []
+
+
+def test_iter_diffs_spilled(tmp_path):
+    a = make_tree(tmp_path / "a", {f"f{i}": str(i).encode() for i in range(30)})
+    b = make_tree(tmp_path / "b", {f"f{i}": str(i % 10).encode() for i in range(30)})
+    rows = iter_diffs([a, b], spill_dir=tmp_path / "spill")
+    assert [row["file"] for row in rows] == [row["file"] for row in diffs([a, b])]
+    assert list((tmp_path / "spill").iterdir()) == []
+
+
+def test_writers(tmp_path):
+    folders = [tmp_path / "a", tmp_path / "b"]
+    rows = [{"file": f"f{i}", str(folders[0]): "x", str(folders[1]): None} for i in range(5)]
+
+    with open_writer(tmp_path / "out.html", folders, page_size=2) as writer:
+        assert writer.write_all(iter(rows)) == 5
+    assert [p.name for p in writer.pages] == ["out.html", "out_2.html", "out_3.html"]
+    assert 'href="out_3.html"' in (tmp_path / "out_2.html").read_text()
+
+    with open_writer(tmp_path / "out.csv", folders) as writer:
+        writer.write_all(rows)
+    assert (tmp_path / "out.csv").read_text().splitlines()[1] == "f0,x,"
+
+    with open_writer(tmp_path / "out.ndjson", folders) as writer:
+        writer.write_all(rows)
+    assert json.loads((tmp_path / "out.ndjson").read_text().splitlines()[4]) == rows[4]
+
+    class RowsOnly(DiffWriter):
+        def _write_row(self, row):
+            pass
+
+    # a writer missing a method fails before any row, not when the report is half written
+    with pytest.raises(TypeError):
+        RowsOnly(tmp_path / "out.txt", folders)
+
+
+def test_snapshot_refresh(tmp_path):
+    root = make_tree(tmp_path / "root", {"a/1.txt": b"1", "a/2.txt": b"2", "b/c/3.txt": b"3"})
+    with Snapshot(tmp_path / "snap.db") as snap:
+        first = snap.refresh(root)
+        assert (first["dirs_listed"], first["files_hashed"]) == (4, 3)
+
+        again = snap.refresh(root)
+        assert (again["dirs_listed"], again["files_stat"], again["files_hashed"]) == (0, 0, 0)
+
+        (root / "a" / "new.txt").write_bytes(b"new")
+        for path in (root / "b").rglob("*"):
+            if path.is_file():
+                path.unlink()
+        (root / "b" / "c").rmdir()
+        stats = snap.refresh(root)
+        assert (stats["dirs_listed"], stats["files_hashed"], stats["files_removed"]) == (2, 1, 1)
+        assert [path for path, _ in snap.iter_hashes(root)] == ["a/1.txt", "a/2.txt", "a/new.txt"]
+
+        # an in-place rewrite only shows up through the events file
+        (root / "a" / "1.txt").write_bytes(b"rewritten")
+        events = tmp_path / "events.log"
+        events.write_text(f"{root / 'a' / '1.txt'}\n")
+        stats = snap.refresh(root, events_file=events)
+        assert stats["files_hashed"] == 1
+        assert dict(snap.iter_hashes(root))["a/1.txt"] == sha256(b"rewritten").digest()
+
+
+def test_snapshot_refresh_interrupted(tmp_path, monkeypatch):
+    root = make_tree(tmp_path / "root", {"a/1.txt": b"1"})
+    with Snapshot(tmp_path / "snap.db") as snap:
+        snap.refresh(root)
+        (root / "a" / "new.txt").write_bytes(b"new")
+
+        def fail(path):
+            raise OSError("read error")
+
+        monkeypatch.setattr(snapshot, "hash_file", fail)
+        with pytest.raises(OSError):
+            snap.refresh(root)
+        monkeypatch.undo()
+        # the failed run must not have marked "a" as up to date
+        stats = snap.refresh(root)
+        assert (stats["dirs_listed"], stats["files_hashed"]) == (1, 1)
+        assert [path for path, _ in snap.iter_hashes(root)] == ["a/1.txt", "a/new.txt"]
+
+
+def test_iter_snapshot_diffs(tmp_path):
+    a = make_tree(tmp_path / "a", {"same.txt": b"1", "diff.txt": b"a", "only_a.txt": b"x"})
+    b = make_tree(tmp_path / "b", {"same.txt": b"1", "diff.txt": b"b"})
+    snap = tmp_path / "snap.db"
+    assert list(iter_snapshot_diffs([a, b], snap)) == diffs([a, b])
+    (b / "only_a.txt").write_bytes(b"x")
+    stats = {}
+    assert [row["file"] for row in iter_snapshot_diffs([a, b], snap, stats=stats)] == ["diff.txt"]
+    assert stats["files_hashed"] == 1
+
+
+def test_chunk_diff(tmp_path):
+    data = random.Random(1).getrandbits(8 * 400_000).to_bytes(400_000, "little")
+    a = tmp_path / "a.bin"
+    b = tmp_path / "b.bin"
+    a.write_bytes(data)
+    # insert 100 bytes in the middle, a fixed-size block diff would see everything after it as changed
+    b.write_bytes(data[:200_000] + b"X" * 100 + data[200_000:])
+    file_chunks = chunk_file(a, avg_size=4096)
+    assert sum(c.length for c in file_chunks) == len(data)
+    assert all(c.length <= 4 * 4096 for c in file_chunks)
+    result = diff_files(a, b, avg_size=4096)
+    assert result.size_b == len(data) + 100
+    assert result.differing_bytes < 5 * 4 * 4096
+    assert len(result.ranges_b) == 1
+    offset, length = result.ranges_b[0]
+    assert offset <= 200_000 and offset + length >= 200_100
+
+    rows = [{"file": "a.bin", str(tmp_path): "x", str(tmp_path / "copy"): "y"}]
+    (tmp_path / "copy").mkdir()
+    (tmp_path / "copy" / "a.bin").write_bytes(b.read_bytes())
+    cache_dir = tmp_path / "cache"
+    for _ in range(2):
+        (row,) = iter_chunk_diffs(rows, [tmp_path, tmp_path / "copy"], 1, avg_size=4096, cache_dir=cache_dir)
+        assert row["chunks"][str(tmp_path / "copy")]["differing_bytes"] == result.differing_bytes
+    # worker processes, one pool for every row
+    results = iter_chunk_diffs(rows * 3, [tmp_path, tmp_path / "copy"], 1, avg_size=4096, jobs=2, use_cache=False)
+    differing = [row["chunks"][str(tmp_path / "copy")]["differing_bytes"] for row in results]
+    assert differing == [result.differing_bytes] * 3
+
+
+def test_chunk_boundaries_numpy_and_python(monkeypatch):
+    # the vectorized rolling hash cuts where the pure python loop does, whatever the read size
+    pytest.importorskip("numpy")
+    rng = random.Random(2)
+    data = b"\0" * 50_000 + rng.getrandbits(8 * 300_000).to_bytes(300_000, "little")
+    expected = list(chunks.iter_chunks(io.BytesIO(data), avg_size=256))
+    monkeypatch.setattr(chunks, "READ_SIZE", 1000)
+    assert list(chunks.iter_chunks(io.BytesIO(data), avg_size=256)) == expected
+    monkeypatch.setattr(chunks, "numpy", None)
+    assert list(chunks.iter_chunks(io.BytesIO(data), avg_size=256)) == expected
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Throughput and peak disk usage of an archive backup: staged (Backup copy tree, then tar of it, the
+copy removed afterwards) against Backup.backup_archive streaming straight into the compressed tar.
+Peak disk usage is sampled from the output folder while each run goes on.
+
+    python benchmarks/bench_backup.py --files 2000 --file-size 256
+    python benchmarks/bench_backup.py --src /etc --compression gzip zstd
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from qutil.filesystem.archive import write_archive
+from qutil.filesystem.backup import Backup
+
+
+def build_tree(root, files, file_size, files_per_dir=100):
+    # half random (incompressible), half repetitive text, file_size KB each
+    for i in range(files):
+        folder = os.path.join(root, f"dir_{i // files_per_dir}")
+        os.makedirs(folder, exist_ok=True)
+        size = file_size * 1024
+        data = os.urandom(size // 2) + (b"some log line %d\n" % i) * (size // 2 // 18 + 1)
+        with open(os.path.join(folder, f"file_{i}.dat"), "wb") as f:
+            f.write(data[:size])
+
+
+def disk_usage(top):
+    total = 0
+    for root, _, files in os.walk(top):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class PeakUsage(object):
+    # samples the disk usage of a folder on a thread until stopped, keeps the maximum
+    def __init__(self, top, interval=0.05):
+        self.top = top
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, disk_usage(self.top))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, disk_usage(self.top))
+
+
+def staged(src, out, compression, jobs):
+    stage = os.path.join(out, "stage")
+    Backup(stage, jobs=jobs).backup(src)
+    stats = write_archive([stage], os.path.join(out, "staged.tar"), compression)
+    shutil.rmtree(stage)
+    return stats
+
+
+def streaming(src, out, compression, jobs):
+    backup = Backup(out)
+    backup.backup_archive(src, os.path.join(out, "streamed.tar"), compression)
+    return backup.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000, help="files in the synthetic tree")
+    parser.add_argument("--file-size", type=int, default=256, help="KB per file")
+    parser.add_argument("--src", default=None, help="existing tree to back up instead of building one")
+    parser.add_argument("--compression", nargs="+", default=["none", "gzip", "zstd"], help="none gzip zstd xz")
+    parser.add_argument("--jobs", type=int, default=8, help="copy threads of the staged backup")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = args.src
+        if src is None:
+            src = os.path.join(tmp, "src")
+            build_tree(src, args.files, args.file_size)
+        source_bytes = disk_usage(src)
+        print(f"source {source_bytes / 1e6:.1f} MB on disk")
+        for compression in args.compression:
+            compression = None if compression == "none" else compression
+            for name, run in (("staged", staged), ("streaming", streaming)):
+                out = os.path.join(tmp, f"out_{name}_{compression}")
+                os.makedirs(out)
+                started = time.perf_counter()
+                with PeakUsage(out) as usage:
+                    stats = run(src, out, compression, args.jobs)
+                elapsed = time.perf_counter() - started
+                print(
+                    f"{name:10} {str(compression):5} {stats['bytes'] / elapsed / 1e6:8.1f} MB/s "
+                    f"archive {stats['archive_bytes'] / 1e6:8.1f} MB  peak disk {usage.peak / 1e6:8.1f} MB"
+                )
+                shutil.rmtree(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Entries per second of os.walk, scan_tree and parallel_scan_tree over a synthetic tree.
+With --latency every os.scandir call first sleeps that many milliseconds, a stand-in for a slow
+FUSE/network mount (SSHFS, CIFS) where each readdir is a round trip.
+
+    python benchmarks/bench_walk.py --entries 1000000
+    python benchmarks/bench_walk.py --entries 20000 --latency 5 --jobs 16
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from qutil.filesystem.folder import parallel_scan_tree, scan_tree
+
+
+def build_tree(root, entries, fanout, files_per_dir):
+    # directories fanout wide, each holding files_per_dir empty files, until entries are created
+    created = 0
+    level = [root]
+    while created < entries:
+        next_level = []
+        for parent in level:
+            for d in range(fanout):
+                path = os.path.join(parent, f"dir_{d}")
+                os.mkdir(path)
+                created += 1
+                for f in range(files_per_dir):
+                    open(os.path.join(path, f"file_{f}.dat"), "wb").close()
+                created += files_per_dir
+                next_level.append(path)
+                if created >= entries:
+                    return created
+        level = next_level
+    return created
+
+
+def count_os_walk(root):
+    return sum(len(dirs) + len(files) for _, dirs, files in os.walk(root))
+
+
+def slow_scandir(latency):
+    real_scandir = os.scandir
+
+    def scandir(path="."):
+        time.sleep(latency)
+        return real_scandir(path)
+
+    return scandir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1_000_000, help="files and directories in the tree")
+    parser.add_argument("--fanout", type=int, default=10, help="sub-directories per directory")
+    parser.add_argument("--files-per-dir", type=int, default=20, help="files per directory")
+    parser.add_argument("--jobs", type=int, default=8, help="threads of parallel_scan_tree")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds added to every os.scandir call")
+    parser.add_argument("--root", default=None, help="existing tree to walk instead of building one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root
+        if root is None:
+            root = tmp
+            started = time.perf_counter()
+            created = build_tree(root, args.entries, args.fanout, args.files_per_dir)
+            print(f"built {created} entries in {time.perf_counter() - started:.1f}s")
+        if args.latency:
+            os.scandir = slow_scandir(args.latency / 1000)
+
+        walkers = (
+            ("os.walk", lambda: count_os_walk(root)),
+            ("scan_tree", lambda: sum(1 for _ in scan_tree(root))),
+            (f"parallel ordered x{args.jobs}", lambda: sum(1 for _ in parallel_scan_tree(root, jobs=args.jobs))),
+            (
+                f"parallel unordered x{args.jobs}",
+                lambda: sum(1 for _ in parallel_scan_tree(root, jobs=args.jobs, ordered=False)),
+            ),
+        )
+        for name, walk in walkers:
+            started = time.perf_counter()
+            count = walk()
+            elapsed = time.perf_counter() - started
+            print(f"{name:24} {count:10} entries {elapsed:8.2f}s {count / elapsed:12.0f} entries/s")
+
+
+if __name__ == "__main__":
+    main()
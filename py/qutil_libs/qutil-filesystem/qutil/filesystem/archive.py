@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+from qutil.filesystem.copier import COPY_BUFFER
+
+try:
+    import zstandard
+except ImportError:  # optional, pip install qutil-filesystem[zstd]
+    zstandard = None
+
+ARCHIVE_COMPRESSIONS = (None, "gzip", "zstd", "xz")
+# archive file suffix by compression
+ARCHIVE_SUFFIX = {None: ".tar", "gzip": ".tar.gz", "zstd": ".tar.zst", "xz": ".tar.xz"}
+# first bytes of a compressed stream, the archive is read by content not by name
+_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd", b"\xfd7zXZ\x00": "xz"}
+
+
+def _threads(threads):
+    return threads or os.cpu_count() or 1
+
+
+def _fileno(fileobj):
+    # file descriptor behind fileobj, None for in-memory streams (BytesIO.fileno() raises)
+    try:
+        return fileobj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _compressing(fileobj, compression, level, threads):
+    # writable stream compressing into fileobj; zstd compresses on threads, gzip through pigz if installed
+    if compression is None:
+        yield fileobj
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ValueError("compression 'zstd' needs the zstandard package")
+        cctx = zstandard.ZstdCompressor(level=level, threads=_threads(threads))
+        with cctx.stream_writer(fileobj, closefd=False) as stream:
+            yield stream
+    elif compression == "gzip" and shutil.which("pigz") and _fileno(fileobj) is not None:
+        fileobj.flush()
+        cmd = ["pigz", f"-{level}", "-p", str(_threads(threads)), "-c"]
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=_fileno(fileobj))
+        try:
+            yield process.stdin
+        finally:
+            process.stdin.close()
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, cmd)
+    elif compression == "gzip":
+        with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level) as stream:
+            yield stream
+    elif compression == "xz":
+        with lzma.LZMAFile(fileobj, "wb", preset=level) as stream:
+            yield stream
+    else:
+        raise ValueError(f"compression must be one of {ARCHIVE_COMPRESSIONS}")
+
+
+def _decompressing(fileobj):
+    # readable stream of the tar inside fileobj, whatever it was compressed with
+    head = fileobj.read(6)
+    compression = next((name for magic, name in _MAGIC.items() if head.startswith(magic)), None)
+    fileobj = _Prepend(head, fileobj)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(fileobj, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("reading zstd archives needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=COPY_BUFFER)
+    return fileobj
+
+
+class _Prepend(object):
+    # file-like object giving back the bytes already read from a non-seekable stream
+    def __init__(self, head, fileobj):
+        self.head = head
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.fileobj.read(), b""
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.fileobj.read(size - len(data))
+        return data
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def write_archive(paths, archive, compression="zstd", level=3, threads=0):
+    """
+    Stream files or folders into one compressed tar, nothing is staged on disk.
+    Members are named by their absolute path without the leading "/", like GNU tar.
+    archive: file path (written aside and renamed when complete) or a writable binary file object,
+             eg: a socket or the stdin of "ssh host 'cat > backup.tar.zst'"
+    compression: None, "gzip", "zstd" or "xz"; threads compress in parallel for zstd, and for gzip when
+                 pigz is installed (0: one per CPU)
+    return {"files", "bytes", "archive_bytes", "seconds", "bytes_per_second"}, bytes are uncompressed
+    """
+    if compression not in ARCHIVE_COMPRESSIONS:
+        raise ValueError(f"compression must be one of {ARCHIVE_COMPRESSIONS}")
+    stats = {"files": 0, "bytes": 0, "archive_bytes": 0, "seconds": 0.0, "bytes_per_second": 0.0}
+    started = time.perf_counter()
+
+    def count(member):
+        if member.isfile():
+            stats["files"] += 1
+            stats["bytes"] += member.size
+        return member
+
+    def write(fileobj):
+        with _compressing(fileobj, compression, level, threads) as stream:
+            with tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT, bufsize=COPY_BUFFER) as tar:
+                for path in paths:
+                    path = os.path.abspath(path)
+                    tar.add(path, arcname=os.path.splitdrive(path)[1].lstrip("\\/"), filter=count)
+
+    if hasattr(archive, "write"):
+        write(archive)
+    else:
+        tmp = os.fspath(archive) + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, archive)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        stats["archive_bytes"] = os.path.getsize(archive)
+    stats["seconds"] = time.perf_counter() - started
+    if stats["seconds"]:
+        stats["bytes_per_second"] = stats["bytes"] / stats["seconds"]
+    logger.info(
+        f"Archived {stats['files']} files, {stats['bytes']} bytes in {stats['seconds']:.2f}s "
+        f"({stats['bytes_per_second'] / 1e6:.1f} MB/s)"
+    )
+    return stats
+
+
+def extract_archive(archive, paths=None, dest="/", filter="fully_trusted"):
+    """
+    Stream an archive of write_archive() back, extracting only the members under paths (all when None).
+    The archive is read once front to back, members not asked for are skipped without being written.
+    archive: file path or a readable binary file object; the compression is recognised from its content
+    dest: folder the absolute paths are restored under, "/" puts them back where they came from
+    filter: tarfile extraction filter, where tarfile has them. "fully_trusted" restores modes (setuid,
+            sticky, group write) and owners as archived, right for our own backups; "tar" or "data"
+            for archives from elsewhere, no member can then escape dest through ".." or links
+    return {"files", "bytes"} extracted
+    """
+    wanted = None if paths is None else [os.path.abspath(p) for p in paths]
+    stats = {"files": 0, "bytes": 0}
+    options = {"filter": filter} if hasattr(tarfile, "tar_filter") else {}
+    dirs = []
+
+    def extract(fileobj):
+        stream = _decompressing(fileobj)
+        with tarfile.open(fileobj=stream, mode="r|", bufsize=COPY_BUFFER) as tar:
+            for member in tar:
+                path = "/" + member.name
+                if wanted is not None and not any(os.path.commonpath([path, p]) == p for p in wanted):
+                    continue
+                tar.extract(member, dest, **options)
+                if member.isdir():
+                    dirs.append(member)
+                elif member.isfile():
+                    stats["files"] += 1
+                    stats["bytes"] += member.size
+        # files written into a folder changed its mtime after the folder was extracted
+        for member in reversed(dirs):
+            os.utime(os.path.join(dest, member.name), (member.mtime, member.mtime))
+
+    if hasattr(archive, "read"):
+        extract(archive)
+    else:
+        with open(archive, "rb") as f:
+            extract(f)
+    return stats
@@ -1,11 +1,38 @@
 #!/usr/bin/env python3
 
 # contains class Backup class which can backup files or folders and restore them to original path
+import json
 import os
+import re
 import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+from qutil.filesystem.archive import ARCHIVE_SUFFIX, extract_archive, write_archive
+from qutil.filesystem.copier import CopyPipeline, copy_file
+from qutil.filesystem.store import BlobStore, file_sha256
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# snapshot folders are named <YYYYmmdd_HHMMSS>, <YYYYmmdd_HHMMSS>_1, ... for more within one second
+SNAPSHOT_RE = re.compile(r"^(\d{8}_\d{6})(?:_(\d+))?$")
+# how an unchanged file is taken over from the previous snapshot
+LINK_MODES = ("hardlink", "reflink", "copy")
+# ioctl cloning a whole file on filesystems sharing extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+# one JSON object per backed up file, at the root of the backup (or of each snapshot)
+MANIFEST_NAME = ".qutil-backup-manifest.jsonl"
+# folder of the content addressed store under backup_path (dedup=True)
+BLOBS_DIR = "blobs"
+# copies only get the owner of their source when running as root, like rsync -o
+KEEP_OWNER = hasattr(os, "geteuid") and os.geteuid() == 0
+
 
 def is_child(child_path, parent_path):
     child = Path(child_path).resolve()
@@ -17,74 +44,566 @@ def is_child(child_path, parent_path):
         return False
 
 
+def reflink(src, dst):
+    """
+    Clone src into dst sharing its data blocks, raise OSError where the filesystem cannot.
+    """
+    if fcntl is None:
+        raise OSError("reflink is not supported on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _unchanged(st, other):
+    # copy2 keeps mtime to the nanosecond, so equal size and mtime means the same content was copied;
+    # a link shares mode and owner too, a chmod or chown alone needs a new copy (like rsync --link-dest)
+    if other is None:
+        return False
+    if (st.st_size, st.st_mtime_ns, st.st_mode) != (other.st_size, other.st_mtime_ns, other.st_mode):
+        return False
+    return not KEEP_OWNER or (st.st_uid, st.st_gid) == (other.st_uid, other.st_gid)
+
+
+def _lstat(path):
+    try:
+        return os.lstat(path)
+    except OSError:
+        return None
+
+
+def read_manifest(root):
+    """
+    {source path: entry} of the manifest at root, None when there is none
+    entry: {"path", "size", "mtime_ns", "mode", "sha256"}, symlinks have "link" and no sha256
+    """
+    try:
+        with open(os.path.join(root, MANIFEST_NAME), encoding="utf-8") as f:
+            return {entry["path"]: entry for entry in map(json.loads, f)}
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for key in sorted(manifest):
+            f.write(json.dumps(manifest[key], ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def _set_metadata(path, entry):
+    os.chmod(path, stat.S_IMODE(entry["mode"]))
+    os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+
+def _under(path, top):
+    return path == top or path.startswith(top.rstrip("/") + "/")
+
+
 class Backup:
-    def __init__(self, backup_path):
+    """
+    Backup files or folders under backup_path, mirroring their absolute path, and restore them.
+    Usage example:
+        b = Backup("/backups/etc", incremental=True)
+        b.backup(["/etc/nginx", "/etc/hosts"])   # new snapshot /backups/etc/<YYYYmmdd_HHMMSS>/etc/...
+        b.restore("/etc/hosts")                  # from the latest snapshot
+        b.restore(None, snapshot="20250101_020000")  # everything of an older snapshot
+    incremental:False, a single copy directly under backup_path, overwritten by every backup
+    incremental:True,  every backup() makes a timestamped snapshot folder; files unchanged since the
+                       previous snapshot (same size, mtime, mode and owner) are hard-linked
+                       (link="hardlink") or reflinked (link="reflink", copied where unsupported)
+                       instead of copied; as root, copies keep the owner of their source
+    jobs: files copied (and hashed by restore/verify) at the same time, see copier.CopyPipeline; more
+          than 1 pays off where per-file latency dominates (network mounts), on a local disk one copy
+          thread was faster; stats holds the figures of the last backup() or restore() call
+    Every backup writes a manifest (path, size, mtime, mode, sha256 of each file) next to the copies:
+    restore() then only copies files that differ from the live system (plan_restore() shows which),
+    and verify() checks the copies against it without needing the source.
+    dedup:True, no copy tree: file bodies go once by sha256 into the BlobStore backup_path/blobs
+                (compression None, "gzip" or "zstd"), every backup or snapshot is only its manifest.
+                Files unchanged since the previous manifest are not even read. Backups of many similar
+                hosts can share one backup_path; gc() removes blobs no manifest refers to any more.
+                Folders are not recorded, empty ones are not restored.
+    backup_archive()/restore_archive() stream into and out of a single compressed tar instead, eg: to
+    ship a backup off-host, without a copy tree on disk.
+    """
+
+    def __init__(self, backup_path, incremental=False, link="hardlink", jobs=1, dedup=False, compression=None):
+        if link not in LINK_MODES:
+            raise ValueError(f"link must be one of {LINK_MODES}")
         self.backup_path = backup_path
+        self.incremental = incremental
+        self.link = link
+        self.jobs = jobs
+        self.stats = None
+        self.store = BlobStore(os.path.join(backup_path, BLOBS_DIR), compression) if dedup else None
+        # snapshot being written and copy pipeline used by the running backup()/restore() call
+        self._snapshot = None
+        self._pipeline = None
+        # manifest being written by the running backup() call and the one before it
+        self._manifest = None
+        self._prev_manifest = None
+
+    # snapshots
+    def list_snapshots(self):
+        """
+        names of the snapshot folders, oldest first
+        """
+        if not os.path.isdir(self.backup_path):
+            return []
+        matches = filter(None, (SNAPSHOT_RE.match(name) for name in os.listdir(self.backup_path)))
+        return [m.group(0) for m in sorted(matches, key=lambda m: (m.group(1), int(m.group(2) or 0)))]
+
+    def latest_snapshot(self):
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def _new_snapshot(self):
+        # create the folder of a new snapshot, never one an earlier backup() of the same second made
+        os.makedirs(self.backup_path, exist_ok=True)
+        name = stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        count = 0
+        while True:
+            try:
+                os.mkdir(os.path.join(self.backup_path, name))
+                return name
+            except FileExistsError:
+                count += 1
+                name = f"{stamp}_{count}"
+
+    def _write_root(self):
+        # folder a backup writes into: only the snapshot made by the running call, finished snapshots
+        # share their inodes with later ones and are never written to again
+        if not self.incremental:
+            return self.backup_path
+        if self._snapshot is None:
+            raise RuntimeError("incremental backups write into a new snapshot only")
+        return os.path.join(self.backup_path, self._snapshot)
+
+    def _root(self, snapshot=None):
+        # folder that mirrors "/" for a snapshot (latest by default), or backup_path itself, to read from
+        if not self.incremental:
+            return self.backup_path
+        snapshot = snapshot or self._snapshot or self.latest_snapshot()
+        if snapshot is None:
+            raise FileNotFoundError(f"No snapshot under '{self.backup_path}'.")
+        return os.path.join(self.backup_path, snapshot)
+
+    @staticmethod
+    def _dest_path(root, src_path):
+        # treat root as the new root of src_path, eg: /home/service/a.txt ==> root/home/service/a.txt
+        return os.path.join(root, os.path.splitdrive(src_path)[1].lstrip("\\/"))
+
+    # copying
+    def _take_file(self, src, dst, prev=None):
+        # copy one file (or symlink) to dst, or link it from prev when prev holds the same content
+        # return the bytes copied
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if prev is not None and self.link != "copy" and not os.path.islink(src):
+            if _unchanged(os.lstat(src), _lstat(prev)):
+                try:
+                    if self.link == "hardlink":
+                        os.link(prev, dst)
+                    else:
+                        reflink(prev, dst)
+                    return 0
+                except OSError:
+                    pass  # other filesystem, no reflink support, link count limit: copy instead
+        copied = copy_file(src, dst)
+        if KEEP_OWNER:
+            # chown clears setuid/setgid, the mode goes back on after it
+            st = os.lstat(src)
+            os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+            if not stat.S_ISLNK(st.st_mode):
+                os.chmod(dst, stat.S_IMODE(st.st_mode))
+        return copied
+
+    @contextmanager
+    def _snapshotting(self):
+        # incremental: one new snapshot for a whole backup() call, nested backup_one() calls write into it
+        if not self.incremental or self._snapshot is not None:
+            yield self._snapshot
+            return
+        self._snapshot = self._new_snapshot()
+        try:
+            yield self._snapshot
+        finally:
+            self._snapshot = None
+
+    @contextmanager
+    def _copying(self):
+        # one CopyPipeline for a whole backup()/restore() call, nested calls reuse it
+        if self._pipeline is not None:
+            yield self._pipeline
+            return
+        with CopyPipeline(jobs=self.jobs) as pipeline:
+            self._pipeline = pipeline
+            try:
+                yield pipeline
+            finally:
+                self._pipeline = None
+        self.stats = pipeline.stats
+
+    def _backup_file(self, src, dst, prev=None):
+        # _take_file plus the manifest entry of src
+        copied = self._take_file(src, dst, prev)
+        st = os.lstat(dst)
+        entry = {"path": src, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "mode": st.st_mode}
+        if stat.S_ISLNK(st.st_mode):
+            entry["link"] = os.readlink(dst)
+        else:
+            old = self._prev_manifest.get(src)
+            same = old and (old["size"], old["mtime_ns"]) == (st.st_size, st.st_mtime_ns)
+            if not copied and same and old.get("sha256"):
+                entry["sha256"] = old["sha256"]  # linked from the previous backup, nothing was read
+            else:
+                entry["sha256"] = file_sha256(dst)
+        self._manifest[src] = entry
+        return copied
+
+    def _store_file(self, src):
+        # put src into the blob store and add its manifest entry, return the bytes written to the store
+        st = os.lstat(src)
+        entry = {"path": src, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "mode": st.st_mode}
+        written = 0
+        if stat.S_ISLNK(st.st_mode):
+            entry["link"] = os.readlink(src)
+        else:
+            old = self._prev_manifest.get(src)
+            same = old and (old["size"], old["mtime_ns"]) == (st.st_size, st.st_mtime_ns)
+            if same and old.get("sha256") and self.store.has(old["sha256"]):
+                entry["sha256"] = old["sha256"]
+            else:
+                entry["sha256"], written = self.store.put(src)
+        self._manifest[src] = entry
+        return written
+
+    def _store_tree(self, src):
+        # _copy_tree for the blob store: every file and symlink under src goes to the manifest
+        with self._copying() as pipeline:
+            if not os.path.isdir(src) or os.path.islink(src):
+                pipeline.submit(self._store_file, src)
+                return
+            for root, dir_names, file_names in os.walk(src):
+                for name in dir_names + file_names:
+                    path = os.path.join(root, name)
+                    if name in file_names or os.path.islink(path):
+                        pipeline.submit(self._store_file, path)
+
+    @contextmanager
+    def _recording(self):
+        # load the manifest of the backup root, let backup_one() calls fill it, write it at the end
+        if self._manifest is not None:
+            yield
+            return
+        root = self._write_root()
+        os.makedirs(root, exist_ok=True)
+        if self.incremental:
+            previous = [s for s in self.list_snapshots() if os.path.join(self.backup_path, s) != root]
+            prev_root = os.path.join(self.backup_path, previous[-1]) if previous else None
+            self._prev_manifest = (prev_root and read_manifest(prev_root)) or {}
+            self._manifest = {}
+        else:
+            self._prev_manifest = read_manifest(root) or {}
+            self._manifest = dict(self._prev_manifest)
+        try:
+            yield
+            self._wait()
+            write_manifest(root, self._manifest)
+        finally:
+            self._manifest = self._prev_manifest = None
+
+    def _wait(self):
+        if self._pipeline is not None:
+            self._pipeline.wait()
+
+    def _copy_tree(self, src, dst, prev=None, record=False):
+        # copy src (file or folder) to dst, linking what is unchanged in prev, folder metadata last
+        # record: add the files to the manifest of the running backup
+        take = self._backup_file if record else self._take_file
+        with self._copying() as pipeline:
+            if not os.path.isdir(src) or os.path.islink(src):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                pipeline.submit(take, src, dst, prev)
+                return
+            dirs = []
+            for root, dir_names, file_names in os.walk(src):
+                rel = os.path.relpath(root, src)
+                dst_root = os.path.normpath(os.path.join(dst, rel))
+                prev_root = os.path.normpath(os.path.join(prev, rel)) if prev else None
+                os.makedirs(dst_root, exist_ok=True)
+                dirs.append((root, dst_root))
+                # os.walk lists symlinks to folders as folders without entering them, keep them as links
+                for name in dir_names + file_names:
+                    path = os.path.join(root, name)
+                    if name in file_names or os.path.islink(path):
+                        prev_path = prev_root and os.path.join(prev_root, name)
+                        pipeline.submit(take, path, os.path.join(dst_root, name), prev_path)
+            # writing the files changed the folder times
+            pipeline.wait()
+            for src_dir, dst_dir in reversed(dirs):
+                shutil.copystat(src_dir, dst_dir)
 
     def backup_one(self, src_path):
         """
         Backup a single file or folder to the destination folder.
+        incremental: called on its own it makes a new snapshot, earlier ones are never written to
         """
         src_path = os.path.abspath(src_path)
         if not os.path.exists(src_path):
             raise FileNotFoundError(f"Source path '{src_path}' does not exist.")
-        # treat the backup path as the new root of src_path
-        # eg: /home/service/a.txt ==>  dest/home/service/a.txt
-        dest_path = os.path.join(self.backup_path, src_path)
-
-        (
-            shutil.copytree(src_path, dest_path)
-            if os.path.isdir(src_path)
-            else shutil.copy2(src_path, dest_path)
-        )
+        with self._snapshotting():
+            return self._backup_one(src_path)
+
+    def _backup_one(self, src_path):
+        root = self._write_root()
+        dest_path = self._dest_path(root, src_path)
+        prev = None
+        if self.incremental and self.store is None:
+            previous = [s for s in self.list_snapshots() if os.path.join(self.backup_path, s) != root]
+            if previous:
+                prev = self._dest_path(os.path.join(self.backup_path, previous[-1]), src_path)
+        with self._copying(), self._recording():
+            # files deleted from src since the last backup must not stay in the manifest
+            for path in [path for path in self._manifest if _under(path, src_path)]:
+                del self._manifest[path]
+            if self.store is not None:
+                self._store_tree(src_path)
+            else:
+                self._copy_tree(src_path, dest_path, prev, record=True)
         return (src_path, dest_path)
 
-    def restore_one(self, r_path):
+    def _split_backup_path(self, r_path, snapshot):
+        # (root, src_path, dest_path) of r_path, which is a source path or a path inside the backup
+        backup_path = os.path.abspath(self.backup_path)
+        # not is_child(): a symlink kept in the backup must not be resolved to where it points
+        if os.path.commonpath([r_path, backup_path]) == backup_path and r_path != backup_path:
+            rel = Path(os.path.relpath(r_path, backup_path))
+            if self.incremental:
+                snapshot, rel = rel.parts[0], Path(*rel.parts[1:])
+            root = self._root(snapshot)
+            return root, str(Path("/") / rel), r_path
+        root = self._root(snapshot)
+        return root, r_path, self._dest_path(root, r_path)
+
+    def _plan(self, root, manifest, src_path):
+        # [(entry, action)] of manifest entries under src_path whose live file differs
+        # action: "copy" (content differs or missing) or "metadata" (same content, other mtime/mode)
+        plan = []
+        to_hash = []
+        for path in sorted(p for p in manifest if _under(p, src_path)):
+            entry = manifest[path]
+            live = _lstat(path)
+            if "link" in entry:
+                same = live is not None and stat.S_ISLNK(live.st_mode) and os.readlink(path) == entry["link"]
+                if not same:
+                    plan.append((entry, "copy"))
+            elif live is None or not stat.S_ISREG(live.st_mode) or live.st_size != entry["size"]:
+                plan.append((entry, "copy"))
+            elif live.st_mtime_ns == entry["mtime_ns"]:
+                if live.st_mode != entry["mode"]:
+                    plan.append((entry, "metadata"))
+            else:
+                to_hash.append(entry)
+        # same size, other mtime: only the content tells
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            for entry, sha in zip(to_hash, executor.map(lambda e: file_sha256(e["path"]), to_hash)):
+                plan.append((entry, "metadata" if sha == entry["sha256"] else "copy"))
+        return plan
+
+    def _restore_items(self, src_path, snapshot):
+        # (root, source path) of what restore(src_path, snapshot) covers
+        if src_path is None:
+            return [(self._root(snapshot), "/")]
+        items = []
+        for item in self._items(src_path):
+            root, src, _ = self._split_backup_path(os.path.abspath(item), snapshot)
+            items.append((root, src))
+        return items
+
+    def plan_restore(self, src_path=None, snapshot=None):
+        """
+        [(source path, "copy" or "metadata")] that restore() would do, from the manifest
+        """
+        plan = []
+        for root, src in self._restore_items(src_path, snapshot):
+            manifest = read_manifest(root)
+            if manifest is None:
+                raise FileNotFoundError(f"No manifest in '{root}'.")
+            plan.extend((entry["path"], action) for entry, action in self._plan(root, manifest, src))
+        return plan
+
+    def restore_one(self, r_path, snapshot=None):
         """r_path could be source path or dest path
         Restore a single file or folder from the destination folder to its original location.
+        snapshot: name of the snapshot to restore from, latest by default (incremental only)
+        With a manifest only files that differ from the live system are copied, otherwise everything.
         """
         r_path = os.path.abspath(r_path)
-        # rpath is under dest , get rid fo dest prefix to get src_path
-        if is_child(r_path, self.backup_path):
-            src_path = Path("/") / Path(r_path).relative_to(self.backup_path)
-            dest_path = r_path
-        else:
-            src_path = r_path
-            dest_path = os.path.join(self.backup_path, src_path)
-        if not os.path.exists(dest_path):
+        root, src_path, dest_path = self._split_backup_path(r_path, snapshot)
+        manifest = read_manifest(root)
+        if self.store is not None:
+            if not any(_under(path, src_path) for path in manifest or ()):
+                raise FileNotFoundError(f"'{src_path}' is not in the backup '{root}'.")
+        elif not os.path.lexists(dest_path):
             raise FileNotFoundError(f"Backup file path '{dest_path}' does not exist.")
-
-        (
-            shutil.copytree(dest_path, src_path, dirs_exist_ok=True)
-            if os.path.isdir(dest_path)
-            else shutil.copy2(dest_path, src_path)
-        )
+        if manifest is None:
+            self._copy_tree(dest_path, src_path)
+            return (dest_path, src_path)
+        with self._copying() as pipeline:
+            for entry, action in self._plan(root, manifest, src_path):
+                path = entry["path"]
+                if action == "metadata":
+                    _set_metadata(path, entry)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.store is not None:
+                    pipeline.submit(self._fetch_file, entry)
+                else:
+                    pipeline.submit(self._take_file, self._dest_path(root, path), path)
         return (dest_path, src_path)
 
+    def _fetch_file(self, entry):
+        # restore one manifest entry from the blob store, return the bytes written
+        path = entry["path"]
+        if os.path.lexists(path):
+            os.remove(path)
+        if "link" in entry:
+            os.symlink(entry["link"], path)
+            return 0
+        size = self.store.get(entry["sha256"], path)
+        _set_metadata(path, entry)
+        return size
+
+    def verify(self, snapshot=None):
+        """
+        Check every file of the backup (or snapshot) against its manifest, reading the copies in parallel.
+        return {"checked": n, "missing": [paths], "corrupt": [paths]}, paths are source paths
+        """
+        root = self._root(snapshot)
+        manifest = read_manifest(root)
+        if manifest is None:
+            raise FileNotFoundError(f"No manifest in '{root}'.")
+
+        if self.store is not None:
+            return self._verify_blobs(manifest)
+
+        def check(entry):
+            copy = self._dest_path(root, entry["path"])
+            st = _lstat(copy)
+            if st is None:
+                return "missing"
+            if "link" in entry:
+                return None if stat.S_ISLNK(st.st_mode) and os.readlink(copy) == entry["link"] else "corrupt"
+            if st.st_size != entry["size"] or file_sha256(copy) != entry["sha256"]:
+                return "corrupt"
+            return None
+
+        result = {"checked": 0, "missing": [], "corrupt": []}
+        entries = [manifest[path] for path in sorted(manifest)]
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            for entry, problem in zip(entries, executor.map(check, entries)):
+                result["checked"] += 1
+                if problem:
+                    result[problem].append(entry["path"])
+        return result
+
+    def _verify_blobs(self, manifest):
+        # each blob is read once however many files share it
+        entries = [manifest[path] for path in sorted(manifest)]
+        digests = sorted({entry["sha256"] for entry in entries if "link" not in entry})
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            problems = dict(zip(digests, executor.map(self.store.check, digests)))
+        result = {"checked": len(entries), "missing": [], "corrupt": []}
+        for entry in entries:
+            problem = "link" not in entry and problems[entry["sha256"]]
+            if problem:
+                result[problem].append(entry["path"])
+        return result
+
+    def gc(self, dry_run=False):
+        """
+        Remove the blobs of the store (dedup:True) that no manifest under backup_path refers to any more,
+        eg: after deleting old snapshot folders.
+        return {"blobs_kept", "blobs_removed", "bytes_freed"}
+        """
+        if self.store is None:
+            raise ValueError("gc() is for backups made with dedup=True")
+        referenced = set()
+        roots = [self.backup_path] + [os.path.join(self.backup_path, s) for s in self.list_snapshots()]
+        for root in roots:
+            for entry in (read_manifest(root) or {}).values():
+                if "sha256" in entry:
+                    referenced.add(entry["sha256"])
+        return self.store.gc(referenced, dry_run=dry_run)
+
+    @staticmethod
+    def _items(paths):
+        # a single path or an iterable of paths
+        if isinstance(paths, (str, bytes, os.PathLike)):
+            return [paths]
+        try:
+            return list(paths)
+        except TypeError:
+            return [paths]
+
     def backup(self, src_path):
         """
         Backup a/multiple files or folders to the destination folder.
+        incremental: all of them go into one new snapshot, whose name is returned
         """
         if src_path is None:
             raise ValueError("src_path cannot be None")
 
-        # is src_path iterable
-        try:
-            for item in src_path:
+        with self._snapshotting() as snapshot, self._copying(), self._recording():
+            for item in self._items(src_path):
                 self.backup_one(item)
-        except TypeError:
-            self.backup_one(src_path)
+        return snapshot
 
-    def restore(self, src_path):
+    def restore(self, src_path=None, snapshot=None):
         """
         Restore files or folders from the destination folder to its original location.
+        src_path None restores everything in the backup (or snapshot)
+        snapshot: name of the snapshot to restore from, latest by default (incremental only)
         """
         if src_path is None:
-            src_path = self.src_dest_map.keys()
+            root = self._root(snapshot)
+            if self.store is not None:
+                src_path = [os.sep]
+            else:
+                src_path = [os.path.join(root, name) for name in sorted(os.listdir(root)) if name != MANIFEST_NAME]
 
-        # is src_path iterable
-        try:
-            for item in src_path:
-                self.restore_one(item)
-        except TypeError:
-            self.restore_one(src_path)
+        with self._copying():
+            for item in self._items(src_path):
+                self.restore_one(item, snapshot=snapshot)
+
+    def backup_archive(self, src_path, archive=None, compression="zstd", level=3, threads=0):
+        """
+        Stream a/multiple files or folders into one compressed tar, see archive.write_archive.
+        archive: path or writable file object, backup_path/<YYYYmmdd_HHMMSS>.tar.<ext> by default
+        return the archive path (or file object)
+        """
+        if src_path is None:
+            raise ValueError("src_path cannot be None")
+        if archive is None:
+            os.makedirs(self.backup_path, exist_ok=True)
+            name = datetime.now().strftime("%Y%m%d_%H%M%S") + ARCHIVE_SUFFIX[compression]
+            archive = os.path.join(self.backup_path, name)
+        self.stats = write_archive(self._items(src_path), archive, compression, level, threads)
+        return archive
+
+    def restore_archive(self, archive, src_path=None):
+        """
+        Restore files or folders from an archive of backup_archive() to their original location.
+        src_path None restores everything in it, otherwise only the given source paths are extracted
+        """
+        paths = None if src_path is None else self._items(src_path)
+        self.stats = extract_archive(archive, paths)
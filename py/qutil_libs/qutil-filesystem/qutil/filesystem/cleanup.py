@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+
+def _disk_usage(entry):
+    # bytes the entry occupies on disk, 0 where st_blocks does not exist (Windows)
+    st = entry.stat(follow_symlinks=False)
+    return getattr(st, "st_blocks", 0) * 512
+
+
+def clean_empty(top, files=True, dirs=True, jobs=1, dry_run=False):
+    """
+    Remove empty files (size zero) and empty sub-directories under top in one bottom-up pass.
+    A directory counts as empty when everything in it is removed too, so chains of directories that
+    only hold empty files and directories go in the same run. top itself is kept.
+    Only regular files and real directories are considered, symlinks are left alone.
+    Files are unlinked on a pool of jobs threads while the walk continues; directories are removed
+    afterwards, deepest first, each depth level in parallel.
+    if dry_run:True, nothing is removed and the returned counts are what would be removed
+    return {"files_removed", "dirs_removed", "bytes_reclaimed", "errors"}
+    """
+    stats = {"files_removed": 0, "dirs_removed": 0, "bytes_reclaimed": 0, "errors": 0}
+    # depth -> [(path, bytes)] of directories that will be empty once their children are gone
+    empty_dirs = defaultdict(list)
+    # (future, bytes) of the file removals submitted during the walk
+    file_jobs = []
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+
+    def remove(func, path):
+        if dry_run:
+            return True
+        try:
+            func(path)
+            return True
+        except OSError as e:
+            logger.warning(f"Cannot remove {path}: {e}")
+            return False
+
+    def listing(path):
+        try:
+            with os.scandir(path) as it:
+                return list(it)
+        except OSError as e:
+            logger.warning(f"Cannot list {path}: {e}")
+            stats["errors"] += 1
+            return None
+
+    def plan(top):
+        # walk depth first with an explicit stack, deep trees do not hit the recursion limit
+        # frame: [DirEntry (None for top), depth, entries left, True while it can still end up empty]
+        entries = listing(top)
+        stack = [[None, 0, iter(entries), True]] if entries is not None else []
+        while stack:
+            frame = stack[-1]
+            entry = next(frame[2], None)
+            if entry is None:
+                done, depth, _, empty = stack.pop()
+                if not stack:
+                    continue
+                try:
+                    if empty and dirs:
+                        empty_dirs[depth].append((done.path, _disk_usage(done)))
+                    else:
+                        stack[-1][3] = False
+                except OSError:
+                    stack[-1][3] = False
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    children = listing(entry.path)
+                    if children is None:
+                        frame[3] = False
+                    else:
+                        stack.append([entry, frame[1] + 1, iter(children), True])
+                elif files and entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_size == 0:
+                    file_jobs.append((executor.submit(remove, os.remove, entry.path), _disk_usage(entry)))
+                else:
+                    frame[3] = False
+            except OSError:
+                frame[3] = False
+
+    with executor:
+        plan(top)
+        for future, size in file_jobs:
+            if future.result():
+                stats["files_removed"] += 1
+                stats["bytes_reclaimed"] += size
+            else:
+                stats["errors"] += 1
+        for depth in sorted(empty_dirs, reverse=True):
+            level = empty_dirs[depth]
+            removed = executor.map(lambda job: remove(os.rmdir, job[0]), level)
+            for (_, size), ok in zip(level, removed):
+                if ok:
+                    stats["dirs_removed"] += 1
+                    stats["bytes_reclaimed"] += size
+                else:
+                    stats["errors"] += 1
+    return stats
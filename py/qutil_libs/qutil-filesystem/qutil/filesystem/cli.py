@@ -2,10 +2,37 @@
 
 
 from qutil.filesystem import folder
+from qutil.filesystem.backup import Backup
 from qutil.log.log import setup_logger
 import argparse
 
 
+def run_index(args):
+    folder_instance = folder.FolderHelper(args.folder, jobs=args.jobs, index_path=args.index)
+    if args.build_index:
+        stats = folder_instance.build_index()
+        print(f"Indexed {stats['added']} entries in {stats['dirs']} folders")
+    elif args.refresh_index:
+        stats = folder_instance.refresh_index()
+        print(
+            f"Re-listed {stats['dirs_listed']} of {stats['dirs']} folders: "
+            f"{stats['added']} added, {stats['updated']} updated, {stats['removed']} removed"
+        )
+    if args.query is None:
+        return
+
+    recursive = not args.non_recursive
+    if args.query == "list":
+        for x in folder_instance.iter_sorted(recursive=recursive, dirs=args.dirs, ext=args.ext):
+            print(x)
+    elif args.query == "first":
+        for x in folder_instance.search_first_n(args.n, recursive=recursive, dirs=args.dirs, ext=args.ext):
+            print(x)
+    else:
+        for x in folder_instance.search_last_n(args.n, recursive=recursive, dirs=args.dirs, ext=args.ext):
+            print(x)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Sample CLI using qutil.filesystem"
@@ -16,9 +43,78 @@ def main():
         help="Directory path to investigate",
         
     )
+    parser.add_argument(
+        "--index",
+        default=None,
+        help="Index file of the folder, queries are answered from it",
+    )
+    parser.add_argument(
+        "--build-index", action="store_true", help="Index the folder from scratch"
+    )
+    parser.add_argument(
+        "--refresh-index",
+        action="store_true",
+        help="Update the index, only folders whose mtime changed are listed again",
+    )
+    parser.add_argument(
+        "--query",
+        choices=["list", "first", "last"],
+        default=None,
+        help="List entries in natural order, or print the first/last -n of them",
+    )
+    parser.add_argument("-n", type=int, default=1, help="Entries printed by first/last")
+    parser.add_argument("--ext", default=None, help="Only files with this extension, e.g. .rpm")
+    parser.add_argument("--dirs", action="store_true", help="Query folders instead of files")
+    parser.add_argument(
+        "--non-recursive", action="store_true", help="Only direct children of the folder"
+    )
+    parser.add_argument(
+        "--clean-empty",
+        action="store_true",
+        help="Remove empty files and folders (also folders left empty by that)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="With --clean-empty/--backup-gc, only report what would go"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker threads listing folders (parallel_scan_tree, not --query list) and removing files",
+    )
+    parser.add_argument(
+        "--backup-gc",
+        default=None,
+        metavar="BACKUP_PATH",
+        help="Remove the blobs of a dedup backup that no backup refers to any more",
+    )
     args = parser.parse_args()
 
-    folder_instance = folder.FolderHelper(args.folder)
+    if args.backup_gc:
+        stats = Backup(args.backup_gc, dedup=True).gc(dry_run=args.dry_run)
+        verb = "Would remove" if args.dry_run else "Removed"
+        print(
+            f"{verb} {stats['blobs_removed']} blobs, {stats['bytes_freed']} bytes, "
+            f"kept {stats['blobs_kept']}"
+        )
+        return
+
+    if args.clean_empty:
+        stats = folder.FolderHelper(args.folder, jobs=args.jobs).del_empty_child(
+            dry_run=args.dry_run
+        )
+        verb = "Would remove" if args.dry_run else "Removed"
+        print(
+            f"{verb} {stats['files_removed']} files and {stats['dirs_removed']} folders, "
+            f"{stats['bytes_reclaimed']} bytes, {stats['errors']} errors"
+        )
+        return
+
+    if args.index or args.query:
+        run_index(args)
+        return
+
+    folder_instance = folder.FolderHelper(args.folder, jobs=args.jobs)
 
     print("======= All files: ========")
     for x in folder_instance.list_file(
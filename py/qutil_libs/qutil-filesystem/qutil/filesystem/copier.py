@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import errno
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from loguru import logger
+
+# buffer of the read/write fallback
+COPY_BUFFER = 8 * 1024 * 1024
+# bytes asked per copy_file_range/sendfile call, the kernel moves them without a user space buffer
+ZERO_COPY_CHUNK = 1024 * 1024 * 1024
+# errors meaning "this syscall cannot copy between these two files", not a real I/O failure
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+# switched off for the whole process the first time the kernel says it does not have them
+_zero_copy = {
+    "copy_file_range": hasattr(os, "copy_file_range"),
+    "sendfile": hasattr(os, "sendfile") and os.name == "posix",
+}
+
+
+def _copy_zero(name, fsrc, fdst, size):
+    # copy size bytes with os.copy_file_range or os.sendfile, return False when not possible
+    call = getattr(os, name)
+    offset = 0
+    while offset < size:
+        try:
+            if name == "copy_file_range":
+                n = call(fsrc, fdst, min(ZERO_COPY_CHUNK, size - offset))
+            else:
+                n = call(fdst, fsrc, offset, min(ZERO_COPY_CHUNK, size - offset))
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or offset:
+                raise
+            if e.errno == errno.ENOSYS:
+                _zero_copy[name] = False
+            return False
+        if n == 0:  # file shrank while copying
+            break
+        offset += n
+    return True
+
+
+def _copy_buffered(fsrc, fdst, buffer_size=COPY_BUFFER):
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    n = fsrc.readinto(buf)
+    while n:
+        fdst.write(view[:n])
+        n = fsrc.readinto(buf)
+
+
+def copy_file(src, dst):
+    """
+    Copy the content and metadata (mode, times, flags) of src to dst and return the bytes copied.
+    The data goes through os.copy_file_range (in kernel, reflink/server-side copy where the filesystem
+    supports it), else os.sendfile, else a read/write loop with a COPY_BUFFER sized buffer.
+    A symlink src is copied as a symlink.
+    """
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return 0
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        done = False
+        for name in ("copy_file_range", "sendfile"):
+            if not done and _zero_copy[name] and size:
+                done = _copy_zero(name, fsrc.fileno(), fdst.fileno(), size)
+        if not done:
+            fsrc.seek(0)
+            _copy_buffered(fsrc, fdst)
+    shutil.copystat(src, dst)
+    return size
+
+
+class CopyPipeline(object):
+    """
+    Runs per-file copy functions on a pool of jobs threads and sums up what they did.
+    A function returns the number of bytes it copied. At most jobs * 4 are queued at a time, so
+    submitting a huge tree does not hold all of it in memory. The first error is re-raised by wait().
+    Usage example:
+        with CopyPipeline(jobs=8) as pipeline:
+            for src, dst in pairs:
+                pipeline.submit(copy_file, src, dst)
+        print(pipeline.stats)  # files, bytes, seconds, bytes_per_second
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs)
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self.pending = set()
+        self.stats = {"files": 0, "bytes": 0, "seconds": 0.0, "bytes_per_second": 0.0}
+        self.started = time.perf_counter()
+        self.error = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        if self.jobs == 1:
+            self._count(func(*args))
+            return
+        if len(self.pending) >= self.jobs * 4:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        self.pending.add(self.executor.submit(self._done, func, args))
+
+    def _done(self, func, args):
+        try:
+            copied = func(*args)
+        except Exception as e:
+            with self._lock:
+                self.error = self.error or e
+            raise
+        self._count(copied)
+
+    def _count(self, copied):
+        with self._lock:
+            self.stats["files"] += 1
+            self.stats["bytes"] += copied or 0
+
+    def _collect(self, futures):
+        for future in futures:
+            future.exception()  # kept in self.error, raised by wait()
+
+    def wait(self):
+        """
+        wait for everything submitted so far, update the throughput figures
+        """
+        done, _ = wait(self.pending)
+        self.pending = set()
+        self._collect(done)
+        self.stats["seconds"] = time.perf_counter() - self.started
+        if self.stats["seconds"]:
+            self.stats["bytes_per_second"] = self.stats["bytes"] / self.stats["seconds"]
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return self.stats
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+        logger.info(
+            f"Copied {self.stats['files']} files, {self.stats['bytes']} bytes in {self.stats['seconds']:.2f}s "
+            f"({self.stats['bytes_per_second'] / 1e6:.1f} MB/s)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown()
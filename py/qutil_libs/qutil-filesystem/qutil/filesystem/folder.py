@@ -3,41 +3,207 @@
 import re
 import os
 import shutil 
+import fnmatch
+import heapq
+from collections import deque
+from functools import cmp_to_key, lru_cache
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime  # <-- Fix: use standard datetime
 
+from loguru import logger
+
+from qutil.filesystem.cleanup import clean_empty
+
+
+_DIGITS_RE = re.compile(r"(\d+)")
+
+
+@lru_cache(maxsize=65536)
+def _natural_component_key(part):
+    # directory and file names repeat a lot across paths, so keys are cached per component
+    return tuple(
+        (0, int(chunk)) if i % 2 else (1, chunk)
+        for i, chunk in enumerate(_DIGITS_RE.split(part))
+    )
+
+
+def _with_ext(paths, ext, dirs=False):
+    # keep the files with extension ext (case-insensitive), like the ext column of FolderIndex; dirs have none
+    if ext is None:
+        return paths
+    return (path for path in paths if not dirs and os.path.splitext(path)[1].lower() == ext.lower())
+
+
+def natural_sort_key(path):
+    """
+    Key ordering paths like natural_path_compare, for sorted()/min()/heapq.
+    Numbers compare as numbers and come before text, a path sorts before the paths below it.
+    """
+    key = ()
+    for part in path.split("/"):
+        key += _natural_component_key(part)
+    return key
+
 
 def natural_path_compare(a, b):
     """
     Compare two paths using natural order (numbers as numbers, not strings).
     Returns -1 if a < b, 0 if a == b, 1 if a > b.
     """
+    ka = natural_sort_key(a)
+    kb = natural_sort_key(b)
+    if ka == kb:
+        return 0
+    return -1 if ka < kb else 1
+
+
+def _compile_globs(patterns):
+    # one regex matching any of the glob patterns, None when there are none
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+class _DirScanner(object):
+    """
+    Lists one directory at a time for scan_tree and parallel_scan_tree, applying their options.
+    """
 
-    def split_key(path):
-        # Split path into components, then split each component into digit/non-digit parts
-        parts = []
-        for part in re.split(r"[\/]", path):
-            # Split into digit and non-digit chunks
-            for chunk in re.split(r"(\d+)", part):
-                if chunk.isdigit():
-                    parts.append(int(chunk))
-                else:
-                    parts.append(chunk)
-        return parts
-
-    ka = split_key(a)
-    kb = split_key(b)
-    # Compare component-wise
-    for x, y in zip(ka, kb):
-        if x == y:
+    def __init__(self, recursive, max_depth, include, exclude, follow_symlinks):
+        self.max_depth = 1 if not recursive else max_depth
+        self.include_re = _compile_globs(include)
+        self.exclude_re = _compile_globs(exclude)
+        self.follow_symlinks = follow_symlinks
+
+    @staticmethod
+    def _matches(regex, entry, rel_path):
+        return regex.match(entry.name) is not None or regex.match(rel_path) is not None
+
+    def list(self, path, rel_dir, depth):
+        """
+        return (entries to yield, [(path, rel_dir, depth) of sub-directories to descend into])
+        """
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return [], []
+        subdirs = []
+        selected = []
+        for entry in entries:
+            rel_path = rel_dir + entry.name
+            if self.exclude_re is not None and self._matches(self.exclude_re, entry, rel_path):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir and (self.max_depth is None or depth < self.max_depth):
+                if self.follow_symlinks or not entry.is_symlink():
+                    subdirs.append((entry.path, rel_path + "/", depth + 1))
+            if self.include_re is None or self._matches(self.include_re, entry, rel_path):
+                selected.append(entry)
+        return selected, subdirs
+
+
+def scan_tree(
+    top,
+    recursive=True,
+    max_depth=None,
+    include=None,
+    exclude=None,
+    topdown=True,
+    follow_symlinks=False,
+):
+    """
+    Walk top with os.scandir and yield an os.DirEntry for every file and directory below it.
+    The DirEntry caches what the directory listing returned (type, and on some systems the stat), so
+    entry.is_dir()/entry.stat() usually cost no extra system call.
+    if recursive:False, only direct children are listed and no sub-directory is opened
+    max_depth: 1 means direct children only, None means no limit
+    include: glob(s) an entry must match to be yielded, directories are still descended into
+    exclude: glob(s) of entries to skip, an excluded directory is not descended into
+    globs are matched against the entry name and its path relative to top (with "/" separators)
+    topdown:False yields the entries of sub-directories before those of their parent, like os.walk
+    symlinks to directories are yielded but only followed with follow_symlinks:True
+    """
+    scanner = _DirScanner(recursive, max_depth, include, exclude, follow_symlinks)
+    # depth first with an explicit stack of (entries, sub-directories left), deep trees do not recurse
+    selected, subdirs = scanner.list(top, "", 1)
+    if topdown:
+        yield from selected
+    stack = [(selected, iter(subdirs))]
+    while stack:
+        sub = next(stack[-1][1], None)
+        if sub is None:
+            selected, _ = stack.pop()
+            if not topdown:
+                yield from selected
             continue
-        if type(x) == type(y):
-            return -1 if x < y else 1
-        # Numbers come before strings
-        return -1 if isinstance(x, int) else 1
-    # If all components so far are equal, shorter path is less
-    if len(ka) == len(kb):
-        return 0
-    return -1 if len(ka) < len(kb) else 1
+        selected, subdirs = scanner.list(*sub)
+        if topdown:
+            yield from selected
+        stack.append((selected, iter(subdirs)))
+
+
+def parallel_scan_tree(
+    top,
+    jobs=8,
+    ordered=True,
+    recursive=True,
+    max_depth=None,
+    include=None,
+    exclude=None,
+    follow_symlinks=False,
+):
+    """
+    Same entries as scan_tree(topdown=True), with up to jobs directories listed at the same time on a
+    thread pool. Worth it where each readdir waits on the network (CIFS, SSHFS, NFS mounts).
+    if ordered:True,  entries come in exactly the order of scan_tree, sub-directories about to be visited
+                      are listed ahead of time
+    if ordered:False, entries come as soon as their directory is listed, a parent still comes before
+                      its children
+    At most jobs * 4 listings are in flight or waiting to be consumed.
+    """
+    scanner = _DirScanner(recursive, max_depth, include, exclude, follow_symlinks)
+    max_pending = max(1, jobs) * 4
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        if ordered:
+            # depth first on the main thread, listings of the next directories on the stack are prefetched
+            stack = [(top, "", 1)]
+            pending = {}
+            while stack:
+                for sub in reversed(stack[-max_pending:]):
+                    if sub not in pending and len(pending) < max_pending:
+                        pending[sub] = executor.submit(scanner.list, *sub)
+                current = stack.pop()
+                future = pending.pop(current, None) or executor.submit(scanner.list, *current)
+                selected, subdirs = future.result()
+                yield from selected
+                stack.extend(reversed(subdirs))
+            return
+
+        waiting = deque([(top, "", 1)])
+        running = set()
+        while waiting or running:
+            while waiting and len(running) < max_pending:
+                running.add(executor.submit(scanner.list, *waiting.popleft()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                selected, subdirs = future.result()
+                yield from selected
+                waiting.extend(subdirs)
+
+
+def _is_dir(entry):
+    # same classification as os.walk: symlinks to directories count as directories
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
 
 
 class FolderHelper(object):
@@ -52,87 +218,186 @@ class FolderHelper(object):
         a_dir.list_file(recursive=False)  # similar as linux command ls but yield file path
         a_dir.list_dir(recursive=True)    # similar as linux command tree but yield sub-folder path
         a_dir.list_dir(recursive=False)   # similar as linux command ls but yield sub-folder path
+        FolderHelper("/mnt/share", jobs=16)  # list sub-directories 16 at a time, for network mounts
 
     TODO Add more functions
         del_file_by_extension(extension, recursive=True)
     """
 
-    def __init__(self, folder_path="./", topdown=True):
+    def __init__(self, folder_path="./", topdown=True, jobs=1, ordered=True, index_path=None):
         self.dir_path = folder_path
         self.topdown = topdown
+        # jobs > 1 lists directories in parallel (topdown only), see parallel_scan_tree
+        self.jobs = jobs
+        self.ordered = ordered
+        # with an index, list/search calls are answered from it as of its last refresh_index()
+        self.index_path = index_path
+
+    # Persistent index
+    def _open_index(self):
+        from qutil.filesystem.index import FolderIndex  # index.py imports this module
+
+        return FolderIndex(self.index_path, self.dir_path)
+
+    def build_index(self):
+        """
+        index the folder from scratch into index_path, return counts
+        """
+        with self._open_index() as index:
+            return index.build()
+
+    def refresh_index(self):
+        """
+        update index_path, only directories whose mtime changed are listed again, return counts
+        """
+        with self._open_index() as index:
+            return index.refresh()
+
+    def _index_ready(self):
+        # an index that was never built would answer every query with nothing: scan the folder instead
+        if not self.index_path:
+            return False
+        if os.path.exists(self.index_path):
+            with self._open_index() as index:
+                if index.is_built():
+                    return True
+        logger.warning(f"Index '{self.index_path}' was never built, scanning '{self.dir_path}' instead.")
+        return False
+
+    def _iter_indexed(self, dirs=False, recursive=True, reverse=False, ext=None):
+        with self._open_index() as index:
+            yield from index.iter_paths(dirs=dirs, recursive=recursive, ext=ext, reverse=reverse)
 
     # Generic file and dir iterators
-    def iter_files(self, recursive=True):
-        for root, _, files in os.walk(self.dir_path, topdown=self.topdown):
-            if not recursive and root != self.dir_path:
-                continue
-            for f_name in files:
-                yield os.path.join(root, f_name)
+    def iter_entries(self, recursive=True, max_depth=None, include=None, exclude=None):
+        """
+        yield os.DirEntry of files and dirs under folder, see scan_tree for the options
+        """
+        if self.jobs > 1 and self.topdown:
+            yield from parallel_scan_tree(
+                self.dir_path,
+                jobs=self.jobs,
+                ordered=self.ordered,
+                recursive=recursive,
+                max_depth=max_depth,
+                include=include,
+                exclude=exclude,
+            )
+            return
+        yield from scan_tree(
+            self.dir_path,
+            recursive=recursive,
+            max_depth=max_depth,
+            include=include,
+            exclude=exclude,
+            topdown=self.topdown,
+        )
 
-    def iter_dirs(self, recursive=True):
-        for root, dirs, _ in os.walk(self.dir_path, topdown=self.topdown):
-            if not recursive and root != self.dir_path:
-                continue
-            for d_name in dirs:
-                yield os.path.join(root, d_name)
+    def iter_file_entries(self, recursive=True, **kwargs):
+        for entry in self.iter_entries(recursive=recursive, **kwargs):
+            if not _is_dir(entry):
+                yield entry
 
-    # Internal helpers using the iterators
-    def _apply_file_action_by_condition(
-        self, action_func, condition_func, recursive=True
-    ):
-        for f_path in self.iter_files(recursive=recursive):
-            if condition_func(f_path):
-                action_func(f_path)
+    def iter_dir_entries(self, recursive=True, **kwargs):
+        for entry in self.iter_entries(recursive=recursive, **kwargs):
+            if _is_dir(entry):
+                yield entry
 
-    def _apply_dir_action_by_condition(
-        self, action_func, condition_func, recursive=True
-    ):
-        for d_path in self.iter_dirs(recursive=recursive):
-            if condition_func(d_path):
-                action_func(d_path)
+    def iter_files(self, recursive=True, **kwargs):
+        if not kwargs and self._index_ready():
+            yield from self._iter_indexed(recursive=recursive)
+            return
+        for entry in self.iter_file_entries(recursive=recursive, **kwargs):
+            yield entry.path
+
+    def iter_dirs(self, recursive=True, **kwargs):
+        if not kwargs and self._index_ready():
+            yield from self._iter_indexed(dirs=True, recursive=recursive)
+            return
+        for entry in self.iter_dir_entries(recursive=recursive, **kwargs):
+            yield entry.path
 
     # interfaces exposed
-    def del_empty_sub_dir(self):
+    def del_empty_sub_dir(self, dry_run=False):
         """
-        remove all empty sub dirs
+        remove all empty sub dirs, including dirs that only hold empty dirs
+        return counts, see cleanup.clean_empty
         """
-        self._apply_dir_action_by_condition(
-            lambda d_path: os.rmdir(d_path),  # remove dir
-            lambda d_path: len(os.listdir(d_path)) == 0,  # if has no child
-        )
+        return clean_empty(self.dir_path, files=False, jobs=self.jobs, dry_run=dry_run)
 
-    def del_empty_file(self):
+    def del_empty_file(self, dry_run=False):
         """
         remove empty file(file size is zero)
+        return counts, see cleanup.clean_empty
         """
-        self._apply_file_action_by_condition(
-            lambda f_path: os.remove(f_path),  # remove file
-            lambda f_path: os.path.getsize(f_path) == 0,  # if size is zero
-        )
+        return clean_empty(self.dir_path, dirs=False, jobs=self.jobs, dry_run=dry_run)
 
-    def del_empty_child(self):
+    def del_empty_child(self, dry_run=False):
         """
-        remove empty file or dir(file size is zero, dir has no child)
+        remove empty file or dir(file size is zero, dir has no child once empty children are removed)
+        done in a single pass, return counts, see cleanup.clean_empty
         """
-        # del all empty files firstly because it will cause some dir empty
-        self.del_empty_file()
-        self.del_empty_sub_dir()
+        return clean_empty(self.dir_path, jobs=self.jobs, dry_run=dry_run)
 
-    def list_file(self, recursive=True):
+    def list_file(self, recursive=True, **kwargs):
         """
         list files under folder
         if recursive:True,  list all files, including subdirectories' files
         if recursive:False,  only list direct child files
+        max_depth, include and exclude globs are applied during the walk, see scan_tree
         """
-        yield from self.iter_files(recursive=recursive)
+        yield from self.iter_files(recursive=recursive, **kwargs)
 
-    def list_dir(self, recursive=True):
+    def list_dir(self, recursive=True, **kwargs):
         """
         list folders
         if recursive:True,  list all folders, including subdirectories' folders
         if recursive:False,  only list direct child folders
+        max_depth, include and exclude globs are applied during the walk, see scan_tree
+        """
+        yield from self.iter_dirs(recursive=recursive, **kwargs)
+
+    def _search(self, paths, n, last, compare_func, condition_func):
+        # the n first (or last) of paths in compare_func order, through a heap of size n
+        if condition_func:
+            paths = (path for path in paths if condition_func(path))
+        key = natural_sort_key if compare_func is natural_path_compare else cmp_to_key(compare_func)
+        if last:
+            return heapq.nlargest(n, paths, key=key)
+        return heapq.nsmallest(n, paths, key=key)
+
+    def _search_indexed(self, n, last, condition_func, recursive, dirs, ext):
+        # the index already yields paths in natural order, stop at the n-th one passing condition_func
+        indexed = self._iter_indexed(dirs=dirs, recursive=recursive, reverse=last, ext=ext)
+        paths = (path for path in indexed if condition_func(path)) if condition_func else indexed
+        found = list(islice(paths, n))
+        indexed.close()
+        return found
+
+    def search_first_n(
+        self, n, compare_func=natural_path_compare, condition_func=None, recursive=True, dirs=False, ext=None
+    ):
+        """
+        search the first n files (dirs if dirs:True) under folder, first one first
+        compare_func and condition_func as in search_first_file
+        ext: only files with this extension, e.g. ".rpm", looked up in the index when there is one
+        """
+        if compare_func is natural_path_compare and self._index_ready():
+            return self._search_indexed(n, False, condition_func, recursive, dirs, ext)
+        paths = self.list_dir(recursive=recursive) if dirs else self.list_file(recursive=recursive)
+        return self._search(_with_ext(paths, ext, dirs), n, False, compare_func, condition_func)
+
+    def search_last_n(
+        self, n, compare_func=natural_path_compare, condition_func=None, recursive=True, dirs=False, ext=None
+    ):
+        """
+        search the last n files (dirs if dirs:True) under folder, last one first
+        compare_func, condition_func and ext as in search_first_n
         """
-        yield from self.iter_dirs(recursive=recursive)
+        if compare_func is natural_path_compare and self._index_ready():
+            return self._search_indexed(n, True, condition_func, recursive, dirs, ext)
+        paths = self.list_dir(recursive=recursive) if dirs else self.list_file(recursive=recursive)
+        return self._search(_with_ext(paths, ext, dirs), n, True, compare_func, condition_func)
 
     def search_first_file(
         self, compare_func=natural_path_compare, condition_func=None, recursive=True
@@ -144,13 +409,8 @@ class FolderHelper(object):
         use compare_func to determine order
         use condition_func to filter files
         """
-        first_file = None
-        for f_path in self.list_file(recursive=recursive):
-            if condition_func and not condition_func(f_path):
-                continue
-            if first_file is None or compare_func(f_path, first_file) < 0:
-                first_file = f_path
-        return first_file
+        found = self.search_first_n(1, compare_func, condition_func, recursive)
+        return found[0] if found else None
 
     def search_first_dir(
         self, compare_func=natural_path_compare, condition_func=None, recursive=True
@@ -162,13 +422,8 @@ class FolderHelper(object):
         use compare_func to determine order
         use condition_func to filter dirs
         """
-        first_dir = None
-        for d_path in self.list_dir(recursive=recursive):
-            if condition_func and not condition_func(d_path):
-                continue
-            if first_dir is None or compare_func(d_path, first_dir) < 0:
-                first_dir = d_path
-        return first_dir    
+        found = self.search_first_n(1, compare_func, condition_func, recursive, dirs=True)
+        return found[0] if found else None
 
     def search_last_file(
         self, compare_func=natural_path_compare, condition_func=None, recursive=True
@@ -180,13 +435,8 @@ class FolderHelper(object):
         use compare_func to determine order
         use condition_func to filter files
         """
-        last_file = None
-        for f_path in self.list_file(recursive=recursive):
-            if condition_func and not condition_func(f_path):
-                continue
-            if last_file is None or compare_func(f_path, last_file) > 0:
-                last_file = f_path
-        return last_file    
+        found = self.search_last_n(1, compare_func, condition_func, recursive)
+        return found[0] if found else None
 
     def search_last_dir(
         self, compare_func=natural_path_compare, condition_func=None, recursive=True
@@ -198,13 +448,37 @@ class FolderHelper(object):
         use compare_func to determine order
         use condition_func to filter dirs
         """
-        last_dir = None
-        for d_path in self.list_dir(recursive=recursive):
-            if condition_func and not condition_func(d_path):
+        found = self.search_last_n(1, compare_func, condition_func, recursive, dirs=True)
+        return found[0] if found else None
+
+    def iter_sorted(self, recursive=True, dirs=False, ext=None, **kwargs):
+        """
+        yield files (dirs if dirs:True) under folder in natural order, while walking
+        A directory's natural key is a prefix of the keys below it, so the walk pops entries and
+        directories to list from one heap and only holds the listed-but-not-yet-yielded entries.
+        max_depth, include and exclude globs as in scan_tree, ext as in search_first_n
+        """
+        if not kwargs and self._index_ready():
+            yield from self._iter_indexed(dirs=dirs, recursive=recursive, ext=ext)
+            return
+        yield from _with_ext(self._walk_sorted(recursive, dirs, **kwargs), ext, dirs)
+
+    def _walk_sorted(self, recursive, dirs, **kwargs):
+        scanner = _DirScanner(recursive, kwargs.get("max_depth"), kwargs.get("include"),
+                              kwargs.get("exclude"), kwargs.get("follow_symlinks", False))
+        # (key, path, 0: yield / 1: list, payload), (key, path, kind) is unique so payloads never compare
+        heap = [(natural_sort_key(self.dir_path), self.dir_path, 1, ("", 1))]
+        while heap:
+            _, path, kind, payload = heapq.heappop(heap)
+            if kind == 0:
+                yield path
                 continue
-            if last_dir is None or compare_func(d_path, last_dir) > 0:
-                last_dir = d_path
-        return last_dir
+            selected, subdirs = scanner.list(path, *payload)
+            for entry in selected:
+                if _is_dir(entry) == dirs:
+                    heapq.heappush(heap, (natural_sort_key(entry.path), entry.path, 0, None))
+            for sub_path, rel_dir, depth in subdirs:
+                heapq.heappush(heap, (natural_sort_key(sub_path), sub_path, 1, (rel_dir, depth)))
 
     def create_timestamp_subdir(self):
         """
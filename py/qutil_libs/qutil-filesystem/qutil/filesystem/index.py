@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+from qutil.filesystem.folder import _natural_component_key
+
+
+def natural_key_bytes(rel_path):
+    """
+    natural_sort_key of rel_path encoded so that comparing the bytes (SQLite BLOB order, memcmp)
+    gives the same order as comparing the keys.
+    numbers: 0x01, byte length, big-endian value; text: 0x02, utf-8 with 0x00 escaped, 0x00 0x00
+    byte length: one byte below 255, else 0xff and 4 bytes, so longer numbers still sort after shorter ones
+    """
+    out = bytearray()
+    for part in rel_path.split("/"):
+        for kind, value in _natural_component_key(part):
+            if kind == 0:
+                raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+                out.append(0x01)
+                out += bytes([len(raw)]) if len(raw) < 0xFF else b"\xff" + len(raw).to_bytes(4, "big")
+                out += raw
+            else:
+                out.append(0x02)
+                out += value.encode("utf-8", "surrogatepass").replace(b"\x00", b"\x00\xff")
+                out += b"\x00\x00"
+    return bytes(out)
+
+
+class FolderIndex(object):
+    """
+    Persistent index of the files and dirs under one folder, kept in SQLite: path, size, mtime,
+    extension and natural-sort key of every entry, plus the mtime of every directory.
+    refresh() only re-lists directories whose mtime changed since the last refresh, then list and
+    search queries are answered from the database without touching the folder.
+    Usage example:
+        with FolderIndex("repo.idx", "/repo") as index:
+            index.refresh()
+            newest_rpm = next(index.iter_paths(ext=".rpm", reverse=True), None)
+    """
+
+    def __init__(self, db_path, root):
+        self.db_path = db_path
+        self.root = root
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY, dir TEXT, is_dir INTEGER, size INTEGER, mtime_ns INTEGER,
+                ext TEXT, nkey BLOB);
+            CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir);
+            CREATE INDEX IF NOT EXISTS entries_nkey ON entries (is_dir, nkey);
+            CREATE INDEX IF NOT EXISTS entries_ext ON entries (is_dir, ext, nkey);
+            """
+        )
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+        root_key = os.path.abspath(root)
+        if row is not None and row[0] != root_key:
+            raise ValueError(f"{db_path} indexes {row[0]}, not {root_key}")
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (root_key,))
+
+    def build(self):
+        """
+        index the folder from scratch
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM dirs")
+        return self.refresh()
+
+    def refresh(self):
+        """
+        bring the index up to date, return counts of what was looked at and changed
+        """
+        stats = {"dirs": 0, "dirs_listed": 0, "added": 0, "updated": 0, "removed": 0}
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                self._remove_dir(rel_dir, stats)
+                continue
+            stats["dirs"] += 1
+            known = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (rel_dir,)).fetchone()
+            if known is not None and known[0] == mtime_ns:
+                # no entry was added, removed or renamed here
+                stack.extend(p for (p,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (rel_dir,)))
+                continue
+            stats["dirs_listed"] += 1
+            stack.extend(self._relist(abs_dir, rel_dir, mtime_ns, stats))
+        return stats
+
+    def _relist(self, abs_dir, rel_dir, mtime_ns, stats):
+        # replace the rows of one directory's children, return the sub-directories to visit
+        try:
+            with os.scandir(abs_dir) as it:
+                entries = list(it)
+        except OSError:
+            entries = []
+        old = {
+            path: (size, mtime)
+            for path, size, mtime in self.conn.execute(
+                "SELECT path, size, mtime_ns FROM entries WHERE dir = ?", (rel_dir,)
+            )
+        }
+        rows = []
+        subdirs = []
+        for entry in entries:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+            except OSError:
+                continue
+            size = 0 if is_dir else st.st_size
+            if is_dir and not entry.is_symlink():
+                subdirs.append(rel)
+            previous = old.pop(rel, None)
+            if previous == (size, st.st_mtime_ns):
+                continue
+            stats["added" if previous is None else "updated"] += 1
+            ext = "" if is_dir else os.path.splitext(entry.name)[1].lower()
+            rows.append((rel, rel_dir, int(is_dir), size, st.st_mtime_ns, ext, natural_key_bytes(rel)))
+        for gone in old:
+            self._remove_dir(gone, stats)
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                (rel_dir, os.path.dirname(rel_dir) if rel_dir else None, mtime_ns),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO dirs VALUES (?, ?, NULL)", ((sub, rel_dir) for sub in subdirs)
+            )
+        return subdirs
+
+    def _remove_dir(self, rel, stats):
+        # drop an entry that vanished and, if it was a directory, everything indexed below it
+        pattern = rel.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"
+        with self.conn:
+            cur = self.conn.execute(
+                "DELETE FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'", (rel, pattern)
+            )
+            stats["removed"] += cur.rowcount
+            self.conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (rel, pattern))
+
+    def is_built(self):
+        """
+        True once build() or refresh() has indexed the folder
+        """
+        row = self.conn.execute("SELECT 1 FROM dirs WHERE path = '' AND mtime_ns IS NOT NULL").fetchone()
+        return row is not None
+
+    def iter_paths(self, dirs=False, recursive=True, ext=None, reverse=False):
+        """
+        yield indexed file paths (dir paths if dirs:True) joined to the root, in natural order
+        if recursive:False,  only direct children
+        ext: only files with this extension, e.g. ".rpm"
+        reverse:True yields the last path first
+        """
+        query = "SELECT path FROM entries WHERE is_dir = ?"
+        params = [int(dirs)]
+        if not recursive:
+            query += " AND dir = ''"
+        if ext is not None:
+            query += " AND ext = ?"
+            params.append(ext.lower())
+        order = "DESC" if reverse else "ASC"
+        query += f" ORDER BY nkey {order}, path {order}"
+        for (rel,) in self.conn.execute(query, params):
+            yield os.path.join(self.root, rel)
+
+    def __len__(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
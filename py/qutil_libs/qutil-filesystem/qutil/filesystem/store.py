@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import nullcontext
+
+from qutil.filesystem.copier import COPY_BUFFER, copy_file
+
+try:
+    import zstandard
+except ImportError:  # optional, pip install qutil-filesystem[zstd]
+    zstandard = None
+
+COMPRESSIONS = (None, "gzip", "zstd")
+# what reading a damaged blob raises
+_READ_ERRORS = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+# file name suffix of a blob by compression, a store can hold blobs written with different settings
+_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        n = f.readinto(buf)
+        while n:
+            h.update(view[:n])
+            n = f.readinto(buf)
+    return h.hexdigest()
+
+
+class BlobStore(object):
+    """
+    Content addressed file store: every file body is kept once, under the sha256 of its content,
+    in path/<first 2 hex digits>/<sha256>[.gz|.zst].
+    compression: None, "gzip" or "zstd" (needs the zstandard package) for the blobs written from now on
+    Usage example:
+        store = BlobStore("/backups/blobs", compression="zstd")
+        digest, written = store.put("/etc/hosts")   # written is 0 when the content was already there
+        store.get(digest, "/tmp/hosts")
+        store.gc(referenced={digest})               # remove every other blob
+    """
+
+    def __init__(self, path, compression=None, level=3):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("compression 'zstd' needs the zstandard package")
+        self.path = path
+        self.compression = compression
+        self.level = level
+
+    def _blob_path(self, digest, compression):
+        return os.path.join(self.path, digest[:2], digest + _SUFFIX[compression])
+
+    def find(self, digest):
+        """
+        (path, compression) of the blob of digest, None when the store does not have it
+        """
+        for compression in COMPRESSIONS:
+            path = self._blob_path(digest, compression)
+            if os.path.exists(path):
+                return path, compression
+        return None
+
+    def has(self, digest):
+        return self.find(digest) is not None
+
+    def _compressing(self, fileobj):
+        # writable stream compressing into fileobj as configured
+        if self.compression == "gzip":
+            return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).stream_writer(fileobj, closefd=False)
+        return nullcontext(fileobj)
+
+    def _write(self, src, fileobj):
+        # copy src into fileobj and return the sha256 of the bytes copied
+        h = hashlib.sha256()
+        buf = bytearray(COPY_BUFFER)
+        view = memoryview(buf)
+        with open(src, "rb") as fsrc, self._compressing(fileobj) as stream:
+            n = fsrc.readinto(buf)
+            while n:
+                h.update(view[:n])
+                stream.write(view[:n])
+                n = fsrc.readinto(buf)
+        return h.hexdigest()
+
+    def put(self, src, digest=None):
+        """
+        Store the content of file src, return (sha256, bytes written), bytes written is 0 for content
+        the store already has. digest: sha256 of src when the caller knows it already
+        The blob is named by the sha256 of the bytes it was written from: if src changes meanwhile,
+        the returned sha256 is that of the content actually stored, not digest.
+        """
+        digest = digest or file_sha256(src)
+        if self.has(digest):
+            return digest, 0
+        os.makedirs(self.path, exist_ok=True)
+        # written aside and linked, a blob under its final name is always complete
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fdst:
+                digest = self._write(src, fdst)
+            if self.has(digest):
+                return digest, 0
+            os.chmod(tmp, 0o444)
+            blob = self._blob_path(digest, self.compression)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                # unlike a rename, fails when a concurrent put() stored the same content first
+                os.link(tmp, blob)
+            except FileExistsError:
+                return digest, 0
+            except OSError:  # no hard links on this filesystem
+                os.replace(tmp, blob)
+            return digest, os.path.getsize(blob)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _open(self, digest):
+        # readable file object of the uncompressed content
+        found = self.find(digest)
+        if found is None:
+            raise FileNotFoundError(f"Blob '{digest}' is not in '{self.path}'.")
+        path, compression = found
+        if compression == "gzip":
+            return gzip.open(path, "rb")
+        if compression == "zstd":
+            if zstandard is None:
+                raise ValueError("reading zstd blobs needs the zstandard package")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return open(path, "rb")
+
+    def get(self, digest, dst):
+        """
+        Write the content of digest to the file dst (replaced if it exists), return its size.
+        """
+        found = self.find(digest)
+        if found is not None and found[1] is None:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            size = copy_file(found[0], dst)
+            os.chmod(dst, 0o644)  # blobs are read-only, the caller sets the real mode
+            return size
+        with self._open(digest) as fsrc, open(dst, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER)
+            return fdst.tell()
+
+    def check(self, digest):
+        """
+        None when the blob is there and its content still hashes to digest, else "missing" or "corrupt"
+        """
+        if not self.has(digest):
+            return "missing"
+        h = hashlib.sha256()
+        try:
+            with self._open(digest) as f:
+                for chunk in iter(lambda: f.read(COPY_BUFFER), b""):
+                    h.update(chunk)
+        except _READ_ERRORS:
+            return "corrupt"
+        return None if h.hexdigest() == digest else "corrupt"
+
+    def iter_blobs(self):
+        """
+        yield (digest, path) of every blob
+        """
+        if not os.path.isdir(self.path):
+            return
+        for prefix in sorted(os.listdir(self.path)):
+            folder = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                if not name.startswith("."):
+                    yield name.split(".", 1)[0], os.path.join(folder, name)
+
+    def gc(self, referenced, dry_run=False):
+        """
+        Remove the blobs whose digest is not in referenced (and leftovers of interrupted writes).
+        Not to be run while a backup writes to the store, its new blobs are not referenced yet.
+        if dry_run:True, nothing is removed and the returned counts are what would be removed
+        return {"blobs_kept", "blobs_removed", "bytes_freed"}
+        """
+        stats = {"blobs_kept": 0, "blobs_removed": 0, "bytes_freed": 0}
+        for digest, path in self.iter_blobs():
+            if digest in referenced:
+                stats["blobs_kept"] += 1
+                continue
+            stats["blobs_removed"] += 1
+            stats["bytes_freed"] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        if not dry_run and os.path.isdir(self.path):
+            for prefix in os.listdir(self.path):
+                folder = os.path.join(self.path, prefix)
+                if prefix.startswith(".tmp-"):
+                    os.remove(folder)
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if name.startswith(".tmp-"):
+                        os.remove(os.path.join(folder, name))
+                if not os.listdir(folder):
+                    os.rmdir(folder)
+        return stats
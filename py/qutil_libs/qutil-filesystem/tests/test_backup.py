@@ -0,0 +1,228 @@
+import io
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+import pytest
+
+from qutil.filesystem import copier
+from qutil.filesystem.archive import extract_archive, write_archive
+from qutil.filesystem.backup import Backup, read_manifest
+from qutil.filesystem.copier import CopyPipeline, copy_file
+from qutil.filesystem.store import BlobStore
+
+
+def make_tree(root, files):
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return root
+
+
+def test_backup_and_restore(tmp_path):
+    src = make_tree(tmp_path / "src", {"a.txt": b"a", "sub/b.txt": b"b"})
+    backup = Backup(str(tmp_path / "backup"))
+    backup.backup(str(src))
+    mirrored = tmp_path / "backup" / str(src).lstrip("/")
+    assert (mirrored / "sub" / "b.txt").read_bytes() == b"b"
+
+    (src / "a.txt").write_bytes(b"changed")
+    backup.restore(str(src / "a.txt"))
+    assert (src / "a.txt").read_bytes() == b"a"
+
+
+def test_incremental_snapshots(tmp_path):
+    src = make_tree(tmp_path / "src", {"same.txt": b"same", "edit.txt": b"v1"})
+    backup = Backup(str(tmp_path / "backup"), incremental=True)
+    first = backup.backup([str(src)])
+    (src / "edit.txt").write_bytes(b"v2")
+    os.utime(src / "edit.txt", ns=(0, 1_000_000_000))  # same size as v1, make sure the mtime differs too
+    second = backup.backup(str(src))
+    # snapshot names have a one second resolution, a second backup in the same one gets a suffix
+    assert second != first
+    assert backup.list_snapshots() == [first, second]
+
+    def snap_file(snapshot, name):
+        return tmp_path / "backup" / snapshot / str(src).lstrip("/") / name
+
+    assert os.path.samefile(snap_file(first, "same.txt"), snap_file(second, "same.txt"))
+    assert not os.path.samefile(snap_file(first, "edit.txt"), snap_file(second, "edit.txt"))
+
+    backup.restore(str(src / "edit.txt"), snapshot=first)
+    assert (src / "edit.txt").read_bytes() == b"v1"
+    (src / "same.txt").unlink()
+    backup.restore(None)
+    assert (src / "edit.txt").read_bytes() == b"v2"
+    assert (src / "same.txt").read_bytes() == b"same"
+
+    # a chmod alone is a change: linking the old copy would restore the old mode
+    os.chmod(src / "same.txt", 0o600)
+    third = backup.backup(str(src))
+    assert backup.list_snapshots() == [first, second, third]
+    assert not os.path.samefile(snap_file(second, "same.txt"), snap_file(third, "same.txt"))
+    assert snap_file(third, "same.txt").stat().st_mode & 0o777 == 0o600
+    assert snap_file(second, "same.txt").stat().st_mode & 0o777 != 0o600
+
+
+def test_backup_one_makes_a_snapshot(tmp_path):
+    src = make_tree(tmp_path / "src", {"a/x.txt": b"x", "y.txt": b"y"})
+    backup = Backup(str(tmp_path / "backup"), incremental=True)
+    first = backup.backup([str(src / "a"), str(src / "y.txt")])
+    (src / "y.txt").write_bytes(b"y2")
+    backup.backup_one(str(src / "y.txt"))
+    first_root = str(tmp_path / "backup" / first)
+    assert sorted(read_manifest(first_root)) == [str(src / "a" / "x.txt"), str(src / "y.txt")]
+    second = backup.latest_snapshot()
+    assert second != first
+    assert sorted(read_manifest(str(tmp_path / "backup" / second))) == [str(src / "y.txt")]
+    # a finished snapshot is history, later backups never change it
+    assert (tmp_path / "backup" / first / str(src).lstrip("/") / "y.txt").read_bytes() == b"y"
+    assert backup.verify(first)["corrupt"] == []
+
+
+def test_copy_file_fallbacks(tmp_path, monkeypatch):
+    src = tmp_path / "big.bin"
+    src.write_bytes(os.urandom(3 * 1024 * 1024))
+    os.utime(src, ns=(1_000_000_000, 2_000_000_123))
+    assert copy_file(str(src), str(tmp_path / "zero.bin")) == src.stat().st_size
+    monkeypatch.setitem(copier._zero_copy, "copy_file_range", False)
+    monkeypatch.setitem(copier._zero_copy, "sendfile", False)
+    copy_file(str(src), str(tmp_path / "buffered.bin"))
+    for name in ("zero.bin", "buffered.bin"):
+        assert (tmp_path / name).read_bytes() == src.read_bytes()
+        assert (tmp_path / name).stat().st_mtime_ns == 2_000_000_123
+
+
+def test_copy_pipeline(tmp_path):
+    files = make_tree(tmp_path / "src", {f"f{i}": b"x" * i for i in range(50)})
+    (tmp_path / "dst").mkdir()
+    with CopyPipeline(jobs=4) as pipeline:
+        for i in range(50):
+            pipeline.submit(copy_file, str(files / f"f{i}"), str(tmp_path / "dst" / f"f{i}"))
+    assert (pipeline.stats["files"], pipeline.stats["bytes"]) == (50, sum(range(50)))
+
+    with pytest.raises(FileNotFoundError):
+        with CopyPipeline(jobs=4) as pipeline:
+            pipeline.submit(copy_file, str(files / "missing"), str(tmp_path / "dst" / "missing"))
+
+
+def test_manifest_restore_plan_and_verify(tmp_path):
+    src = make_tree(tmp_path / "src", {"keep.txt": b"keep", "edit.txt": b"v1", "touch.txt": b"same"})
+    backup = Backup(str(tmp_path / "backup"), incremental=True)
+    backup.backup(str(src))
+    assert backup.verify()["checked"] == 3
+    assert backup.plan_restore() == []
+
+    (src / "edit.txt").write_bytes(b"v2")
+    os.utime(src / "touch.txt", ns=(0, 0))  # same content, other mtime
+    (src / "keep.txt").unlink()
+    plan = dict(backup.plan_restore(str(src)))
+    assert plan == {str(src / "edit.txt"): "copy", str(src / "touch.txt"): "metadata", str(src / "keep.txt"): "copy"}
+    backup.restore(None)
+    assert backup.stats["files"] == 2
+    assert (src / "edit.txt").read_bytes() == b"v1" and (src / "keep.txt").read_bytes() == b"keep"
+    assert backup.plan_restore() == []
+
+    copy = tmp_path / "backup" / backup.latest_snapshot() / str(src).lstrip("/") / "edit.txt"
+    copy.unlink()
+    copy.write_bytes(b"v9")
+    (copy.parent / "keep.txt").unlink()
+    result = backup.verify()
+    assert (result["missing"], result["corrupt"]) == ([str(src / "keep.txt")], [str(src / "edit.txt")])
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_dedup_store(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    hosts = [make_tree(tmp_path / host, {"etc/hosts": b"127.0.0.1 localhost\n" * 100, "etc/name": host.encode()})
+             for host in ("host1", "host2")]
+    (hosts[0] / "etc" / "link").symlink_to("hosts")
+    backup = Backup(str(tmp_path / "backup"), incremental=True, dedup=True, compression=compression)
+    first = backup.backup([str(h) for h in hosts])
+    assert len(list(backup.store.iter_blobs())) == 3  # one shared hosts file, two names
+    assert not (tmp_path / "backup" / first / str(hosts[0]).lstrip("/")).exists()
+    assert backup.verify() == {"checked": 5, "missing": [], "corrupt": []}
+
+    (hosts[0] / "etc" / "hosts").write_bytes(b"gone")
+    (hosts[1] / "etc" / "name").unlink()
+    (hosts[0] / "etc" / "link").unlink()
+    backup.restore(None)
+    assert (hosts[0] / "etc" / "hosts").read_bytes() == b"127.0.0.1 localhost\n" * 100
+    assert (hosts[1] / "etc" / "name").read_bytes() == b"host2"
+    assert os.readlink(hosts[0] / "etc" / "link") == "hosts"
+    assert backup.stats["files"] == 3
+
+    (hosts[1] / "etc" / "name").write_bytes(b"renamed")
+    backup.backup(str(hosts[1]))
+    assert backup.gc()["blobs_removed"] == 0
+    shutil.rmtree(tmp_path / "backup" / first)
+    stats = backup.gc()
+    assert (stats["blobs_kept"], stats["blobs_removed"]) == (2, 2)
+    assert backup.verify()["checked"] == 2
+
+
+def test_blob_store_put(tmp_path):
+    data = b"content" * 1000
+    (tmp_path / "f").write_bytes(data)
+    store = BlobStore(str(tmp_path / "blobs"), compression="gzip")
+    # src changed after the caller hashed it: the blob is named by what was stored
+    digest, written = store.put(str(tmp_path / "f"), digest=sha256(b"old").hexdigest())
+    assert digest == sha256(data).hexdigest() and written > 0
+    assert store.check(digest) is None and not store.has(sha256(b"old").hexdigest())
+
+    # the same new content put from many threads at once is written (and counted) once
+    (tmp_path / "g").write_bytes(b"other" * 1000)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: store.put(str(tmp_path / "g")), range(16)))
+    assert len({d for d, _ in results}) == 1
+    assert sum(w for _, w in results) == os.path.getsize(store.find(results[0][0])[0])
+    assert not [name for name in os.listdir(tmp_path / "blobs") if name.startswith(".tmp-")]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "xz", "zstd"])
+def test_archive_backup(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    src = make_tree(tmp_path / "src", {"a.txt": b"a" * 5000, "sub/b.txt": b"b", "other/c.txt": b"c"})
+    os.utime(src / "sub", ns=(0, 10**9))
+    backup = Backup(str(tmp_path / "backup"))
+    archive = backup.backup_archive(str(src), compression=compression)
+    assert os.listdir(tmp_path / "backup") == [os.path.basename(archive)]
+    assert (backup.stats["files"], backup.stats["bytes"]) == (3, 5002)
+
+    shutil.rmtree(src)
+    backup.restore_archive(archive, [str(src / "sub"), str(src / "a.txt")])
+    assert (src / "a.txt").read_bytes() == b"a" * 5000
+    assert (src / "sub" / "b.txt").read_bytes() == b"b"
+    assert (src / "sub").stat().st_mtime_ns == 10**9
+    assert not (src / "other").exists()
+    assert backup.stats["files"] == 2
+
+
+def test_archive_modes_and_streams(tmp_path, monkeypatch):
+    src = make_tree(tmp_path / "src", {"tool": b"#!/bin/sh\n", "shared/f": b"f"})
+    os.chmod(src / "tool", 0o4755)
+    os.chmod(src / "shared", 0o1777)
+    archive = tmp_path / "out.tar.gz"  # a Path, not a str
+    write_archive([str(src)], archive, "gzip")
+    shutil.rmtree(src)
+    extract_archive(archive)
+    assert (src / "tool").stat().st_mode & 0o7777 == 0o4755
+    assert (src / "shared").stat().st_mode & 0o7777 == 0o1777
+
+    # a pigz on PATH compresses into real files only, in-memory streams fall back to gzip
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "pigz").write_text("#!/bin/sh\nexec gzip -c\n")
+    os.chmod(bin_dir / "pigz", 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    stream = io.BytesIO()
+    write_archive([str(src / "tool")], stream, "gzip")
+    write_archive([str(src / "tool")], tmp_path / "pigz.tar.gz", "gzip")
+    for archive in (io.BytesIO(stream.getvalue()), tmp_path / "pigz.tar.gz"):
+        shutil.rmtree(src)
+        assert extract_archive(archive)["files"] == 1
+        assert (src / "tool").read_bytes() == b"#!/bin/sh\n"
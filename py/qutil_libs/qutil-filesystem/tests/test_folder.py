@@ -0,0 +1,152 @@
+import os
+import sys
+from functools import cmp_to_key
+
+from qutil.filesystem.folder import (
+    FolderHelper,
+    natural_path_compare,
+    natural_sort_key,
+    parallel_scan_tree,
+    scan_tree,
+)
+from qutil.filesystem.index import FolderIndex, natural_key_bytes
+
+
+def make_tree(root, files):
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return root
+
+
+def walk_files(root):
+    return sorted(os.path.join(r, f) for r, _, files in os.walk(root) for f in files)
+
+
+def test_iter_files_matches_os_walk(tmp_path):
+    make_tree(tmp_path, {"a.txt": b"1", "d1/b.rpm": b"2", "d1/d2/c.txt": b"", "d3/e.rpm": b"3"})
+    helper = FolderHelper(str(tmp_path))
+    assert sorted(helper.list_file()) == walk_files(tmp_path)
+    assert sorted(helper.list_file(recursive=False)) == [str(tmp_path / "a.txt")]
+    assert sorted(helper.list_dir(recursive=False)) == [str(tmp_path / "d1"), str(tmp_path / "d3")]
+    assert sorted(helper.list_dir()) == sorted(os.path.join(r, d) for r, dirs, _ in os.walk(tmp_path) for d in dirs)
+
+
+def test_scan_tree_pruning(tmp_path):
+    make_tree(tmp_path, {"a.txt": b"1", "d1/b.rpm": b"2", "d1/d2/c.txt": b"", "skip/e.rpm": b"3"})
+    names = lambda entries: sorted(entry.name for entry in entries)
+    assert names(scan_tree(str(tmp_path), max_depth=2)) == ["a.txt", "b.rpm", "d1", "d2", "e.rpm", "skip"]
+    assert names(scan_tree(str(tmp_path), include="*.rpm")) == ["b.rpm", "e.rpm"]
+    assert names(scan_tree(str(tmp_path), include="*.rpm", exclude=["skip"])) == ["b.rpm"]
+    assert names(scan_tree(str(tmp_path), exclude="d1/d2")) == ["a.txt", "b.rpm", "d1", "e.rpm", "skip"]
+
+    bottom_up = [entry.name for entry in scan_tree(str(tmp_path / "d1"), topdown=False)]
+    assert bottom_up.index("c.txt") < bottom_up.index("d2")
+
+
+def test_deep_tree(tmp_path):
+    # deeper than the recursion limit, still well under PATH_MAX
+    depth = sys.getrecursionlimit() + 100
+    deepest = str(tmp_path)
+    for _ in range(depth):  # os.makedirs recurses too
+        deepest = os.path.join(deepest, "d")
+        os.mkdir(deepest)
+    open(os.path.join(deepest, "empty"), "w").close()
+    assert len(list(scan_tree(str(tmp_path)))) == depth + 1
+    bottom_up = list(scan_tree(str(tmp_path), topdown=False))
+    assert bottom_up[0].name == "empty" and bottom_up[-1].path == str(tmp_path / "d")
+    stats = FolderHelper(str(tmp_path)).del_empty_child()
+    assert (stats["files_removed"], stats["dirs_removed"]) == (1, depth)
+    assert os.listdir(tmp_path) == []
+
+
+def test_del_empty_file(tmp_path):
+    make_tree(tmp_path, {"a.txt": b"1", "d1/empty": b"", "d1/d2/empty": b""})
+    FolderHelper(str(tmp_path)).del_empty_file()
+    assert walk_files(tmp_path) == [str(tmp_path / "a.txt")]
+
+
+def test_parallel_scan_tree(tmp_path):
+    make_tree(tmp_path, {f"d{i}/s{j}/f{k}.txt": b"x" for i in range(4) for j in range(3) for k in range(2)})
+    serial = [entry.path for entry in scan_tree(str(tmp_path))]
+    assert [entry.path for entry in parallel_scan_tree(str(tmp_path), jobs=4)] == serial
+    unordered = [entry.path for entry in parallel_scan_tree(str(tmp_path), jobs=4, ordered=False)]
+    assert sorted(unordered) == sorted(serial)
+    assert sorted(FolderHelper(str(tmp_path), jobs=4).list_file()) == walk_files(tmp_path)
+
+
+def test_natural_sort(tmp_path):
+    paths = ["b/10.rpm", "b/9.rpm", "a1", "a/b", "a10/x", "a2/y", "a02/z", "b/x.rpm"]
+    assert sorted(paths, key=natural_sort_key) == sorted(paths, key=cmp_to_key(natural_path_compare))
+    assert natural_path_compare("build_9", "build_10") == -1
+
+    make_tree(tmp_path, {p: b"x" for p in ["b/10.rpm", "b/9.rpm", "a1", "a/b", "a10/x", "a2/y", "b/x.rpm"]})
+    helper = FolderHelper(str(tmp_path))
+    ordered = sorted(helper.list_file(), key=natural_sort_key)
+    assert list(helper.iter_sorted()) == ordered
+    is_rpm = lambda f: f.endswith(".rpm")
+    assert helper.search_last_n(2, condition_func=is_rpm) == [str(tmp_path / "b/x.rpm"), str(tmp_path / "b/10.rpm")]
+    assert helper.search_first_n(3) == ordered[:3]
+    assert helper.search_last_file(condition_func=lambda f: f.endswith("0.rpm")) == str(tmp_path / "b/10.rpm")
+    assert helper.search_first_dir() == str(tmp_path / "a")
+    assert helper.search_first_file(condition_func=lambda f: False) is None
+
+
+def test_natural_key_bytes():
+    paths = ["b/10.rpm", "b/9.rpm", "a1", "a/b", "a10/x", "a2/y", "b/x.rpm", "a", "a\x00b", "1/2"]
+    # numbers of 255 bytes and more (614+ digits) do not fit a one byte length
+    paths += ["n" + "9" * 700, "n" + "1" * 2000, "n" + "8" * 615, "n" + "9" * 614 + "x"]
+    assert sorted(paths, key=natural_key_bytes) == sorted(paths, key=natural_sort_key)
+
+
+def test_folder_index(tmp_path):
+    root = make_tree(tmp_path / "repo", {"b/10.rpm": b"x", "b/9.rpm": b"x", "a/1.txt": b"x", "c.rpm": b"x"})
+    helper = FolderHelper(str(root), index_path=str(tmp_path / "repo.idx"))
+    walked = sorted(FolderHelper(str(root)).list_file(), key=natural_sort_key)
+    # not built yet: answered from the folder, not from an empty index
+    assert helper.search_first_n(2, ext=".rpm") == [str(root / "b/9.rpm"), str(root / "b/10.rpm")]
+    assert helper.build_index()["added"] == 6
+    assert list(helper.list_file()) == walked
+    assert list(helper.iter_sorted(ext=".RPM")) == [str(root / "b/9.rpm"), str(root / "b/10.rpm"), str(root / "c.rpm")]
+    assert helper.search_last_n(1, ext=".txt") == [str(root / "a/1.txt")]
+    assert helper.search_last_file(condition_func=lambda f: f.endswith(".rpm")) == str(root / "c.rpm")
+    assert helper.search_first_n(2, condition_func=lambda f: f.endswith(".rpm")) == [
+        str(root / "b/9.rpm"), str(root / "b/10.rpm")]
+    assert list(helper.list_dir(recursive=False)) == [str(root / "a"), str(root / "b")]
+
+    stats = helper.refresh_index()
+    assert (stats["dirs_listed"], stats["added"]) == (0, 0)
+
+    (root / "b" / "11.rpm").write_bytes(b"x")
+    for f in (root / "a").iterdir():
+        f.unlink()
+    (root / "a").rmdir()
+    stats = helper.refresh_index()
+    assert (stats["dirs_listed"], stats["added"], stats["removed"]) == (2, 1, 2)
+    assert helper.search_last_n(2, condition_func=lambda f: f.startswith(str(root / "b"))) == [
+        str(root / "b/11.rpm"), str(root / "b/10.rpm")]
+    with FolderIndex(str(tmp_path / "repo.idx"), str(root)) as index:
+        assert list(index.iter_paths(ext=".RPM", reverse=True))[0] == str(root / "c.rpm")
+
+
+def test_clean_empty_cascades(tmp_path):
+    make_tree(tmp_path, {"keep/a.txt": b"1", "keep/empty": b"", "x/y/z/empty": b"", "x/y/empty2": b""})
+    (tmp_path / "bare" / "deeper").mkdir(parents=True)
+    helper = FolderHelper(str(tmp_path), jobs=4)
+
+    planned = helper.del_empty_child(dry_run=True)
+    assert (planned["files_removed"], planned["dirs_removed"]) == (3, 5)
+    assert (tmp_path / "x" / "y" / "z" / "empty").exists()
+
+    assert helper.del_empty_child() == planned
+    assert sorted(os.listdir(tmp_path)) == ["keep"]
+    assert os.listdir(tmp_path / "keep") == ["a.txt"]
+
+
+def test_del_empty_sub_dir_keeps_files(tmp_path):
+    make_tree(tmp_path, {"a/empty": b""})
+    (tmp_path / "b" / "c").mkdir(parents=True)
+    stats = FolderHelper(str(tmp_path)).del_empty_sub_dir()
+    assert stats["dirs_removed"] == 2
+    assert sorted(os.listdir(tmp_path)) == ["a"]
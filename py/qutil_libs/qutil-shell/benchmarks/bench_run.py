@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Per call overhead of qutil.shell.local.run through invoke (shell, with and without pty) against
+the direct run_argv path (no shell, no pty), on a command that does nothing.
+
+    python benchmarks/bench_run.py --calls 500
+    python benchmarks/bench_run.py --calls 200 --command "echo hello"
+"""
+
+import argparse
+import shlex
+import time
+
+from loguru import logger
+
+from qutil.shell.local import run, run_argv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500, help="calls per variant")
+    parser.add_argument("--command", default="true", help="command run by every call")
+    args = parser.parse_args()
+    logger.remove()  # the debug line of every call would be measured too
+
+    argv = shlex.split(args.command)
+    variants = (
+        ("invoke pty=True", lambda: run(args.command, pty=True, direct=False)),
+        ("invoke pty=False", lambda: run(args.command, pty=False, direct=False)),
+        ("run() pty=False", lambda: run(args.command, pty=False)),
+        ("run_argv", lambda: run_argv(argv)),
+    )
+    baseline = None
+    for name, call in variants:
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            call()
+        per_call = (time.perf_counter() - started) / args.calls * 1000
+        baseline = baseline or per_call
+        print(f"{name:18} {per_call:8.2f} ms/call {baseline / per_call:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
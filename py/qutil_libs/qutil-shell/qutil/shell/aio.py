@@ -0,0 +1,195 @@
+import asyncio
+import codecs
+import inspect
+import os
+import re
+import shlex
+import signal
+
+import invoke
+from invoke.exceptions import CommandTimedOut
+from loguru import logger
+
+from qutil.shell.local import READ_SIZE, SHELL, as_argv
+
+
+class _Output:
+    """
+    One output stream of a command: collects it, splits it into lines for
+    on_line and answers the responses patterns the way invoke's Responder
+    does (each match answered once, searching only what came after it).
+    """
+
+    def __init__(self, name, on_line, responses, stdin):
+        self.name = name
+        self.on_line = on_line
+        self.responses = responses
+        self.stdin = stdin
+        self.text = []
+        self.seen = ""  # text since the last match, searched for prompts
+        self.partial = ""  # last line, not ended yet
+        # a character can be split across two reads
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    async def feed(self, data, final=False):
+        text = self.decoder.decode(data, final)
+        if not text:
+            return
+        self.text.append(text)
+        if self.on_line:
+            lines = (self.partial + text).split("\n")
+            self.partial = lines.pop()
+            for line in lines:
+                await _call(self.on_line, self.name, line.rstrip("\r"))
+        if self.responses:
+            self.seen += text
+            for pattern, response in self.responses.items():
+                matches = list(pattern.finditer(self.seen))
+                if not matches:
+                    continue
+                self.seen = self.seen[matches[-1].end():]
+                for _ in matches:
+                    self.stdin.write(response.encode())
+                await self.stdin.drain()
+            self.seen = self.seen[-READ_SIZE:]  # a prompt is not that long
+
+    async def close(self):
+        await self.feed(b"", final=True)
+        if self.on_line and self.partial:
+            await _call(self.on_line, self.name, self.partial.rstrip("\r"))
+            self.partial = ""
+
+    def value(self):
+        return "".join(self.text)
+
+
+async def _call(callback, *args):
+    ret = callback(*args)
+    if inspect.isawaitable(ret):
+        await ret
+
+
+async def _pump(stream, output):
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            break
+        await output.feed(data)
+    await output.close()
+
+
+def _kill(process):
+    # the command runs in its own session, kill it with everything it started
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def arun(command,
+    responses: dict = None,
+    warn=False,
+    return_as_str=False,
+    environment: dict = None,
+    timeout: float = None,
+    on_line=None) -> str | dict:
+    """
+    asyncio counterpart of local.run, built on asyncio.create_subprocess_exec.
+    A command that needs no shell (see local.as_argv) is executed directly,
+    otherwise through bash -c. No pty: stdout and stderr stay apart.
+
+    Parameters:
+    command (str|list): The shell command to run, or an argv list.
+    responses (dict): Dict where keys are regex patterns and values are responses
+        written to stdin when the pattern shows up in stdout or stderr.
+    warn (bool): If True, does not raise on non-zero exit codes or timeouts.
+    environment (dict): Environment variables added for the command.
+    timeout (float): Seconds after which the command (and its children) is killed.
+    on_line (callable): on_line(stream, line) for each line as it arrives,
+        stream is "stdout" or "stderr"; may be a coroutine function.
+
+    Cancelling the task kills the command.
+
+    Returns:
+    dict: { 'stdout': str, 'stderr': str, 'exit_code': int, 'timed_out': bool }
+    """
+    argv = as_argv(command)
+    if argv is None:
+        argv = [SHELL, "-c", command]
+    env = {**os.environ, **environment} if environment else None
+    logger.debug(f"Running async: {argv}")
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.PIPE if responses else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        start_new_session=True,
+    )
+    patterns = {
+        re.compile(pattern, re.S): response if response.endswith("\n") else response + "\n"
+        for pattern, response in (responses or {}).items()
+    }
+    outputs = [_Output(name, on_line, patterns, process.stdin) for name in ("stdout", "stderr")]
+
+    async def communicate():
+        await asyncio.gather(_pump(process.stdout, outputs[0]), _pump(process.stderr, outputs[1]))
+        return await process.wait()
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill(process)
+        await process.wait()
+    except BaseException:  # cancelled
+        _kill(process)
+        await process.wait()
+        raise
+    finally:
+        if process.stdin:
+            process.stdin.close()
+
+    stdout, stderr = outputs[0].value(), outputs[1].value()
+    if not warn and (timed_out or process.returncode != 0):
+        result = invoke.Result(stdout=stdout, stderr=stderr, command=shlex.join(argv),
+                               exited=process.returncode)
+        if timed_out:
+            raise CommandTimedOut(result, timeout)
+        raise invoke.UnexpectedExit(result)
+    if return_as_str:
+        return stdout + stderr
+    return {
+        "stdout": stdout,
+        "stderr": stderr,
+        "exit_code": process.returncode,
+        "timed_out": timed_out,
+    }
+
+
+async def arun_many(commands, limit: int = 8, on_line=None, **kwargs) -> list:
+    """
+    Run commands with arun, at most limit at the same time, results in order.
+    on_line(index, stream, line) gets the index of the command the line is from.
+    Other keyword arguments go to arun. Without warn, the first failure is
+    raised and the commands still running are cancelled (killed).
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def one(index, command):
+        line_callback = None
+        if on_line:
+            def line_callback(stream, line):
+                return on_line(index, stream, line)
+        async with semaphore:
+            return await arun(command, on_line=line_callback, **kwargs)
+
+    tasks = [asyncio.ensure_future(one(i, command)) for i, command in enumerate(commands)]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
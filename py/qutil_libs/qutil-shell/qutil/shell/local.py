@@ -1,6 +1,19 @@
+import codecs
 import os
+import re
+import selectors
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
 from contextlib import contextmanager
+from functools import lru_cache
 from loguru import logger
+from invoke.exceptions import CommandTimedOut
 from invoke.watchers import Responder
 import invoke
 
@@ -33,27 +46,395 @@ def cwd(path):
         os.chdir(old_cwd)
         logger.debug(f"Restored working directory to: {old_cwd}")
 
+class _SessionLocal(invoke.Local):
+    """
+    invoke runner starting a non-pty command in its own process group, so a
+    timeout kills the shell and everything it started, not only the shell
+    (whose children would keep the output pipes open until they finish).
+    """
+
+    def start(self, command, shell, env):
+        if self.using_pty:
+            return super().start(command, shell, env)
+        self.process = subprocess.Popen(
+            command,
+            shell=True,
+            executable=shell,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    def kill(self):
+        if self.using_pty:
+            return super().kill()
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+# characters that need a shell: pipes, redirections, variables, globs, ...
+_SHELL_CHARS = frozenset("|&;<>()$`\\*?[]{}~#!\n")
+# builtins and keywords acting on the shell itself: some systems ship a program of
+# the same name (eg: /usr/bin/cd, /usr/bin/umask) that cannot do what they do
+_SHELL_ONLY = frozenset(
+    "alias bg builtin cd command declare eval exec exit export fc fg getopts hash"
+    " jobs local read readonly return set shift source time times trap type"
+    " typeset ulimit umask unalias unset wait .".split()
+)
+# shell of commands that need one when not going through invoke, the one invoke.run uses
+SHELL = "/bin/bash" if os.path.exists("/bin/bash") else "/bin/sh"
+READ_SIZE = 65536
+# RunStream(lines=True): line ends, a lone \r too (progress output), and the longest line held
+_LINE_END = re.compile(r"\r\n|\r|\n")
+MAX_LINE = 64 * 1024
+
+
+@lru_cache(maxsize=256)
+def _which(program, path):
+    # shutil.which walks PATH every call, remembered per PATH value
+    return shutil.which(program, path=path)
+
+
+def _hidden(hide, stream):
+    # invoke style hide: True/"both", "out"/"stdout" or "err"/"stderr"
+    if hide in (True, "both"):
+        return True
+    return hide in (stream, "std" + stream)
+
+
+def as_argv(command):
+    """
+    argv list of a command that needs no shell, None when it does.
+    A list/tuple is taken as is; a string qualifies when it has no shell syntax
+    (pipes, redirections, variables, globs, VAR=value prefixes) and its program
+    is an executable on PATH. Builtins that also exist as programs (echo,
+    printf, test, kill, ...) then run as the program; those acting on the shell
+    itself (cd, export, umask, ulimit, time, ...) always need the shell.
+    """
+    if isinstance(command, (list, tuple)):
+        return list(command)
+    if _SHELL_CHARS.intersection(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0] or argv[0] in _SHELL_ONLY:
+        return None
+    if _which(argv[0], os.environ.get("PATH")) is None:
+        return None
+    return argv
+
+
+class OutputBuffer:
+    """
+    One output stream kept with bounded memory.
+    tail: keep only the last tail bytes (ring buffer), the rest is dropped
+    spill: past spill bytes the whole stream goes to a temp file (path, left
+           for the caller to remove), memory keeps its last spill bytes
+    neither: keep everything
+    """
+
+    def __init__(self, tail=None, spill=None):
+        self.limit = tail or spill
+        self.spill = spill
+        self.chunks = deque()
+        self.size = 0  # bytes in memory
+        self.total = 0  # bytes written
+        self.path = None
+        self._file = None
+
+    def write(self, data):
+        self.total += len(data)
+        if self.spill and self._file is None and self.total > self.spill:
+            self._file = tempfile.NamedTemporaryFile(prefix="qutil-shell-", suffix=".out", delete=False)
+            self.path = self._file.name
+            self._file.writelines(self.chunks)
+        if self._file is not None:
+            self._file.write(data)
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.limit:
+            while self.size - len(self.chunks[0]) >= self.limit:
+                self.size -= len(self.chunks.popleft())
+            excess = self.size - self.limit
+            if excess > 0:
+                self.chunks[0] = self.chunks[0][excess:]
+                self.size -= excess
+
+    @property
+    def dropped(self):
+        """bytes written but no longer in memory"""
+        return self.total - self.size
+
+    def getvalue(self):
+        return b"".join(self.chunks).decode("utf-8", "replace")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class RunStream:
+    """
+    Runs a command without pty and yields its output as it arrives, holding
+    only a bounded part of it in memory. An argv list or a command that needs
+    no shell (see as_argv) is executed directly, otherwise through bash -c.
+    Usage example:
+        with run_stream(["find", "/"]) as output:
+            for stream, line in output:     # stream is "stdout" or "stderr"
+                print(line)
+        print(output.exit_code, output.stderr)   # the last 64KB of stderr
+    lines: yield lines without their newline if True, else chunks of text;
+        a lone \r ends a line too (progress output) and a line longer than
+        MAX_LINE characters is yielded in pieces of at most that size
+    tail, spill: what output.stdout/output.stderr keep, see OutputBuffer
+    echo: {"stdout": file, "stderr": file} the output is also written to
+    Leaving the with block (or close()) before the end kills the command.
+    """
+
+    def __init__(self, command, lines=True, environment=None, timeout=None,
+                 tail=64 * 1024, spill=None, echo=None):
+        self.argv = as_argv(command) or [SHELL, "-c", command]
+        self.lines = lines
+        self.echo = echo or {}
+        self.buffers = {"stdout": OutputBuffer(tail, spill), "stderr": OutputBuffer(tail, spill)}
+        self.exit_code = None
+        self.timed_out = False
+        self.timeout = timeout
+        self._read_all = False
+        logger.debug(f"Running argv: {self.argv}")
+        env = {**os.environ, **environment} if environment else None
+        # own session: a timeout or close() kills whatever the command started too
+        self.process = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def __iter__(self):
+        selector = selectors.DefaultSelector()
+        decoders = {}
+        partial = {}
+        for name, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            selector.register(pipe, selectors.EVENT_READ, name)
+            decoders[name] = codecs.getincrementaldecoder("utf-8")("replace")
+            partial[name] = ""
+        try:
+            while selector.get_map():
+                wait = None if self.deadline is None else self.deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    self.timed_out = True
+                    self._kill()
+                    break
+                for key, _ in selector.select(wait):
+                    name = key.data
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        text = partial[name] + decoders[name].decode(b"", final=True)
+                        if self.lines and text.endswith("\r"):
+                            text = text[:-1]
+                        if text:
+                            yield name, text
+                        continue
+                    self.buffers[name].write(data)
+                    text = decoders[name].decode(data)
+                    if name in self.echo:
+                        self.echo[name].write(text)
+                        self.echo[name].flush()
+                    if not self.lines:
+                        if text:
+                            yield name, text
+                        continue
+                    text = partial[name] + text
+                    # a \r at the end may be the first half of a \r\n
+                    held = "\r" if text.endswith("\r") else ""
+                    text_lines = _LINE_END.split(text[:len(text) - len(held)])
+                    rest = text_lines.pop()
+                    for line in text_lines:
+                        yield name, line
+                    while len(rest) > MAX_LINE:
+                        yield name, rest[:MAX_LINE]
+                        rest = rest[MAX_LINE:]
+                    partial[name] = rest + held
+            self._read_all = not self.timed_out
+        finally:
+            selector.close()
+            self.close()
+
+    def _kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        """kill the command if its output was not read to the end, wait for it"""
+        if self.exit_code is None:
+            if not self._read_all and self.process.poll() is None:
+                self._kill()
+            elif self.deadline is not None:
+                # the pipes close long before the command exits when it redirects its output
+                try:
+                    self.process.wait(max(0, self.deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    self.timed_out = True
+                    self._kill()
+            self.exit_code = self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            for buffer in self.buffers.values():
+                buffer.close()
+
+    @property
+    def stdout(self):
+        return self.buffers["stdout"].getvalue()
+
+    @property
+    def stderr(self):
+        return self.buffers["stderr"].getvalue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def run_stream(command, lines=True, environment: dict = None, timeout: float = None,
+               tail=64 * 1024, spill=None, echo=None) -> RunStream:
+    """
+    Start a command and iterate over (stream, line) of its output as it
+    arrives; memory stays bounded whatever the command prints. See RunStream.
+    """
+    return RunStream(command, lines=lines, environment=environment, timeout=timeout,
+                     tail=tail, spill=spill, echo=echo)
+
+
+def run_argv(argv: list,
+    hide=True,
+    warn=False,
+    return_as_str = False,
+    environment: dict = None,
+    timeout: float = None,
+    tail: int = None,
+    spill: int = None) ->str|dict:
+    """
+    Runs a program directly, without shell and without pty: one fork/exec
+    and two pipes read by a selector, no watcher threads.
+    stdin is /dev/null. Same parameters and result as run() minus responses.
+
+    Parameters:
+    argv (list): Program and its arguments, eg: ["ls", "-l", "/tmp"].
+    hide (bool): If True, hides output during execution, else streams it.
+    warn (bool): If True, does not raise on non-zero exit codes.
+    environment (dict): Environment variables added for the command.
+    timeout (float): Seconds after which the command is killed.
+    tail (int): Keep only the last tail bytes of stdout and of stderr.
+    spill (int): Past spill bytes a stream goes to a temp file whose path is
+        in 'stdout_file'/'stderr_file'; stdout/stderr hold its last spill bytes.
+
+    Returns:
+    dict: { 'stdout': str, 'stderr': str, 'exit_code': int, 'timed_out': bool }
+    """
+    echo = {}
+    if not _hidden(hide, "out"):
+        echo["stdout"] = sys.stdout
+    if not _hidden(hide, "err"):
+        echo["stderr"] = sys.stderr
+    with RunStream(argv, lines=False, environment=environment, timeout=timeout,
+                   tail=tail, spill=spill, echo=echo) as output:
+        for _ in output:
+            pass
+    stdout, stderr = output.stdout, output.stderr
+
+    if output.timed_out and not warn:
+        raise subprocess.TimeoutExpired(argv, timeout, stdout, stderr)
+    if output.exit_code != 0 and not warn and not output.timed_out:
+        raise subprocess.CalledProcessError(output.exit_code, argv, stdout, stderr)
+    if return_as_str:
+        return stdout + stderr
+    ret = {
+        "stdout": stdout,
+        "stderr": stderr,
+        "exit_code": output.exit_code,
+        "timed_out": output.timed_out,
+    }
+    for name, buffer in output.buffers.items():
+        if buffer.path:
+            ret[name + "_file"] = buffer.path
+    return ret
+
 def run(command: str, 
     responses: dict = {}, 
     hide=True, 
     warn=False, 
     pty=True,
     return_as_str = False,
-    environment: dict = None) ->str|dict: 
+    environment: dict = None,
+    timeout: float = None,
+    direct: bool = None,
+    tail: int = None,
+    spill: int = None) ->str|dict: 
     """
     Runs a local shell command and responds to prompts using regex patterns.
+    With pty=False (or direct=True) and no responses, a command that needs no
+    shell (see as_argv) goes through run_argv: no shell, stderr kept apart
+    from stdout, stdin is /dev/null.
 
     Parameters:
-    command (str): The shell command to run.
+    command (str): The shell command to run, or an argv list.
     responses (dict): Dict where keys are regex patterns and values are responses.
     hide (bool): If True, hides output during execution.
     warn (bool): If True, does not raise on non-zero exit codes.
     environment (dict): Environment variables to set for the command.
+    timeout (float): Seconds after which the command is killed, it then counts as
+        failed (exit code -9) and raises unless warn is True.
+    pty (bool): Run the shell in a pseudo-terminal (stderr then comes on
+        stdout). run_argv never uses one, so the default keeps the shell.
+    direct (bool): None picks run_argv when possible once pty is False (or
+        tail/spill is given), False always uses the shell, True requires
+        run_argv whatever pty says.
+    tail (int), spill (int): bound the memory the output takes, see run_argv;
+        the command then always runs without invoke (bash -c when it needs a
+        shell), so not together with responses.
 
     Returns:
-    dict: { 'stdout': str, 'stderr': str, 'exit_code': int }
+    dict: { 'stdout': str, 'stderr': str, 'exit_code': int, 'timed_out': bool }
     """
 
+    if (tail or spill) and (responses or direct is False):
+        raise ValueError("tail/spill cannot be used with responses or direct=False")
+    if direct is None and pty and not (tail or spill):
+        direct = False  # the pty of the shell path stays the default
+    if direct is not False and not responses:
+        argv = as_argv(command)
+        if argv is None and (tail or spill):
+            argv = [SHELL, "-c", command]
+        if argv is not None:
+            ret = run_argv(argv, hide=hide, warn=True, environment=environment,
+                           timeout=timeout, tail=tail, spill=spill)
+            if not warn and (ret["timed_out"] or ret["exit_code"] != 0):
+                # same exceptions as the shell path
+                result = invoke.Result(stdout=ret["stdout"], stderr=ret["stderr"],
+                                       command=shlex.join(argv), exited=ret["exit_code"])
+                if ret["timed_out"]:
+                    raise CommandTimedOut(result, timeout)
+                raise invoke.UnexpectedExit(result)
+            return ret["stdout"] + ret["stderr"] if return_as_str else ret
+        if direct:
+            raise ValueError(f"Command needs a shell: {command}")
+    if not isinstance(command, str):
+        command = shlex.join(command)
+
     watchers = [
         Responder(
             pattern=pattern,
@@ -65,9 +446,21 @@ def run(command: str,
     ]
 
     logger.debug(f"Running command: {command}")
-    result = invoke.run(
-        command, watchers=watchers, hide=hide, warn=warn, pty=pty, env=environment
-    )
+    timed_out = False
+    runner = invoke.run
+    if timeout and not pty:
+        runner = _SessionLocal(context=invoke.Context()).run
+    try:
+        result = runner(
+            command, watchers=watchers, hide=hide, warn=warn, pty=pty, env=environment,
+            timeout=timeout
+        )
+    except CommandTimedOut as e:
+        if not warn:
+            raise
+        logger.debug(f"Command timed out after {timeout}s: {command}")
+        result = e.result
+        timed_out = True
 
     if return_as_str:
         return result.stdout + result.stderr
@@ -76,4 +469,5 @@ def run(command: str,
             "stdout": result.stdout,
             "stderr": result.stderr,
             "exit_code": result.exited,
+            "timed_out": timed_out,
         }
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import invoke
+import pytest
+
+from qutil.shell.aio import arun, arun_many
+
+
+def test_arun():
+    ret = asyncio.run(arun("echo hello; echo err >&2"))
+    assert (ret["stdout"], ret["stderr"], ret["exit_code"]) == ("hello\n", "err\n", 0)
+    assert asyncio.run(arun(["printf", "a"], return_as_str=True)) == "a"
+    with pytest.raises(invoke.UnexpectedExit):
+        asyncio.run(arun("exit 2"))
+
+    lines = []
+    asyncio.run(arun("printf 'one\\ntwo'", on_line=lambda stream, line: lines.append((stream, line))))
+    assert lines == [("stdout", "one"), ("stdout", "two")]
+
+    # "é" written in two halves by separate writes: decoded whole
+    ret = asyncio.run(arun("printf '\\303'; sleep 0.2; printf '\\251'"))
+    assert ret["stdout"] == "é"
+
+
+def test_arun_responses_and_timeout():
+    command = "printf 'Password: '; read p; echo got $p"
+    ret = asyncio.run(arun(command, responses={r"Password: ": "secret"}))
+    assert ret["stdout"] == "Password: got secret\n"
+
+    started = time.monotonic()
+    ret = asyncio.run(arun("sleep 5 | cat", warn=True, timeout=0.3))
+    assert ret["timed_out"] and time.monotonic() - started < 3
+
+
+def test_arun_many():
+    async def main():
+        started = time.monotonic()
+        results = await arun_many([f"sleep 0.3; echo {i}" for i in range(6)], limit=6)
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(main())
+    assert [r["stdout"].strip() for r in results] == [str(i) for i in range(6)]
+    assert elapsed < 1.5
+
+    async def cancel():
+        task = asyncio.ensure_future(arun_many(["sleep 5"] * 3))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    started = time.monotonic()
+    asyncio.run(cancel())
+    assert time.monotonic() - started < 3
@@ -24,3 +24,70 @@ def test_hello():
     ret = run("ls -lah", hide=True, warn=True)
     assert ret["exit_code"] == 0
     print(ret)
+
+
+def test_timeout():
+    ret = run("sleep 5", warn=True, pty=False, timeout=0.5)
+    assert ret["timed_out"] and ret["exit_code"] != 0
+    assert run("true", timeout=5)["timed_out"] is False
+
+
+def test_direct_path():
+    import time
+    import invoke
+    import pytest
+    from qutil.shell.local import as_argv, run_argv
+
+    assert as_argv("ls -l '/tmp dir'") == ["ls", "-l", "/tmp dir"]
+    shell_only = ("echo $HOME", "ls | wc -l", "cd /tmp", "A=1 env", "ls *.py",
+                  "umask 077", "time ls")
+    for command in shell_only:
+        assert as_argv(command) is None
+
+    ret = run_argv(["sh", "-c", "echo out; echo err >&2; exit 3"], warn=True)
+    assert (ret["stdout"], ret["stderr"], ret["exit_code"]) == ("out\n", "err\n", 3)
+    ret = run_argv(["sleep", "5"], warn=True, timeout=0.3)
+    assert ret["timed_out"]
+    # output redirected away: the pipes are closed long before the command exits
+    started = time.monotonic()
+    ret = run_argv(["sh", "-c", "exec >/dev/null 2>&1; sleep 5"], warn=True, timeout=0.3)
+    assert ret["timed_out"] and time.monotonic() - started < 3
+    assert run("echo hello", direct=True)["stdout"] == "hello\n"
+    with pytest.raises(invoke.UnexpectedExit):
+        run("false")
+    with environ({"QUTIL_TEST": "x"}):
+        assert run("printenv QUTIL_TEST", direct=True)["stdout"] == "x\n"
+    assert run(["printenv", "QUTIL_TEST"], environment={"QUTIL_TEST": "y"}, pty=False)["stdout"] == "y\n"
+    # existing calls keep the shell and its pty: stderr comes on stdout
+    ret = run("sh -c 'echo err >&2'")
+    assert ret["stdout"] == "err\r\n" and ret["stderr"] == ""
+    assert run("sh -c 'echo err >&2'", pty=False)["stderr"] == "err\n"
+
+
+def test_bounded_output():
+    import os
+    from qutil.shell.local import MAX_LINE, run_stream
+
+    with run_stream("seq 100000; echo oops >&2") as output:
+        lines = [line for stream, line in output if stream == "stdout"]
+    assert lines[0] == "1" and lines[-1] == "100000" and len(lines) == 100000
+    assert output.exit_code == 0 and output.stderr == "oops\n"
+
+    ret = run("seq 100000", tail=20)
+    assert ret["stdout"] == "99997\n99998\n99999\n100000\n"[-20:]
+    ret = run("seq 100000", spill=1000)
+    assert len(ret["stdout"]) == 1000 and ret["stdout"].endswith("100000\n")
+    with open(ret["stdout_file"]) as f:
+        assert f.read().splitlines()[-1] == "100000"
+    os.remove(ret["stdout_file"])
+
+    with run_stream(["sleep", "5"], timeout=0.3) as output:
+        list(output)
+    assert output.timed_out
+
+    # progress output ends its lines with \r only, or never ends them: memory stays bounded
+    with run_stream(["printf", "1%%\\r2%%\\r\\r\\n3%%\\r"]) as output:
+        assert [line for _, line in output] == ["1%", "2%", "", "3%"]
+    with run_stream("head -c 1000000 /dev/zero | tr '\\0' x") as output:
+        pieces = [line for _, line in output]
+    assert "".join(pieces) == "x" * 1000000 and max(map(len, pieces)) <= MAX_LINE
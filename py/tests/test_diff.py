@@ -0,0 +1,97 @@
+import io
+import os
+import sys
+import tarfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import diff  # noqa: E402
+
+
+def make_tree(root, files):
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return root
+
+
+def write_tar(folder, tar_path, compression=None, arcname="top"):
+    if compression == "zst":
+        zstandard = pytest.importorskip("zstandard")
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as tar:
+            tar.add(folder, arcname=arcname)
+        tar_path.write_bytes(zstandard.ZstdCompressor().compress(data.getvalue()))
+    else:
+        with tarfile.open(tar_path, "w:gz" if compression == "gz" else "w") as tar:
+            tar.add(folder, arcname=arcname)
+    return tar_path
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = make_tree(tmp_path / "src" / "top", {"a.txt": b"a", "sub/b.txt": b"b" * 100_000, "sub/c.txt": b""})
+    os.link(root / "a.txt", root / "sub" / "hard.txt")  # stored as a hard link member
+    (root / "sub" / "link.txt").symlink_to("b.txt")
+    (root / "sub" / "up.txt").symlink_to("../a.txt")
+    (root / "chain.txt").symlink_to("sub/link.txt")
+    (root / "broken.txt").symlink_to("missing.txt")
+    return root
+
+
+@pytest.mark.parametrize("compression", [None, "gz", "zst"])
+def test_tar_matches_directory(tmp_path, tree, compression):
+    tar_path = write_tar(tree, tmp_path / f"src.tar.{compression}", compression)
+    assert diff.is_tar_extractable(tar_path)
+    expected = diff.get_dir_file_hashes(tree.parent, ignore_top_folder=True)
+    assert sorted(expected) == [
+        "a.txt", "chain.txt", "sub/b.txt", "sub/c.txt", "sub/hard.txt", "sub/link.txt", "sub/up.txt"]
+    # links hash as their target, as after extraction
+    assert expected["chain.txt"] == expected["sub/b.txt"] and expected["sub/up.txt"] == expected["a.txt"]
+    assert diff.get_tar_file_hashes(tar_path, ignore_top_folder=True) == expected
+
+    files = []
+    hashes = diff.get_tar_file_hashes(tar_path, on_file=files.append)
+    assert hashes == {f"top/{name}": sha for name, sha in expected.items()}
+    assert set(files) == {"top/a.txt", "top/sub/b.txt", "top/sub/c.txt"}
+
+
+def test_top_folder_guess(tmp_path):
+    # the first member names a top folder, but the archive has two: read again without stripping
+    src = make_tree(tmp_path / "src", {"a/x": b"x", "b/y": b"y"})
+    tar_path = tmp_path / "two.tar"
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(src / "a", arcname="a")
+        tar.add(src / "b", arcname="b")
+    assert diff.get_tar_file_hashes(tar_path, ignore_top_folder=True) == diff.get_dir_file_hashes(
+        src, ignore_top_folder=True)
+    assert sorted(diff.get_tar_file_hashes(tar_path, ignore_top_folder=True)) == ["a/x", "b/y"]
+
+    # members without a top folder at all
+    flat = write_tar(src / "a", tmp_path / "flat.tar", arcname=".")
+    assert diff.get_tar_file_hashes(flat, ignore_top_folder=True) == {"x": diff.sha256sum(b"x")}
+
+    (tmp_path / "not.tar").write_bytes(b"not a tar")
+    assert not diff.is_tar_extractable(tmp_path / "not.tar")
+
+
+def test_hash_store(tmp_path, tree, monkeypatch):
+    monkeypatch.setattr(diff, "STORE_FLUSH_EVERY", 2)
+    store = diff.HashStore(tmp_path / "store.sqlite")
+    try:
+        write_tar(tree, tmp_path / "src.tar.gz", "gz")
+        diff.get_tar_file_hashes(tmp_path / "src.tar.gz", ignore_top_folder=True, hashes=store)
+        expected = diff.get_dir_file_hashes(tree.parent, ignore_top_folder=True)
+        assert dict(store.items()) == expected
+        assert list(store) == sorted(expected) and len(store) == len(expected)
+        assert [path for path, _ in store.digests()] == sorted(expected)
+        del store["a.txt"]
+        with pytest.raises(KeyError):
+            store["a.txt"]
+        store.clear()
+        assert len(store) == 0
+    finally:
+        store.close()